@@ -1,53 +1,49 @@
 import os
-import requests
+import places_source
+from place_record import PlaceBatch, osm_ref, place_address, place_kind
 from dotenv import load_dotenv
-from google.adk.agents import Agent
-from google.adk.tools import FunctionTool
 
 # Load .env
 load_dotenv("./.env")
 
-def search_places(lat: float, lng: float, query: str):
-    radius_deg = 0.05
-    viewbox = [lng - radius_deg, lat - radius_deg, lng + radius_deg, lat + radius_deg]
-
-    url = "https://nominatim.openstreetmap.org/search"
-    params = {
-        "q": query,
-        "format": "json",
-        "limit": 10,
-        "viewbox": ",".join(map(str, viewbox)),
-        "bounded": 1,
-        "addressdetails": 1
-    }
-
-    res = requests.get(url, params=params, headers={"User-Agent": "multi-agent-app"}).json()
-    if not res:
-        return []
+def find_places(lat: float, lng: float, query: str) -> PlaceBatch:
+    res = places_source.search(lat, lng, query, limit=10)
 
     # Return structured data
-    output = []
+    batch = PlaceBatch(zoom=15)
     for p in res:
         name = p.get("display_name", "Unknown")
-        lat_p = p.get("lat")
-        lon_p = p.get("lon")
-        link = f"https://www.openstreetmap.org/?mlat={lat_p}&mlon={lon_p}&zoom=15"
-        output.append({
-            "name": name,
-            "lat": lat_p,
-            "lng": lon_p,
-            "link": link,
-            "rating": round(4 + (0.5 * len(name) % 1), 1)  
-        })
+        try:
+            lat_p = float(p.get("lat", 0))
+            lon_p = float(p.get("lon", 0))
+        except (TypeError, ValueError):
+            continue
+        if lat_p == 0 or lon_p == 0:
+            continue
+        batch.append(name, lat_p, lon_p, round(4 + (0.5 * len(name) % 1), 1), place_address(p), place_kind(p),
+                     osm_ref(p))
+
+    return batch
 
-    return output
-
-places_tool = FunctionTool(search_places)
-
-places_agent = Agent(
-    name="places_agent",
-    model="gemini-2.5-flash",
-    description="Finds nearby places based on user location.",
-    instruction="Answer only using places_tool for nearby places queries.",
-    tools=[places_tool]
-)
+def search_places(lat: float, lng: float, query: str):
+    return find_places(lat, lng, query).to_dicts()
+
+# The ADK tool and agent are built on first access, so importing this module
+# for find_places does not load google.adk
+def __getattr__(name):
+    if name == "places_tool":
+        from google.adk.tools import FunctionTool
+        value = FunctionTool(search_places)
+    elif name == "places_agent":
+        from google.adk.agents import Agent
+        value = Agent(
+            name="places_agent",
+            model="gemini-2.5-flash",
+            description="Finds nearby places based on user location.",
+            instruction="Answer only using places_tool for nearby places queries.",
+            tools=[__getattr__("places_tool")]
+        )
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
@@ -1,22 +1,29 @@
-from google.adk.agents import Agent
-from google.adk.tools import FunctionTool
-import random
+import ranking
 
 def get_top_reviews(places):
     if not places:
         return "No places found."
 
-    sorted_places = sorted(places, key=lambda x: x["rating"], reverse=True)
-    top3 = sorted_places[:3]
+    top3 = ranking.rank_records(places, 3)
 
     return "\n".join([f"⭐ {p['rating']} — [{p['name']}]({p['link']})" for p in top3])
 
-review_tool = FunctionTool(get_top_reviews)
-
-review_agent = Agent(
-    name="review_agent",
-    model="gemini-2.5-flash",
-    description="Shows top 3 places by rating with links from a list of places.",
-    instruction="Only use review_tool to determine top 3 places.",
-    tools=[review_tool]
-)
+# The ADK tool and agent are built on first access, so importing this module
+# for get_top_reviews does not load google.adk
+def __getattr__(name):
+    if name == "review_tool":
+        from google.adk.tools import FunctionTool
+        value = FunctionTool(get_top_reviews)
+    elif name == "review_agent":
+        from google.adk.agents import Agent
+        value = Agent(
+            name="review_agent",
+            model="gemini-2.5-flash",
+            description="Shows top 3 places by rating with links from a list of places.",
+            instruction="Only use review_tool to determine top 3 places.",
+            tools=[__getattr__("review_tool")]
+        )
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
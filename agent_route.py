@@ -1,5 +1,11 @@
-from google.adk.tools import FunctionTool
-import requests
+import http_client
+import time
+import geo_distance
+import metrics
+import os
+import route_cache
+from circuit_breaker import CircuitBreaker
+from concurrent.futures import ThreadPoolExecutor, wait
 
 # Fallback Haversine distance
 from math import radians, cos, sin, asin, sqrt
@@ -12,50 +18,156 @@ def haversine(lat1, lon1, lat2, lon2):
     km = 6371*c
     return km
 
-# OTP route fetcher
-def otp_route(user_lat, user_lon, place_lat, place_lon):
-    otp_url = "http://localhost:8080/otp/routers/default/plan"
+# OTP route fetcher (OTP_URL lets tests point at otp_stub.py)
+OTP_URL = os.getenv("OTP_URL", "http://localhost:8080/otp/routers/default/plan")
+# Router info endpoint, polled while the circuit is open to detect recovery
+OTP_HEALTH_URL = os.getenv("OTP_HEALTH_URL", OTP_URL.rsplit("/plan", 1)[0])
+
+def _otp_healthy():
+    http_client.get(OTP_HEALTH_URL, timeout=2, retries=0)
+    return True
+
+# While OTP is down or timing out, skip it entirely and use the fallback
+otp_breaker = CircuitBreaker(
+    "otp",
+    failure_threshold=int(os.getenv("OTP_BREAKER_FAILURES", "3")),
+    reset_timeout_s=float(os.getenv("OTP_BREAKER_RESET_S", "30")),
+    probe=_otp_healthy,
+    probe_interval_s=float(os.getenv("OTP_PROBE_INTERVAL_S", "5")),
+)
+
+# Routes are dicts: {"mode", "distance_km", "duration_min", "legs": [{"mode", "route",
+# "distance_km", "duration_min"}], "source": "otp" or "estimate"}; format_route renders
+# one for the [TRANSPORT] section. Estimates have no legs and no duration.
+def fetch_itinerary(user_lat, user_lon, place_lat, place_lon):
+    """Route dict from OTP; raises if OTP is unavailable or finds no itinerary."""
     params = {
         "fromPlace": f"{user_lat},{user_lon}",
         "toPlace": f"{place_lat},{place_lon}",
         "mode": "TRANSIT,WALK",
         "numItineraries": 1
     }
+    # No retries: a slow OTP should fall back to haversine, not wait longer.
+    # Only transport/HTTP errors trip the breaker; "no itinerary" means OTP is healthy.
+    res = otp_breaker.call(http_client.get_json, OTP_URL, params=params, timeout=5, retries=0)
+    itinerary = res["plan"]["itineraries"][0]
+    legs = [{
+        "mode": leg["mode"].lower(),
+        "route": leg.get("route") or None,
+        "distance_km": round(leg["distance"] / 1000, 3),
+        "duration_min": round(leg["duration"] / 60, 1) if "duration" in leg else None,
+    } for leg in itinerary["legs"]]
+    return {
+        "mode": "walk" if all(leg["mode"] == "walk" for leg in legs) else "transit",
+        "distance_km": round(sum(leg["distance_km"] for leg in legs), 3),
+        "duration_min": round(itinerary["duration"] / 60, 1) if "duration" in itinerary else None,
+        "legs": legs,
+        "source": "otp",
+    }
+
+def otp_route(user_lat, user_lon, place_lat, place_lon, dist_km=None):
     try:
-        res = requests.get(otp_url, params=params, timeout=5).json()
-        legs = res["plan"]["itineraries"][0]["legs"]
-        steps = []
-        for leg in legs:
-            mode = leg["mode"]
-            dist_km = leg["distance"]/1000
-            if mode == "BUS":
-                steps.append(f"🚌 {leg['route']} {dist_km:.1f} km")
-            elif mode == "RAIL":
-                steps.append(f"🚇 {leg['route']} {dist_km:.1f} km")
-            elif mode == "WALK":
-                steps.append(f"🚶 {dist_km:.1f} km")
-        return " → ".join(steps)
+        return route_cache.cache.get_or_fetch(user_lat, user_lon, place_lat, place_lon, fetch_itinerary)
     except Exception:
         # OTP failed → fallback
+        return fallback_route(user_lat, user_lon, place_lat, place_lon, dist_km)
+
+# Distance-based suggestion when OTP is unavailable or too slow.
+# `dist_km` can be passed in when it was already computed in a batch.
+def fallback_route(user_lat, user_lon, place_lat, place_lon, dist_km=None):
+    if dist_km is None:
         dist_km = haversine(user_lat, user_lon, place_lat, place_lon)
-        if dist_km <= 0.5:
-            return f"\n**🚶 {dist_km:.1f} km — Walking.**"
-        elif dist_km <= 2:
-            return f"\n**🛵 {dist_km:.1f} km — Auto/taxi recommended.**"
+    if dist_km <= 0.5:
+        mode = "walk"
+    elif dist_km <= 2:
+        mode = "taxi"
+    else:
+        mode = "metro"
+    return {"mode": mode, "distance_km": round(dist_km, 3), "duration_min": None, "legs": [], "source": "estimate"}
+
+_LEG_ICONS = {"bus": "🚌", "rail": "🚇"}
+_ESTIMATE_TEXT = {"walk": ("🚶", "Walking"), "taxi": ("🛵", "Auto/taxi recommended"),
+                  "metro": ("🚇", "Metro recommended")}
+
+def format_route(route):
+    """Markdown for a route dict, as shown in the [TRANSPORT] section."""
+    if route["source"] == "estimate":
+        icon, advice = _ESTIMATE_TEXT[route["mode"]]
+        return f"\n**{icon} {route['distance_km']:.1f} km — {advice}.**"
+    steps = []
+    for leg in route["legs"]:
+        if leg["mode"] in _LEG_ICONS:
+            steps.append(f"{_LEG_ICONS[leg['mode']]} {leg['route']} {leg['distance_km']:.1f} km")
+        elif leg["mode"] == "walk":
+            steps.append(f"🚶 {leg['distance_km']:.1f} km")
+    return " → ".join(steps)
+
+# Shared pool so OTP itineraries for all top places are fetched in parallel
+_route_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="otp")
+
+# One-to-many routing: every destination in one pass
+def otp_route_many(user_lat, user_lon, destinations, deadline=None, concurrent=True):
+    """
+    Route dicts from one origin to each (lat, lon) destination, in order.
+    Cached itineraries are answered immediately; the remaining distinct
+    destinations are planned concurrently (one after another with
+    concurrent=False). Anything not ready by `deadline` (an absolute
+    time.monotonic() value) gets the haversine fallback.
+    """
+    if not destinations:
+        return []
+    # One vectorized pass for every fallback distance
+    dists = [float(d) for d in geo_distance.distances_from(user_lat, user_lon, destinations)]
+    keys = [route_cache.route_key(user_lat, user_lon, lat, lon) for lat, lon in destinations]
+    cached, futures = {}, {}
+    for key, (lat, lon), d in zip(keys, destinations, dists):
+        if key in cached or key in futures:
+            continue
+        itinerary = route_cache.cache.get(key)
+        if itinerary is not None:
+            cached[key] = itinerary
+        elif not concurrent:
+            if deadline is None or time.monotonic() < deadline:
+                cached[key] = metrics.timed("otp_route", otp_route, user_lat, user_lon, lat, lon, d)
+            else:
+                cached[key] = fallback_route(user_lat, user_lon, lat, lon, d)
         else:
-            return f"\n**🚇 {dist_km:.1f} km — Metro recommended.**"
+            futures[key] = _route_pool.submit(metrics.timed, "otp_route", otp_route, user_lat, user_lon, lat, lon, d)
+    timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+    wait(futures.values(), timeout=timeout)
+
+    routes = []
+    for key, (lat, lon), d in zip(keys, destinations, dists):
+        if key in cached:
+            routes.append(cached[key])
+            continue
+        fut = futures[key]
+        if fut.done() and not fut.exception():
+            routes.append(fut.result())
+        else:
+            fut.cancel()
+            routes.append(fallback_route(user_lat, user_lon, lat, lon, d))
+    return routes
 
 # Route suggestion for top 3
-def route_suggestions(user_lat, user_lon, top_places):
+def route_suggestions(user_lat, user_lon, top_places, deadline=None):
+    """
+    Fetch OTP routes for all places in one batched pass.
+    `deadline` is an absolute time.monotonic() value; any place whose
+    itinerary is not ready by then gets the haversine fallback instead.
+    """
     if not top_places:
         return "No top places found for routing."
-    suggestions = []
-    for place in top_places:
-        name = place["name"]
-        lat = float(place["lat"])
-        lon = float(place["lon"])
-        route_text = otp_route(user_lat, user_lon, lat, lon)
-        suggestions.append(f"{name} → {route_text}")
-    return "\n".join(suggestions)
-
-route_tool = FunctionTool(route_suggestions)
+    destinations = [(float(p["lat"]), float(p["lon"])) for p in top_places]
+    routes = otp_route_many(user_lat, user_lon, destinations, deadline)
+    return "\n".join(f"{p['name']} → {format_route(route)}" for p, route in zip(top_places, routes))
+
+# Built on first access so the pipeline can use route_suggestions without loading google.adk
+def __getattr__(name):
+    if name == "route_tool":
+        from google.adk.tools import FunctionTool
+        value = FunctionTool(route_suggestions)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
@@ -1,16 +1,39 @@
-from google.adk.agents import Agent
-from agent_places import places_tool
-from agent_weather import weather_tool
-from agent_route import route_tool
-from google.adk.tools import FunctionTool
+from agent_places import find_places
+from agent_weather import get_weather, get_weather_many
+from agent_route import format_route, otp_route_many
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import contextvars
+import math
+import os
+import time
+import metrics
+import places_source
+import prefetch
+import ranking
+import rate_limiter
+from rate_limiter import StillQueued
 
-def combined_places_review_and_route(user_lat, user_lon, query):
-    """
-    Fetch places, top 3 by rating, and OTP-based transport suggestions.
-    Wrap outputs in structured markers for sidebar.
-    """
-    # Weather
-    weather_info = weather_tool.func(user_lat, user_lon)
+# Concurrent mode: weather + places in parallel, all OTP legs in parallel,
+# everything bounded by a per-request deadline (seconds). The deadline also
+# bounds waits at the Nominatim scheduler; a place search that is still queued
+# when it passes is reported ("places_error") rather than shown as no places.
+CONCURRENT_MODE = os.getenv("PIPELINE_CONCURRENT", "1") != "0"
+REQUEST_DEADLINE_S = float(os.getenv("PIPELINE_DEADLINE_S", "8"))
+
+_pipeline_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="pipeline")
+
+def _remaining(deadline):
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+def _result_or(future, deadline, default):
+    """Wait for a future until the deadline (None: no limit), returning `default` if it is late or failed."""
+    try:
+        return future.result(timeout=_remaining(deadline))
+    except Exception:
+        future.cancel()
+        return default
+
+def format_weather(weather_info):
     if isinstance(weather_info, dict):
         # Convert to readable string
         weather_text = f"Temperature: {weather_info.get('temperature', 'N/A')}°C\n"
@@ -18,65 +41,167 @@ def combined_places_review_and_route(user_lat, user_lon, query):
         weather_text += f"Wind speed: {weather_info.get('wind', 'N/A')} km/h"
     else:
         weather_text = str(weather_info)
+    return weather_text
+
+def top_places(batch, k=3, query=None):
+    """Top k places of a PlaceBatch by rating, distance, travel time and match with the query (see ranking)."""
+    return ranking.rank_batch(batch, k, query)
+
+def combined_places_review_and_route(user_lat, user_lon, query):
+    """
+    Fetch places, the top 3 (see ranking), and OTP-based transport suggestions.
+    Wrap outputs in structured markers for sidebar.
+    """
+    with metrics.span("pipeline.total"):
+        return render_combined(_combined(user_lat, user_lon, query))
+
+def combined_result(user_lat, user_lon, query, deadline_s=None, addresses=False):
+    """
+    The same pipeline as a JSON-ready dict, for API clients:
+    {"weather": {...}, "places": [place, ...], "top": [place + "route" + "weather", ...]}
+    Places carry name, lat, lon, rating, address, link, distance_km and kind (when known);
+    routes are agent_route route dicts (mode, distance_km, duration_min, legs, source).
+    When the place search did not finish in time, places and top are empty and
+    "places_error" is {"reason": "queued" or "timeout", "eta_s": estimated wait}.
+    With addresses=True the top places' missing addresses are looked up
+    while the routes are planned, within the same deadline.
+    deadline_s=math.inf waits for every step however long it takes (batch runs).
+    """
+    with metrics.span("pipeline.total"):
+        return _combined(user_lat, user_lon, query, deadline_s, addresses)
+
+def _combined(user_lat, user_lon, query, deadline_s=None, addresses=False):
+    prefetch.record_query(user_lat, user_lon, query)
+    deadline = None
+    if deadline_s == math.inf:
+        pass
+    elif CONCURRENT_MODE or deadline_s is not None:
+        deadline = time.monotonic() + (REQUEST_DEADLINE_S if deadline_s is None else deadline_s)
+    token = rate_limiter.current_deadline.set(deadline)
+    try:
+        return _pipeline(user_lat, user_lon, query, deadline, addresses)
+    finally:
+        rate_limiter.current_deadline.reset(token)
+
+def _places_late(weather_info, reason, eta_s):
+    return {"weather": weather_info, "places": [], "top": [],
+            "places_error": {"reason": reason, "eta_s": round(eta_s, 1)}}
+
+def _pipeline(user_lat, user_lon, query, deadline, addresses):
+    if CONCURRENT_MODE:
+        # Each task runs in a copy of the caller's context so the rate limiter
+        # still sees which session and priority the request belongs to
+        weather_future = _pipeline_pool.submit(contextvars.copy_context().run,
+                                               metrics.timed, "pipeline.weather", get_weather, user_lat, user_lon)
+        places_future = _pipeline_pool.submit(contextvars.copy_context().run,
+                                              metrics.timed, "pipeline.places", find_places, user_lat, user_lon, query)
+
+    # Weather
+    if CONCURRENT_MODE:
+        weather_info = _result_or(weather_future, deadline, {})
+    else:
+        weather_info = metrics.timed("pipeline.weather", get_weather, user_lat, user_lon)
 
-    weather_section = f"[WEATHER]\n{weather_text}\n"
+    # Place Finder: a search still waiting for Nominatim is reported as late, not as "no places"
+    try:
+        if CONCURRENT_MODE:
+            all_places = places_future.result(timeout=_remaining(deadline))
+        else:
+            all_places = metrics.timed("pipeline.places", find_places, user_lat, user_lon, query)
+    except StillQueued as e:
+        return _places_late(weather_info, "queued", e.eta_s)
+    except FutureTimeout:
+        # The search gives up its scheduler slot at the same deadline
+        return _places_late(weather_info, "timeout", rate_limiter.nominatim.estimated_wait())
+    except Exception:
+        all_places = None
+    if not all_places:
+        return {"weather": weather_info, "places": [], "top": []}
 
-    # Place Finder 
-    all_places_raw = places_tool.func(user_lat, user_lon, query)
-    if not all_places_raw:
-        places_section = "[PLACES]\nNo places found.\n"
+    # Distance from the user to every place, in one vectorized pass
+    all_places.with_distances(user_lat, user_lon)
+
+    # Top 3 by rating, nearness and relevance, with transport suggestions
+    top3 = top_places(all_places, query=query)
+    destinations = [(p.lat, p.lon) for p in top3]
+    # Addresses already looked up cost nothing; others only when asked for
+    places_source.fill_addresses(top3, lookup=False)
+    # Weather at the destinations (one batched call) while the routes are planned
+    if CONCURRENT_MODE:
+        destination_future = _pipeline_pool.submit(contextvars.copy_context().run, metrics.timed,
+                                                   "pipeline.destination_weather", get_weather_many, destinations)
+        if addresses:
+            address_future = _pipeline_pool.submit(contextvars.copy_context().run, places_source.fill_addresses, top3)
+    with metrics.span("pipeline.route"):
+        routes = otp_route_many(user_lat, user_lon, destinations, deadline, concurrent=CONCURRENT_MODE)
+    if CONCURRENT_MODE:
+        destination_weather = _result_or(destination_future, deadline, [None] * len(top3))
+        if addresses:
+            _result_or(address_future, deadline, None)
+    else:
+        destination_weather = metrics.timed("pipeline.destination_weather", get_weather_many, destinations)
+        if addresses:
+            places_source.fill_addresses(top3)
+    top = []
+    for p, route, weather in zip(top3, routes, destination_weather):
+        entry = p.to_dict()
+        entry["route"] = route
+        entry["weather"] = weather
+        top.append(entry)
+
+    return {"weather": weather_info, "places": all_places.to_dicts(), "top": top}
+
+def render_combined(result):
+    """Marker-delimited text ([WEATHER] ... [TRANSPORT] ...) for a combined_result dict."""
+    weather_section = f"[WEATHER]\n{format_weather(result['weather'])}\n"
+    if not result["places"]:
+        late = result.get("places_error")
+        if late:
+            places_section = (f"[PLACES]\n⏳ The place search is queued (about {late['eta_s']:.0f} s). "
+                              "Please ask again in a moment.\n")
+        else:
+            places_section = "[PLACES]\nNo places found.\n"
         top3_section = "[REVIEWS]\nNo reviews info.\n"
         transport_section = "[TRANSPORT]\nNo transport info.\n"
         return weather_section + places_section + top3_section + transport_section
 
-    all_places = []
-    for p in all_places_raw:
-        lat_val = float(p.get("lat", 0))
-        lon_val = float(p.get("lon", 0) or p.get("lng", 0))
-        if lat_val == 0 or lon_val == 0:
-            continue
-        map_link = f"https://www.openstreetmap.org/?mlat={lat_val}&mlon={lon_val}&zoom=15"
-        all_places.append({
-            "name": p.get("name", "Unknown"),
-            "lat": lat_val,
-            "lon": lon_val,
-            "rating": float(p.get("rating", 0)) if p.get("rating") else 0,
-            "link": map_link
-        })
-
-    # Places section
     places_section = "[PLACES]\n" + "\n".join(
-        [f"• {p['name']} ([map]({p['link']}))" for p in all_places]
+        [f"• {p['name']} ([map]({p['link']}))" for p in result["places"]]
     )
-
-    # Top 3 by rating as reviews
-    top3 = sorted(all_places, key=lambda x: x["rating"], reverse=True)[:3]
     top3_section = "[REVIEWS]\n" + "\n".join(
-        [f"⭐ {p['rating']} — {p['name']} ([map]({p['link']}))" for p in top3]
+        [f"⭐ {p['rating']} — {p['name']} ([map]({p['link']}))" for p in result["top"]]
     )
-
-    # Transport suggestions
-    transport_text = route_tool.func(user_lat, user_lon, top3)
-    if isinstance(transport_text, dict):
-        transport_text = str(transport_text)
+    transport_text = "\n".join(f"{p['name']} → {format_route(p['route'])}" for p in result["top"])
     transport_section = f"[TRANSPORT]\n{transport_text.strip()}"
 
     return weather_section + places_section + top3_section + transport_section
 
 
-combined_tool = FunctionTool(combined_places_review_and_route)
-
-# Root multi-agent router
-root_agent = Agent(
-    name="router_agent",
-    model="gemini-2.5-flash",
-    description="Routes queries to weather, places, reviews, and transport agents.",
-    instruction="""
+# The ADK tool and the root agent are built on first access (normally by
+# agent_runtime.get_runner()), so the direct pipeline and the intent fast path
+# never load google.adk or google.genai
+def __getattr__(name):
+    if name == "combined_tool":
+        from google.adk.tools import FunctionTool
+        value = FunctionTool(combined_places_review_and_route)
+    elif name == "root_agent":
+        from google.adk.agents import Agent
+        from agent_weather import weather_tool
+        # Root multi-agent router
+        value = Agent(
+            name="router_agent",
+            model="gemini-2.5-flash",
+            description="Routes queries to weather, places, reviews, and transport agents.",
+            instruction="""
 You are a coordinator AI.
 - For weather → call weather_tool.
 - For nearby places → call combined_tool (all places + top 3 + OTP routes).
 - Always return your output in this structured format:
   [WEATHER] ... [PLACES] ... [REVIEWS] ... [TRANSPORT] ...
 """,
-    tools=[weather_tool, combined_tool]
-)
+            tools=[weather_tool, __getattr__("combined_tool")]
+        )
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
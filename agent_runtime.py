@@ -0,0 +1,144 @@
+import asyncio
+import importlib
+import json
+import os
+import threading
+import time
+
+import metrics
+
+# Process-wide agent runtime.
+# The agent graph, Runner and session service are built once per process, on the
+# first request that actually needs the Gemini agent, and shared by every UI
+# session, CLI run and batch worker; callers only create (cheap) ADK sessions.
+#
+# Also keeps a startup report so cold starts can be tracked after deploys and
+# autoscaling events: seconds spent importing heavy modules, and seconds from
+# process start to milestones such as first_render and first_answer.
+#
+#   python agent_runtime.py    # cold-start report for this machine, as JSON
+APP_NAME = os.getenv("AGENT_APP_NAME", "map_app")
+
+
+def _process_start():
+    """Wall-clock start of this process (from /proc on Linux), else when this module was imported."""
+    try:
+        with open("/proc/self/stat") as f:
+            ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/stat") as f:
+            boot = next(int(line.split()[1]) for line in f if line.startswith("btime"))
+        return boot + ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, StopIteration):
+        return time.time()
+
+
+PROCESS_START = _process_start()
+
+_lock = threading.Lock()
+_runner = None
+_session_service = None
+_sessions = set()  # (user_id, session_id) already created
+_imports = {}      # module -> seconds
+_milestones = {}   # event -> seconds since process start
+
+
+# Startup report
+def timed_import(module):
+    """importlib.import_module that records how long the first (uncached) import took."""
+    start = time.perf_counter()
+    mod = importlib.import_module(module)
+    elapsed = time.perf_counter() - start
+    if module not in _imports:
+        _imports[module] = elapsed
+        metrics.observe("startup.import", elapsed, module=module)
+    return mod
+
+
+def mark(event):
+    """Record the first time `event` happens in this process; later calls are no-ops."""
+    if event in _milestones:
+        return
+    elapsed = time.time() - PROCESS_START
+    _milestones[event] = elapsed
+    metrics.observe(f"startup.{event}", elapsed)
+
+
+def startup_report():
+    return {
+        "process_start": PROCESS_START,
+        "milestones_s": dict(_milestones),
+        "imports_s": dict(_imports),
+        "runner_built": _runner is not None,
+    }
+
+
+def _flat_report():
+    stats = {f"{event}_s": sec for event, sec in _milestones.items()}
+    stats.update({f"import_{mod.replace('.', '_')}_s": sec for mod, sec in _imports.items()})
+    return stats
+
+
+metrics.register_collector("startup", _flat_report)
+
+
+# Shared runner
+def get_runner():
+    """The process-wide Runner over agent_router.root_agent, built on first call."""
+    global _runner, _session_service
+    if _runner is not None:
+        return _runner
+    with _lock:
+        if _runner is None:
+            with metrics.span("startup.runner"):
+                runners = timed_import("google.adk.runners")
+                sessions = timed_import("google.adk.sessions")
+                timed_import("google.genai.types")
+                agent_router = timed_import("agent_router")
+                _session_service = sessions.InMemorySessionService()
+                _runner = runners.Runner(agent=agent_router.root_agent, app_name=APP_NAME,
+                                         session_service=_session_service)
+            mark("runner_ready")
+    return _runner
+
+
+def session_service():
+    get_runner()
+    return _session_service
+
+
+async def ensure_session(user_id, session_id):
+    """Create the ADK session on first use; sessions are kept per (user_id, session_id)."""
+    key = (user_id, session_id)
+    if key in _sessions:
+        return
+    service = session_service()
+    if await service.get_session(app_name=APP_NAME, user_id=user_id, session_id=session_id) is None:
+        await service.create_session(app_name=APP_NAME, user_id=user_id, session_id=session_id)
+    _sessions.add(key)
+
+
+def has_session(user_id, session_id):
+    return (user_id, session_id) in _sessions
+
+
+async def delete_session(user_id, session_id):
+    _sessions.discard((user_id, session_id))
+    await session_service().delete_session(app_name=APP_NAME, user_id=user_id, session_id=session_id)
+
+
+def user_message(text):
+    from google.genai.types import Content, Part
+    return Content(role="user", parts=[Part(text=text)])
+
+
+def main():
+    for module in ("streamlit", "pandas", "numpy", "requests", "agent_router", "intent_router", "stream_parser"):
+        timed_import(module)
+    mark("modules_loaded")
+    get_runner()
+    asyncio.run(ensure_session("startup", "report"))
+    print(json.dumps(startup_report(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,61 @@
-import requests
+import http_client
+import weather_batch
+import weather_cache
 from dotenv import load_dotenv
-from google.adk.agents import Agent
-from google.adk.tools import FunctionTool
 
 load_dotenv("./.env")
 
+PARAMS = {"current_weather": True, "alerts": True}
+
+def _fetch_weather(lat, lng):
+    params = {"latitude": lat, "longitude": lng, **PARAMS}
+    return http_client.get_json(weather_batch.OPEN_METEO_URL, params=params)
+
+def _summary(res):
+    cw = res.get("current_weather", {})
+    temp = cw.get("temperature")
+    wind = cw.get("windspeed")
+
+    alert = None
+    if "alerts" in res and res["alerts"]:
+        events = [a.get("event") for a in res["alerts"] if a.get("event")]
+        if events:
+            alert = "⚠️ " + ", ".join(events)
+
+    return {"temperature": temp, "wind": wind, "alert": alert}
+
 def get_weather(lat: float, lng: float):
-    url = "https://api.open-meteo.com/v1/forecast"
-    params = {"latitude": lat, "longitude": lng, "current_weather": True, "alerts": True}
     try:
-        res = requests.get(url, params=params).json()
-        cw = res.get("current_weather", {})
-        temp = cw.get("temperature")
-        wind = cw.get("windspeed")
-
-        alert = None
-        if "alerts" in res and res["alerts"]:
-            events = [a.get("event") for a in res["alerts"] if a.get("event")]
-            if events:
-                alert = "⚠️ " + ", ".join(events)
-
-        return {"temperature": temp, "wind": wind, "alert": alert}
+        res = weather_cache.cache.get(lat, lng, _fetch_weather, namespace="agent_weather")
+        return _summary(res)
     except:
         return {"temperature": None, "wind": None, "alert": None}
 
-weather_tool = FunctionTool(get_weather)
+def get_weather_many(points):
+    """get_weather for every (lat, lng) in points, with batched upstream calls (see weather_batch)."""
+    unknown = {"temperature": None, "wind": None, "alert": None}
+    try:
+        responses = weather_batch.get_many(points, PARAMS, namespace="agent_weather")
+    except Exception:
+        return [dict(unknown) for _ in points]
+    return [_summary(res) if res else dict(unknown) for res in responses]
 
-weather_agent = Agent(
-    name="weather_agent",
-    model="gemini-2.5-flash",
-    description="Provides current weather and alerts for a location.",
-    instruction="Answer only using weather_tool when user asks about weather or alerts.",
-    tools=[weather_tool]
-)
+# The ADK tool and agent are built on first access, so importing this module
+# for get_weather does not load google.adk
+def __getattr__(name):
+    if name == "weather_tool":
+        from google.adk.tools import FunctionTool
+        value = FunctionTool(get_weather)
+    elif name == "weather_agent":
+        from google.adk.agents import Agent
+        value = Agent(
+            name="weather_agent",
+            model="gemini-2.5-flash",
+            description="Provides current weather and alerts for a location.",
+            instruction="Answer only using weather_tool when user asks about weather or alerts.",
+            tools=[__getattr__("weather_tool")]
+        )
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
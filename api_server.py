@@ -0,0 +1,366 @@
+import argparse
+import asyncio
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Optional, Tuple
+
+from fastapi import FastAPI, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from pydantic import BaseModel, Field
+
+from place_record import PlaceBatch
+
+import agent_router
+import map_layer
+import metrics
+import prefetch
+import rate_limiter
+import stream_parser
+
+# Headless JSON API around the place/weather/route pipeline and the agent.
+#
+#   python api_server.py --port 8000
+#   curl -XPOST localhost:8000/v1/nearby -d '{"lat": 12.97, "lon": 77.59, "query": "cafe"}'
+#
+# One event loop accepts requests; work goes through bounded queues:
+# - "pipeline": blocking tool calls run on API_WORKERS threads
+# - "agent": Gemini runs, API_AGENT_CONCURRENCY at a time on the loop
+# When a queue is full the request is refused at once with 429 and a
+# Retry-After estimate instead of piling up. Every request has a deadline
+# (body "deadline_s", capped at API_MAX_DEADLINE_S); requests still queued
+# when it passes are dropped, and the pipeline falls back to distance
+# estimates for routes that are not ready in time. A blocking call that is
+# still running when its request gives up keeps its thread until it returns,
+# so it keeps counting against the pipeline queue's capacity until then.
+# Every request names its session_id: chat history, map state, prefetch and
+# the Nominatim scheduler's round-robin are all kept per session.
+WORKERS = int(os.getenv("API_WORKERS", "16"))
+QUEUE_SIZE = int(os.getenv("API_QUEUE_SIZE", "64"))
+AGENT_CONCURRENCY = int(os.getenv("API_AGENT_CONCURRENCY", "8"))
+AGENT_QUEUE_SIZE = int(os.getenv("API_AGENT_QUEUE_SIZE", "32"))
+DEFAULT_DEADLINE_S = float(os.getenv("API_DEADLINE_S", str(agent_router.REQUEST_DEADLINE_S)))
+MAX_DEADLINE_S = float(os.getenv("API_MAX_DEADLINE_S", "60"))
+AGENT_DEADLINE_S = float(os.getenv("API_AGENT_DEADLINE_S", "45"))
+
+
+class Overloaded(Exception):
+    def __init__(self, retry_after):
+        super().__init__("server busy")
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class WorkQueue:
+    """
+    Bounded admission queue served by `workers` async tasks.
+    submit() waits for the result, raising Overloaded when `queue_size` jobs
+    are already waiting and DeadlineExceeded when `deadline` passes first.
+    """
+
+    def __init__(self, name, workers, queue_size, busy=None):
+        self.name = name
+        self.workers = workers
+        self.busy = busy  # optional callable: abandoned jobs still holding a worker thread
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._tasks = []
+        self.service_s = 0.5  # moving average of job time, for Retry-After
+        self.counters = {"accepted": 0, "rejected": 0, "expired": 0, "failed": 0, "completed": 0}
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def retry_after(self):
+        return max(1, round((self._queue.qsize() + 1) * self.service_s / self.workers))
+
+    async def submit(self, job, deadline):
+        """Run `await job(deadline)` on a worker; `deadline` is a time.monotonic() value."""
+        future = asyncio.get_running_loop().create_future()
+        try:
+            if self.busy is not None and self._queue.qsize() + self.busy() >= self._queue.maxsize:
+                raise asyncio.QueueFull()
+            self._queue.put_nowait((job, deadline, future, time.monotonic()))
+        except asyncio.QueueFull:
+            self.counters["rejected"] += 1
+            raise Overloaded(self.retry_after())
+        self.counters["accepted"] += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            future.cancel()
+            raise DeadlineExceeded()
+
+    async def _worker(self):
+        while True:
+            job, deadline, future, enqueued = await self._queue.get()
+            metrics.observe("api.queue_wait", time.monotonic() - enqueued, queue=self.name)
+            if future.done() or time.monotonic() >= deadline:
+                self.counters["expired"] += 1
+                continue
+            start = time.monotonic()
+            try:
+                result = await asyncio.wait_for(job(deadline), max(0.0, deadline - start))
+            except asyncio.TimeoutError:
+                self.counters["expired"] += 1
+                if not future.done():
+                    future.set_exception(DeadlineExceeded())
+            except Exception as e:
+                self.counters["failed"] += 1
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                self.counters["completed"] += 1
+                if not future.done():
+                    future.set_result(result)
+            self.service_s = 0.8 * self.service_s + 0.2 * (time.monotonic() - start)
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats["queued"] = self._queue.qsize()
+        stats["service_avg_s"] = self.service_s
+        if self.busy is not None:
+            stats["abandoned_running"] = self.busy()
+        return stats
+
+
+_threads = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="api")
+_abandoned = 0  # thread jobs still running after their request gave up; only touched on the event loop
+pipeline_queue = None
+agent_queue = None
+
+
+def abandoned_threads():
+    return _abandoned
+
+
+def in_thread(fn, session, *args):
+    """A WorkQueue job running blocking fn(*args) on the API threads, tagged with the caller's scheduler session."""
+    def run(deadline):
+        # The request may have expired while this waited for a free thread
+        if time.monotonic() >= deadline:
+            raise DeadlineExceeded()
+        rate_limiter.current_session.set(session)
+        return fn(*args)
+
+    async def job(deadline):
+        global _abandoned
+        loop = asyncio.get_running_loop()
+        thread_future = _threads.submit(contextvars.Context().run, run, deadline)
+        try:
+            return await asyncio.shield(asyncio.wrap_future(thread_future))
+        except asyncio.CancelledError:
+            if not thread_future.cancel():
+                # Already running: it holds its thread until fn returns
+                _abandoned += 1
+                thread_future.add_done_callback(lambda _f: loop.call_soon_threadsafe(_release_abandoned))
+            raise
+    return job
+
+
+def _release_abandoned():
+    global _abandoned
+    _abandoned -= 1
+
+
+def _deadline(requested, default=DEFAULT_DEADLINE_S):
+    return time.monotonic() + min(MAX_DEADLINE_S, requested or default)
+
+
+# Request bodies
+class NearbyRequest(BaseModel):
+    lat: float = Field(ge=-90, le=90)
+    lon: float = Field(ge=-180, le=180)
+    query: str = Field(min_length=1, max_length=200)
+    session_id: str = Field(min_length=1, max_length=128)
+    deadline_s: Optional[float] = Field(default=None, gt=0)
+    addresses: bool = False  # look up the top places' addresses when the search did not return them
+
+
+class AskRequest(BaseModel):
+    lat: float = Field(ge=-90, le=90)
+    lon: float = Field(ge=-180, le=180)
+    prompt: str = Field(min_length=1, max_length=2000)
+    session_id: str = Field(min_length=1, max_length=128)
+    deadline_s: Optional[float] = Field(default=None, gt=0)
+
+
+class MapRequest(BaseModel):
+    session_id: str = Field(min_length=1, max_length=128)
+    zoom: Optional[int] = Field(default=None, ge=0, le=22)
+    bbox: Optional[Tuple[float, float, float, float]] = None  # west, south, east, north
+    width_px: int = Field(default=900, gt=0, le=8192)
+    height_px: int = Field(default=450, gt=0, le=8192)
+    since: Optional[int] = None
+
+
+class LocationRequest(BaseModel):
+    lat: float = Field(ge=-90, le=90)
+    lon: float = Field(ge=-180, le=180)
+    session_id: str = Field(min_length=1, max_length=128)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Queues are created inside the server's event loop
+    global pipeline_queue, agent_queue
+    pipeline_queue = WorkQueue("pipeline", WORKERS, QUEUE_SIZE, busy=abandoned_threads)
+    agent_queue = WorkQueue("agent", AGENT_CONCURRENCY, AGENT_QUEUE_SIZE)
+    pipeline_queue.start()
+    agent_queue.start()
+    metrics.register_collector("api_pipeline_queue", pipeline_queue.stats)
+    metrics.register_collector("api_agent_queue", agent_queue.stats)
+    yield
+    await pipeline_queue.stop()
+    await agent_queue.stop()
+
+
+app = FastAPI(title="Nearby Places Finder API", lifespan=lifespan)
+
+
+@app.exception_handler(Overloaded)
+async def _overloaded(request, exc):
+    return JSONResponse({"error": "busy", "retry_after_s": exc.retry_after}, status_code=429,
+                        headers={"Retry-After": str(exc.retry_after)})
+
+
+@app.exception_handler(DeadlineExceeded)
+async def _deadline_exceeded(request, exc):
+    return JSONResponse({"error": "deadline exceeded"}, status_code=504)
+
+
+@app.middleware("http")
+async def _timed(request: Request, call_next):
+    with metrics.span("api.request", path=request.url.path):
+        return await call_next(request)
+
+
+@app.post("/v1/nearby")
+async def nearby(req: NearbyRequest):
+    """Places, the top 3 with routes, and weather, as structured JSON."""
+    deadline = _deadline(req.deadline_s)
+
+    def run():
+        # Whatever the queue wait left of the deadline bounds the routing stage
+        remaining = max(0.1, deadline - time.monotonic())
+        result = agent_router.combined_result(req.lat, req.lon, req.query, deadline_s=remaining,
+                                              addresses=req.addresses)
+        map_layer.sessions.get(req.session_id).update(PlaceBatch.from_dicts(result["places"]), result["top"],
+                                                      (req.lat, req.lon))
+        return result
+
+    return await pipeline_queue.submit(in_thread(run, req.session_id), deadline)
+
+
+@app.post("/v1/ask")
+async def ask(req: AskRequest):
+    """Free-text prompt: answered by the intent fast path when possible, otherwise by the agent."""
+    import intent_router
+    from chat_history import history
+    deadline = _deadline(req.deadline_s)
+    text = await pipeline_queue.submit(
+        in_thread(intent_router.fast_path, req.session_id, req.prompt, req.lat, req.lon), deadline)
+    source = "fast_path"
+    if text is None:
+        source = "agent"
+        deadline = _deadline(req.deadline_s, AGENT_DEADLINE_S)
+        text = await agent_queue.submit(lambda _deadline: _run_agent(req), deadline)
+    else:
+        # Later agent turns in this session still see what was answered here
+        history.record("api", req.session_id, _agent_prompt(req), text, via_agent=False)
+    sections = stream_parser.parse_sections(text)
+    places = stream_parser.parse_place_links(sections.get("PLACES", ""))
+    if places:
+        map_layer.sessions.get(req.session_id).update(
+            PlaceBatch.from_dicts(places), stream_parser.parse_place_links(sections.get("REVIEWS", "")),
+            (req.lat, req.lon))
+    return {"source": source, "text": text, "sections": sections}
+
+
+def _agent_prompt(req):
+    return f"My location is {req.lat},{req.lon}. {req.prompt}"
+
+
+async def _run_agent(req):
+    import agent_runtime
+    from chat_history import history
+    runner = await asyncio.to_thread(agent_runtime.get_runner)
+    prompt = _agent_prompt(req)
+    session_id, message = await history.prepare("api", req.session_id, prompt)
+    await agent_runtime.ensure_session("api", session_id)
+    parts = []
+    start = time.perf_counter()
+    async for event in runner.run_async(user_id="api", session_id=session_id,
+                                        new_message=agent_runtime.user_message(message)):
+        if event.content and event.content.parts and event.content.parts[0].text:
+            parts.append(event.content.parts[0].text)
+    metrics.observe("agent.stream", time.perf_counter() - start)
+    text = "".join(parts)
+    history.record("api", req.session_id, prompt, text)
+    return text
+
+
+@app.post("/v1/map")
+async def map_frame(req: MapRequest):
+    """
+    Clustered map of the session's last results for a viewport (bbox and zoom;
+    fitted to the results when omitted). Pass the last "version" received as
+    `since` to get only the clusters added, changed or removed since then.
+    """
+    session = map_layer.sessions.get(req.session_id)
+    if req.bbox is None or req.zoom is None:
+        lat, lon, zoom = session.fit(req.width_px, req.height_px)
+        zoom = zoom if req.zoom is None else req.zoom
+        bbox = req.bbox or map_layer.view_bbox(lat, lon, zoom, req.width_px, req.height_px)
+    else:
+        zoom, bbox = req.zoom, req.bbox
+        lat, lon = (bbox[1] + bbox[3]) / 2, (bbox[0] + bbox[2]) / 2
+    frame = session.frame(zoom, bbox, req.since)
+    frame["view"] = {"lat": lat, "lon": lon, "zoom": frame["zoom"], "bbox": bbox}
+    return frame
+
+
+@app.get("/v1/weather")
+async def weather(lat: float, lon: float, session_id: str = Query(min_length=1, max_length=128)):
+    from agent_weather import get_weather
+    deadline = _deadline(None)
+    return await pipeline_queue.submit(in_thread(get_weather, session_id, lat, lon), deadline)
+
+
+@app.post("/v1/prefetch", status_code=202)
+async def start_prefetch(req: LocationRequest):
+    """Warm caches for a client that just learned its location; returns immediately."""
+    prefetch.start(req.session_id, req.lat, req.lon)
+    return {"status": "accepted"}
+
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok", "pipeline": pipeline_queue.stats(), "agent": agent_queue.stats()}
+
+
+@app.get("/metrics")
+async def prometheus():
+    return PlainTextResponse(metrics.export_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+def main():
+    import uvicorn
+    parser = argparse.ArgumentParser(description="Serve the pipeline and agent as a JSON API.")
+    parser.add_argument("--host", default=os.getenv("API_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("API_PORT", "8000")))
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
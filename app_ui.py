@@ -1,19 +1,35 @@
 import streamlit as st
-import pandas as pd
+import agent_runtime
 import asyncio
-import json
+import os
 import re
-from google.adk.runners import Runner
-from google.adk.sessions import InMemorySessionService
-from google.genai.types import Content, Part
-from agent_router import root_agent
+import time
+import uuid
+import stream_parser
+import metrics
+import rate_limiter
+import intent_router
+import prefetch
+import map_layer
+from chat_history import history, trim_messages
+from agent_route import otp_breaker
+import http_client
+import requests
 from itertools import zip_longest
+from place_record import PlaceBatch
 
 st.set_page_config(
     page_title="Nearby Places Finder (Multi-Agent UI)",
     layout="wide",
     page_icon="📍"
 )
+# Minimum seconds between re-renders of the streaming answer
+RENDER_INTERVAL_S = 0.15
+# Size the map is laid out for when choosing its zoom and visible clusters
+MAP_WIDTH_PX, MAP_HEIGHT_PX = 900, 450
+# Set to the api_server.py base URL to run as a thin client: all work happens in the API service
+API_URL = os.getenv("API_URL", "").rstrip("/")
+
 st.title("📍 Nearby Places Finder (Multi-Agent Dashboard)")
 st.write("Use the sidebar to see outputs from individual agents. Ask your query below.")
 
@@ -22,18 +38,14 @@ if "user_lat" not in st.session_state:
     st.session_state.user_lat = None
     st.session_state.user_lng = None
 
-if "runner" not in st.session_state:
-    st.session_state.session_service = InMemorySessionService()
-    st.session_state.runner = Runner(
-        agent=root_agent,
-        app_name="map_app",
-        session_service=st.session_state.session_service
-    )
-    asyncio.run(st.session_state.session_service.create_session(
-        user_id="user",
-        session_id="map_chat",
-        app_name="map_app"
-    ))
+# Identify this browser session to the shared Nominatim scheduler (fair queueing)
+if "session_key" not in st.session_state:
+    st.session_state.session_key = uuid.uuid4().hex
+rate_limiter.current_session.set(st.session_state.session_key)
+
+# The agent runner is shared by all sessions (agent_runtime) and only built on
+# the first prompt the fast path cannot answer; each browser gets its own ADK session
+if "messages" not in st.session_state:
     st.session_state.messages = []
 
 # Structured boxes per agent
@@ -56,8 +68,34 @@ reviews_list = reviews_container.empty()
 
 transport_container = sidebar.container()
 transport_container.subheader("🚗 Transportation Agent")
+OTP_STATUS = {
+    "closed": "🟢 Transit routing online",
+    "half_open": "🟡 Transit routing recovering",
+    "open": "🔴 Transit routing offline — showing distance estimates",
+}
+transport_container.caption(OTP_STATUS[otp_breaker.state])
 transport_list = transport_container.empty()
 
+metrics.serve()
+
+# Optional per-stage timing panel
+show_timings = sidebar.checkbox("⏱ Show timings", value=False, disabled=not metrics.ENABLED)
+timing_panel = sidebar.empty()
+
+def render_timings():
+    if not show_timings:
+        return
+    rows = [f"**{name}** {s['count']}× avg {s['avg_s'] * 1000:.0f} ms, p90 ≤ {s['p90_s'] * 1000:.0f} ms"
+            for name, s in sorted(metrics.summary().items())]
+    last = [f"{name}: {sec * 1000:.0f} ms" for _, name, _, sec in metrics.recent(10)]
+    startup = [f"{event}: {sec:.1f} s" for event, sec in agent_runtime.startup_report()["milestones_s"].items()]
+    conv = [f"{k}: {v:.0f}" for k, v in history.session_stats(st.session_state.session_key).items()]
+    timing_panel.markdown("\n\n".join(["#### ⏱ Timings"] + rows + ["**Last spans**"] + last
+                                       + ["**Startup (since process start)**"] + startup
+                                       + ["**Conversation**"] + conv))
+
+render_timings()
+
 # Automatic geolocation
 if st.session_state.user_lat is None:
     get_location_js = """
@@ -119,9 +157,40 @@ if coords and st.session_state.user_lat is None:
     except:
         st.error("Invalid coordinates received.")
 
-# Show map
+# Warm weather and the usual searches for this spot while the user types
+if st.session_state.user_lat is not None:
+    if not API_URL:
+        prefetch.start(st.session_state.session_key, st.session_state.user_lat, st.session_state.user_lng)
+    elif st.session_state.get("prefetched_at") != (st.session_state.user_lat, st.session_state.user_lng):
+        st.session_state.prefetched_at = (st.session_state.user_lat, st.session_state.user_lng)
+        try:
+            http_client.post_json(f"{API_URL}/v1/prefetch", {"lat": st.session_state.user_lat,
+                                                             "lon": st.session_state.user_lng,
+                                                             "session_id": st.session_state.session_key}, timeout=2)
+        except Exception:
+            pass
+
+# Map of the user's position and the last answer's places (clustered), top picks and route lines
+map_slot = st.empty()
+map_zoom = 0
+
+def render_map():
+    """Draw the map for this session at the zoom that fits everything, shifted by the detail slider."""
+    session = map_layer.sessions.get(st.session_state.session_key)
+    origin = (st.session_state.user_lat, st.session_state.user_lng)
+    if session.origin != origin:
+        session.update(None, origin=origin)  # new location: earlier results no longer apply
+    lat, lon, zoom = session.fit(MAP_WIDTH_PX, MAP_HEIGHT_PX)
+    zoom = int(min(max(zoom + map_zoom, map_layer.MIN_ZOOM), map_layer.MAX_ZOOM))
+    # The chart is redrawn in full on every rerun, so each frame is a full one
+    frame = session.frame(zoom, map_layer.view_bbox(lat, lon, zoom, MAP_WIDTH_PX, MAP_HEIGHT_PX))
+    with metrics.span("ui.map"):
+        map_slot.pydeck_chart(map_layer.deck(frame["add"], frame["origin"], frame["routes"], (lat, lon, zoom)),
+                              height=MAP_HEIGHT_PX)
+
 if st.session_state.user_lat and st.session_state.user_lng:
-    st.map(pd.DataFrame([{"lat": st.session_state.user_lat, "lon": st.session_state.user_lng}]))
+    map_zoom = st.slider("Map detail", -3, 3, 0, help="Zoom in to split clusters into individual places.")
+    render_map()
 
 # Display chat history
 for m in st.session_state.messages:
@@ -144,103 +213,135 @@ if prompt := st.chat_input("Ask about places, weather, reviews, transport..."):
     with st.chat_message("assistant"):
         placeholder = st.empty()
 
-        async def run_agents():
-            full_text = ""
-            msg = Content(role="user", parts=[Part(text=enriched_prompt)])
-
-            # stream agent responses into full_text
-            async for event in st.session_state.runner.run_async(
-                user_id="user",
-                session_id="map_chat",
-                new_message=msg
-            ):
-                if event.content and event.content.parts:
-                    text = event.content.parts[0].text
-                    if text:
-                        full_text += text
-                        placeholder.markdown(full_text + "▌")
-
-            # Parse agent outputs into sections
-            weather_display = {"alert": "None", "temperature": "N/A", "wind": "N/A"}
-            places_display = "No places info"
-            reviews_display = "No reviews info"
-            transport_display = "No transport info"
-
+        # Tell the user up front if place searches are queued behind other sessions
+        eta = rate_limiter.nominatim.estimated_wait()
+        if eta >= 1:
+            placeholder.markdown(f"⏳ Place search is busy, estimated wait ~{eta:.0f}s")
+
+        def add_empty_line_after_bullets(text):
+            """Add one empty line after each bullet/line."""
+            lines = [line.strip() for line in text.split("\n") if line.strip()]
+            return "\n\n".join(lines)
+
+        # Sidebar values, filled in as each section completes
+        weather_display = {"alert": "None", "temperature": "N/A", "wind": "N/A"}
+        displays = {
+            "PLACES": "No places info",
+            "REVIEWS": "No reviews info",
+            "TRANSPORT": "No transport info",
+        }
+        section_lists = {"PLACES": places_list, "REVIEWS": reviews_list, "TRANSPORT": transport_list}
+
+        def show_section(name, raw):
+            """Update the sidebar box for a section as soon as it is complete."""
+            with metrics.span("ui.section"):
+                _show_section(name, raw)
+
+        def _show_section(name, raw):
             try:
-                # Weather Agent
-                w = re.search(r"\[WEATHER\](.*?)\[PLACES\]", full_text, re.DOTALL)
-                weather_data_raw = w.group(1).strip() if w else ""
-                if weather_data_raw:
+                if name == "WEATHER":
+                    weather_display.update(stream_parser.parse_weather(raw))
+                    weather_alert.markdown(f"**Alert:** {weather_display.get('alert', 'None')}")
+                    temp_val = weather_display.get('temperature', "N/A")
                     try:
-                        parsed = json.loads(weather_data_raw.replace("'", '"'))
+                        temp_val_display = f"{float(temp_val):.1f}°C"
                     except:
-                        parsed = None
-                    if isinstance(parsed, dict):
-                        weather_display["alert"] = parsed.get("alert", "None")
-                        weather_display["temperature"] = parsed.get("temperature", "N/A")
-                        weather_display["wind"] = parsed.get("wind", "N/A")
-                    else:
-                        tmatch = re.search(r"([Tt]emperature[: ]+)(-?\d+\.?\d*)", weather_data_raw)
-                        wmatch = re.search(r"([Ww]ind(?: speed)?[: ]+)(-?\d+\.?\d*)", weather_data_raw)
-                        if tmatch:
-                            weather_display["temperature"] = tmatch.group(2)
-                        if wmatch:
-                            weather_display["wind"] = wmatch.group(2)
-                        alert_match = re.search(r"(⚠️|alert[: ]+([^.\n]+))", weather_data_raw, re.IGNORECASE)
-                        if alert_match:
-                            weather_display["alert"] = alert_match.group(2) if alert_match.lastindex and alert_match.group(2) else "⚠️"
-                        else:
-                            if weather_data_raw:
-                                weather_display["alert"] = weather_data_raw
-
-                # Place Finder Agent
-                p = re.search(r"\[PLACES\](.*?)\[REVIEWS\]", full_text, re.DOTALL)
-                if p:
-                    ptxt = p.group(1).strip()
-                    if ptxt and ptxt.lower() not in ("none", "no places found.", "no places info"):
-                        places_display = ptxt
-
-                # Review Agent
-                r = re.search(r"\[REVIEWS\](.*?)\[TRANSPORT\]", full_text, re.DOTALL)
-                if r:
-                    rtxt = r.group(1).strip()
-                    if rtxt and rtxt.lower() not in ("none", ""):
-                        reviews_display = rtxt
-
-                # Transport Agent
-                t = re.search(r"\[TRANSPORT\](.*)", full_text, re.DOTALL)
-                if t:
-                    ttxt = t.group(1).strip()
-                    if ttxt and ttxt.lower() not in ("none", ""):
-                        transport_display = ttxt
+                        temp_val_display = str(temp_val)
+                    weather_temp.markdown(f"**Temperature:** {temp_val_display}")
+                    wind_val = weather_display.get('wind', "N/A")
+                    try:
+                        wind_val_display = f"{float(wind_val):.1f} km/h"
+                    except:
+                        wind_val_display = str(wind_val)
+                    weather_wind.markdown(f"**Wind:** {wind_val_display}")
+                else:
+                    text = stream_parser.section_display(name, raw)
+                    if text:
+                        displays[name] = text
+                    section_lists[name].markdown(add_empty_line_after_bullets(displays[name]), unsafe_allow_html=True)
             except Exception as e:
                 print("Parsing error:", e)
 
-            # Populate sidebar with spacing
-            def add_empty_line_after_bullets(text):
-                """Add one empty line after each bullet/line."""
-                lines = [line.strip() for line in text.split("\n") if line.strip()]
-                return "\n\n".join(lines)
-
-            weather_alert.markdown(f"**Alert:** {weather_display.get('alert', 'None')}")
-            temp_val = weather_display.get('temperature', "N/A")
-            try:
-                temp_val_display = f"{float(temp_val):.1f}°C"
-            except:
-                temp_val_display = str(temp_val)
-            weather_temp.markdown(f"**Temperature:** {temp_val_display}")
-            wind_val = weather_display.get('wind', "N/A")
-            try:
-                wind_val_display = f"{float(wind_val):.1f} km/h"
-            except:
-                wind_val_display = str(wind_val)
-            weather_wind.markdown(f"**Wind:** {wind_val_display}")
-
-            places_list.markdown(add_empty_line_after_bullets(places_display), unsafe_allow_html=True)
-            reviews_list.markdown(add_empty_line_after_bullets(reviews_display), unsafe_allow_html=True)
-            transport_list.markdown(add_empty_line_after_bullets(transport_display), unsafe_allow_html=True)
-
-            user_query_lower = prompt.lower()
+        async def run_agents():
+            parser = stream_parser.SectionStreamParser()
+            parts = []
+            last_render = 0.0
+
+            fast_answer = None
+            if not API_URL:
+                # Simple prompts are answered locally, skipping the Gemini round-trip
+                with metrics.span("fast_path"):
+                    fast_answer = await asyncio.to_thread(
+                        intent_router.fast_path, prompt, st.session_state.user_lat, st.session_state.user_lng
+                    )
+            if API_URL:
+                # Thin client: the API service picks fast path or agent and keeps the chat history
+                try:
+                    with metrics.span("api.ask"):
+                        reply = await asyncio.to_thread(http_client.post_json, f"{API_URL}/v1/ask", {
+                            "lat": st.session_state.user_lat, "lon": st.session_state.user_lng,
+                            "prompt": prompt, "session_id": st.session_state.session_key,
+                        }, None, 60)
+                except requests.RequestException as e:
+                    if e.response is not None and e.response.status_code == 429:
+                        wait_s = e.response.headers.get("Retry-After", "a few")
+                        placeholder.markdown(f"⏳ The service is busy, please try again in {wait_s} seconds.")
+                    else:
+                        placeholder.markdown("⚠️ The service could not answer this question.")
+                    return ""
+                for name, raw in parser.feed(reply["text"]):
+                    show_section(name, raw)
+                parts.append(reply["text"])
+            elif fast_answer is not None:
+                parts.append(fast_answer)
+                for name, raw in parser.feed(fast_answer):
+                    show_section(name, raw)
+            else:
+                runner = await asyncio.to_thread(agent_runtime.get_runner)
+                # Bounded window of recent turns; older ones arrive as a short summary
+                session_id, message = await history.prepare("user", st.session_state.session_key, enriched_prompt)
+                await agent_runtime.ensure_session("user", session_id)
+                msg = agent_runtime.user_message(message)
+
+                # stream agent responses; each chunk is parsed once and the
+                # main placeholder is re-rendered at most every RENDER_INTERVAL_S
+                stream_start = time.perf_counter()
+                first_token = True
+                async for event in runner.run_async(
+                    user_id="user",
+                    session_id=session_id,
+                    new_message=msg
+                ):
+                    if event.content and event.content.parts:
+                        text = event.content.parts[0].text
+                        if text:
+                            if first_token:
+                                metrics.observe("agent.ttft", time.perf_counter() - stream_start)
+                                first_token = False
+                            parts.append(text)
+                            for name, raw in parser.feed(text):
+                                show_section(name, raw)
+                            now = time.monotonic()
+                            if now - last_render >= RENDER_INTERVAL_S:
+                                placeholder.markdown("".join(parts) + "▌")
+                                last_render = now
+                metrics.observe("agent.stream", time.perf_counter() - stream_start)
+
+            for name, raw in parser.finish():
+                show_section(name, raw)
+            # Sections the answer never mentioned still get their default text
+            for name in section_lists:
+                if name not in parser.sections:
+                    show_section(name, "")
+            if "WEATHER" not in parser.sections:
+                show_section("WEATHER", "")
+
+            full_text = "".join(parts)
+            if not API_URL:
+                history.record("user", st.session_state.session_key, enriched_prompt, full_text,
+                               via_agent=fast_answer is None)
+            reviews_display = displays["REVIEWS"]
+            transport_display = displays["TRANSPORT"]
 
             user_query_lower = prompt.lower()
             if "weather" in user_query_lower or "temperature" in user_query_lower or "wind" in user_query_lower:
@@ -284,7 +385,19 @@ if prompt := st.chat_input("Ask about places, weather, reviews, transport..."):
             placeholder.markdown(main_chat_output.replace("\n", "<br>"), unsafe_allow_html=True)
 
             st.session_state.messages.append({"role": "assistant", "content": main_chat_output})
+            trim_messages(st.session_state.messages)
+
+            map_places = stream_parser.parse_place_links(displays["PLACES"])
+            if map_places:
+                map_layer.sessions.get(st.session_state.session_key).update(
+                    PlaceBatch.from_dicts(map_places), stream_parser.parse_place_links(displays["REVIEWS"]),
+                    (st.session_state.user_lat, st.session_state.user_lng))
+                render_map()
+            agent_runtime.mark("first_answer")
+            render_timings()
 
             return full_text
 
         asyncio.run(run_agents())
+
+agent_runtime.mark("first_render")
@@ -0,0 +1,231 @@
+import asyncio
+import csv
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import rate_limiter
+from place_cache import normalize_query
+
+# Batch mode: stream (lat, lon, query) rows from JSONL/CSV, compute each distinct
+# (lat, lon, query) once with a bounded worker pool, and append results to a JSONL
+# file as they complete. Distances and routes depend on the exact coordinates, so
+# nearby rows are not merged here; they share work through the tile, weather and
+# route caches instead. The output file doubles as the checkpoint: rerunning with
+# the same --out skips rows already written. Weather for every cell in the input is
+# fetched up front in a few batched calls (weather_batch) instead of row by row.
+# Rows that cannot be answered (malformed input, a place search that never left
+# the Nominatim queue) are written as error rows, which a resumed run retries.
+REPORT_EVERY_S = 10
+
+
+def read_rows(path):
+    """Yield dicts with id, lat, lon, query from a .jsonl or .csv file; malformed rows as {"id", "error"}."""
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            for i, row in enumerate(csv.DictReader(f)):
+                yield _row(i, row)
+    else:
+        with open(path, encoding="utf-8") as f:
+            for i, line in enumerate(f):
+                if line.strip():
+                    try:
+                        raw = json.loads(line)
+                    except json.JSONDecodeError as e:
+                        yield {"id": str(i), "error": f"bad row: {e}"}
+                        continue
+                    yield _row(i, raw)
+
+
+def _row(i, raw):
+    try:
+        return {
+            "id": str(raw.get("id", i)),
+            "lat": float(raw["lat"]),
+            "lon": float(raw.get("lon", raw.get("lng"))),
+            "query": str(raw["query"]),
+        }
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        row_id = raw.get("id", i) if isinstance(raw, dict) else i
+        return {"id": str(row_id), "error": f"bad row: {type(e).__name__}: {e}"}
+
+
+def row_key(row):
+    return f"{row['lat']!r},{row['lon']!r}|{normalize_query(row['query'])}"
+
+
+def load_checkpoint(out_path):
+    """(ids already written, {key: answer}) from a previous run's output."""
+    done_ids, answers = set(), {}
+    if not os.path.exists(out_path):
+        return done_ids, answers
+    with open(out_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn last line from an interrupted run
+            # Rows that failed are retried on resume
+            if "answer" in rec:
+                done_ids.add(rec["id"])
+                answers[rec["key"]] = rec["answer"]
+    return done_ids, answers
+
+
+def warm_weather(in_path, skip_ids=()):
+    """
+    Fetch the weather of every distinct weather cell in the input with batched
+    Open-Meteo calls, before the rows are processed; returns the number of cells.
+    """
+    from agent_weather import get_weather_many
+    import weather_batch
+    from weather_cache import cell_of
+    cells = {}
+    for row in read_rows(in_path):
+        if "error" not in row and row["id"] not in skip_ids:
+            cells.setdefault(cell_of(row["lat"], row["lon"]), (row["lat"], row["lon"]))
+    points = list(cells.values())
+    group = weather_batch.BATCH_SIZE * weather_batch.BATCH_CONCURRENCY
+    for i in range(0, len(points), group):
+        get_weather_many(points[i:i + group])
+    return len(points)
+
+
+def _pipeline(lat, lon, query):
+    """
+    The tool pipeline without the interactive deadline: a batch row waits for
+    its turn at Nominatim. Raises StillQueued if the place search still came back late.
+    """
+    import agent_router
+    result = agent_router.combined_result(lat, lon, query, deadline_s=math.inf)
+    late = result.get("places_error")
+    if late:
+        raise rate_limiter.StillQueued(late["eta_s"])
+    return agent_router.render_combined(result)
+
+
+class _AgentPipeline:
+    """Runs each query through the router agent instead of calling the tools directly."""
+
+    def __init__(self):
+        import agent_runtime
+        self.runtime = agent_runtime
+        self.runner = agent_runtime.get_runner()
+
+    async def _run(self, lat, lon, query):
+        session_id = uuid.uuid4().hex
+        await self.runtime.ensure_session("batch", session_id)
+        msg = self.runtime.user_message(f"My location is {lat},{lon}. {query}")
+        parts = []
+        async for event in self.runner.run_async(user_id="batch", session_id=session_id, new_message=msg):
+            if event.content and event.content.parts and event.content.parts[0].text:
+                parts.append(event.content.parts[0].text)
+        await self.runtime.delete_session("batch", session_id)
+        return "".join(parts)
+
+    def __call__(self, lat, lon, query):
+        return asyncio.run(self._run(lat, lon, query))
+
+
+def run_batch(in_path, out_path, workers=4, use_agent=False, max_pending=None, prewarm_weather=True):
+    """Process every row of `in_path`, appending results to `out_path`. Returns the summary dict."""
+    pipeline = _AgentPipeline() if use_agent else _pipeline
+
+    done_ids, answers = load_checkpoint(out_path)
+    waiting = {}  # key -> rows waiting on an in-flight computation
+    lock = threading.Lock()
+    slots = threading.BoundedSemaphore(max_pending or workers * 2)  # backpressure on the reader
+    counts = {"rows": 0, "skipped": 0, "computed": 0, "deduped": 0, "errors": 0, "written": 0}
+    start = time.monotonic()
+    if prewarm_weather:
+        with metrics.span("batch.warm_weather"):
+            counts["weather_cells"] = warm_weather(in_path, done_ids)
+    last_report = [start]
+
+    out = open(out_path, "a", encoding="utf-8")
+
+    def write(row, key, answer=None, error=None, elapsed=None):
+        rec = {"id": row["id"], "lat": row.get("lat"), "lon": row.get("lon"), "query": row.get("query"), "key": key}
+        if error is None:
+            rec["answer"] = answer
+        else:
+            rec["error"] = error
+        if elapsed is not None:
+            rec["elapsed_s"] = round(elapsed, 3)
+        out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        out.flush()
+        counts["written"] += 1
+
+    def report(final=False):
+        now = time.monotonic()
+        if not final and now - last_report[0] < REPORT_EVERY_S:
+            return
+        last_report[0] = now
+        elapsed = now - start
+        rate = counts["written"] / elapsed if elapsed else 0.0
+        print(f"[batch] {counts['written']} written, {counts['computed']} computed, "
+              f"{counts['deduped']} deduped, {counts['skipped']} resumed, {counts['errors']} errors "
+              f"- {rate:.1f} rows/s", flush=True)
+
+    def work(row, key):
+        # Batch traffic yields to interactive and prefetch requests at the Nominatim scheduler
+        rate_limiter.current_priority.set(rate_limiter.BATCH)
+        rate_limiter.current_session.set("batch")
+        t0 = time.perf_counter()
+        try:
+            try:
+                answer, error = pipeline(row["lat"], row["lon"], row["query"]), None
+            except Exception as e:
+                answer, error = None, f"{type(e).__name__}: {e}"
+            elapsed = time.perf_counter() - t0
+            metrics.observe("batch.row", elapsed)
+            with lock:
+                rows = waiting.pop(key, [])
+                if error is None:
+                    answers[key] = answer
+                    counts["computed"] += 1
+                else:
+                    counts["errors"] += 1
+                for r in rows:
+                    write(r, key, answer, error, elapsed if r is row else None)
+                report()
+        finally:
+            # Even if writing fails, so the reader is never left waiting for a slot
+            slots.release()
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch") as pool:
+            for row in read_rows(in_path):
+                key = None if "error" in row else row_key(row)
+                with lock:
+                    counts["rows"] += 1
+                    if row["id"] in done_ids:
+                        counts["skipped"] += 1
+                        continue
+                    if key is None:
+                        counts["errors"] += 1
+                        write(row, key, error=row["error"])
+                        continue
+                    if key in answers:
+                        counts["deduped"] += 1
+                        write(row, key, answers[key])
+                        continue
+                    if key in waiting:
+                        counts["deduped"] += 1
+                        waiting[key].append(row)
+                        continue
+                    waiting[key] = [row]
+                slots.acquire()
+                pool.submit(work, row, key)
+    finally:
+        out.close()
+
+    report(final=True)
+    counts["elapsed_s"] = round(time.monotonic() - start, 2)
+    counts["rows_per_s"] = round(counts["written"] / counts["elapsed_s"], 2) if counts["elapsed_s"] else 0.0
+    return counts
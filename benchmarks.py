@@ -0,0 +1,266 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import timeit
+
+# Offline micro-benchmarks for the pipeline's pure hot paths.
+#
+#   python benchmarks.py run --out bench_baseline.json
+#   python benchmarks.py compare bench_baseline.json bench_current.json --threshold 0.15
+#   python benchmarks.py check    # the timed decoders still give the right answers
+#
+# Inputs are generated from recorded Nominatim responses in bench_fixtures/,
+# so nothing here touches the network.
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_fixtures", "nominatim_cafe.json")
+DEFAULT_SIZES = (10, 100, 1000, 10000, 100000)
+USER_LAT, USER_LON = 12.9716, 77.5946
+
+
+# Inputs
+def raw_records(n, seed=0):
+    """n Nominatim records cloned from the fixture with jittered coordinates and unique names."""
+    with open(FIXTURE, encoding="utf-8") as f:
+        fixture = json.load(f)
+    rng = random.Random(seed)
+    records = []
+    for i in range(n):
+        rec = dict(fixture[i % len(fixture)])
+        rec["name"] = f"{rec['name']} #{i}"
+        rec["lat"] = f"{float(rec['lat']) + rng.uniform(-0.04, 0.04):.7f}"
+        rec["lon"] = f"{float(rec['lon']) + rng.uniform(-0.04, 0.04):.7f}"
+        records.append(rec)
+    return records
+
+
+def lean_records(n):
+    """What jsonv2 without addressdetails sends: no "address", "class" renamed "category"."""
+    return [{("category" if k == "class" else k): v for k, v in r.items() if k != "address"}
+            for r in raw_records(n)]
+
+
+def place_batch(n):
+    import places_tool
+    return places_tool.normalize_places(raw_records(n)).with_distances(USER_LAT, USER_LON)
+
+
+def places(n):
+    """The same places as plain dicts, as tools exchange them with the agent."""
+    return place_batch(n).to_dicts()
+
+
+def answer_text(n):
+    """A combined_places_review_and_route-style answer listing n places."""
+    ps = places(n)
+    return (
+        "[WEATHER]\nTemperature: 24.1°C\nCondition: N/A\nWind speed: 7.2 km/h\n"
+        + "[PLACES]\n" + "\n".join(f"• {p['name']} ([map]({p['link']}))" for p in ps)
+        + "[REVIEWS]\n" + "\n".join(f"⭐ {p['rating']} — {p['name']} ([map]({p['link']}))" for p in ps[:3])
+        + "[TRANSPORT]\n" + "\n".join(f"{p['name']} → \n**🚶 0.4 km — Walking.**" for p in ps[:3])
+    )
+
+
+# Benchmarks: name -> setup(n) returning a zero-argument callable to time
+def _bench_normalize(n):
+    import places_tool
+    raw = raw_records(n)
+    return lambda: places_tool.normalize_places(raw)
+
+
+def _bench_haversine_fallback(n):
+    from agent_route import fallback_route
+    ps = places(n)
+    return lambda: [fallback_route(USER_LAT, USER_LON, p["lat"], p["lon"]) for p in ps]
+
+
+def _bench_distance_batch(n):
+    import geo_distance
+    coords = [(p["lat"], p["lon"]) for p in places(n)]
+    return lambda: geo_distance.distances_from(USER_LAT, USER_LON, coords)
+
+
+def _bench_top3_combined(n):
+    from agent_router import top_places
+    batch = place_batch(n)
+    return lambda: top_places(batch)
+
+
+def _bench_top3_reviews(n):
+    from agent_review import get_top_reviews
+    ps = places(n)
+    return lambda: get_top_reviews(ps)
+
+
+def _bench_nominatim_full_decode(n):
+    """The eager profile: whole body decoded, then normalized."""
+    import places_tool
+    body = json.dumps(raw_records(n)).encode("utf-8")
+    return lambda: places_tool.normalize_places(json.loads(body))
+
+
+def _bench_nominatim_lean_decode(n):
+    """The lean profile: 16 KB chunks decoded incrementally and projected, then normalized."""
+    import http_client
+    import places_providers
+    import places_tool
+    body = json.dumps(lean_records(n)).encode("utf-8")
+    chunks = [body[i:i + 16384] for i in range(0, len(body), 16384)]
+    return lambda: places_tool.normalize_places(
+        [places_providers.project(r) for r in http_client.iter_json_array(chunks)])
+
+
+def _bench_section_parse(n):
+    import stream_parser
+    text = answer_text(n)
+    return lambda: stream_parser.parse_sections(text)
+
+
+def _bench_section_stream(n):
+    import stream_parser
+    text = answer_text(n)
+    chunks = [text[i:i + 64] for i in range(0, len(text), 64)]
+
+    def run():
+        parser = stream_parser.SectionStreamParser()
+        for chunk in chunks:
+            parser.feed(chunk)
+        parser.finish()
+    return run
+
+
+BENCHMARKS = {
+    "normalize": _bench_normalize,
+    "haversine_fallback": _bench_haversine_fallback,
+    "distance_batch": _bench_distance_batch,
+    "top3_combined": _bench_top3_combined,
+    "top3_reviews": _bench_top3_reviews,
+    "nominatim_full_decode": _bench_nominatim_full_decode,
+    "nominatim_lean_decode": _bench_nominatim_lean_decode,
+    "section_parse": _bench_section_parse,
+    "section_stream": _bench_section_stream,
+}
+
+
+# Checks: name -> function raising AssertionError when a timed path gives a wrong answer
+def _check_chunked_decode(sizes=(10, 1000), rounds=20, seed=0):
+    """Random chunk boundaries (inside numbers, strings, multi-byte characters) must not change iter_json_array's result."""
+    import http_client
+    rng = random.Random(seed)
+    # Top-level numbers and literals too: they are the elements that can end exactly at a chunk boundary
+    scalars = [rng.choice([rng.uniform(-1e6, 1e6), rng.randint(-10 ** 9, 10 ** 9), 1e-7, True, False, None, "ü"])
+               for _ in range(200)]
+    for n, records in [(n, lean_records(n)) for n in sizes] + [(len(scalars), scalars)]:
+        body = json.dumps(records, ensure_ascii=False).encode("utf-8")
+        for _ in range(rounds):
+            cuts = sorted(rng.sample(range(1, len(body)), min(len(body) - 1, rng.randint(1, 200))))
+            chunks = [body[a:b] for a, b in zip([0] + cuts, cuts + [len(body)])]
+            try:
+                decoded = list(http_client.iter_json_array(chunks))
+            except ValueError as e:
+                raise AssertionError(f"iter_json_array: chunked decode of {n} elements failed: {e}") from e
+            if decoded != records:
+                raise AssertionError(f"iter_json_array: chunked decode of {n} elements differs from json.loads")
+
+
+CHECKS = {
+    "chunked_decode": _check_chunked_decode,
+}
+
+
+def time_call(fn, repeat=5):
+    """Best-of-`repeat` seconds per call, with the loop count auto-scaled to ~0.1 s per sample."""
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    number = max(1, number // 2)
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def run(names, sizes, repeat):
+    results = {}
+    for name in names:
+        results[name] = {}
+        for n in sizes:
+            fn = BENCHMARKS[name](n)
+            seconds = time_call(fn, repeat)
+            results[name][str(n)] = seconds
+            print(f"{name:<20} n={n:<7} {seconds * 1e6:12.1f} µs")
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+
+
+def compare(baseline, current, threshold):
+    """Print a ratio table; return the list of (name, size, ratio) regressions beyond `threshold`."""
+    regressions = []
+    for name, sizes in current["results"].items():
+        for size, seconds in sizes.items():
+            base = baseline["results"].get(name, {}).get(size)
+            if not base:
+                continue
+            ratio = seconds / base
+            flag = ""
+            if ratio > 1 + threshold:
+                flag = "  REGRESSION"
+                regressions.append((name, size, ratio))
+            elif ratio < 1 - threshold:
+                flag = "  faster"
+            print(f"{name:<20} n={size:<7} {base * 1e6:12.1f} → {seconds * 1e6:12.1f} µs  x{ratio:.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline micro-benchmarks for pipeline hot paths.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_p = sub.add_parser("run", help="Run benchmarks and write results as JSON")
+    run_p.add_argument("--out", default="bench_results.json")
+    run_p.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)))
+    run_p.add_argument("--only", default="", help="Comma-separated benchmark names")
+    run_p.add_argument("--repeat", type=int, default=5)
+    cmp_p = sub.add_parser("compare", help="Compare results against a baseline")
+    cmp_p.add_argument("baseline")
+    cmp_p.add_argument("current")
+    cmp_p.add_argument("--threshold", type=float, default=0.15, help="Allowed slowdown, e.g. 0.15 = 15%%")
+    sub.add_parser("check", help="Check that the benchmarked code paths give correct results")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        names = [n for n in args.only.split(",") if n] or list(BENCHMARKS)
+        unknown = set(names) - set(BENCHMARKS)
+        if unknown:
+            parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+        sizes = [int(s) for s in args.sizes.split(",")]
+        report = run(names, sizes, args.repeat)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.out}")
+    elif args.command == "check":
+        failed = 0
+        for name, check in CHECKS.items():
+            try:
+                check()
+            except AssertionError as e:
+                failed += 1
+                print(f"FAIL {name}: {e}")
+            else:
+                print(f"ok   {name}")
+        sys.exit(1 if failed else 0)
+    else:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        with open(args.current, encoding="utf-8") as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}")
+            sys.exit(1)
+        print("No regressions.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+import os
+import re
+import threading
+import time
+
+import agent_runtime
+import metrics
+import stream_parser
+
+# Bounded conversation history for long-lived chat sessions.
+# Each browser session talks to a series of ADK sessions ("generations"). Once a
+# generation holds HISTORY_MAX_TURNS turns it is compacted: its turns are folded
+# into a short text summary, the ADK session (with all its tool payloads such as
+# full place lists) is deleted, and the next prompt starts a fresh generation
+# with the summary prepended. Prompt size therefore stays bounded by
+# max_turns turns plus HISTORY_SUMMARY_CHARS, however long the tab stays open.
+# Sessions idle for HISTORY_IDLE_TTL_S are evicted entirely.
+MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", "6"))
+SUMMARY_CHARS = int(os.getenv("HISTORY_SUMMARY_CHARS", "1200"))
+IDLE_TTL_S = float(os.getenv("HISTORY_IDLE_TTL_S", "1800"))
+DISPLAY_MESSAGES = int(os.getenv("HISTORY_DISPLAY_MESSAGES", "40"))
+EVICT_INTERVAL_S = 60.0
+
+_LOCATION_RE = re.compile(r"^My location is [^.]*\.\s*")
+_PLACE_RE = re.compile(r"⭐\s*[\d.]+\s*—\s*\[?([^\]\(\n]+)")
+
+
+def gist(prompt, answer):
+    """One summary line for a turn: what was asked and what came back, without the tool payloads."""
+    asked = _LOCATION_RE.sub("", prompt).strip()[:80]
+    sections = stream_parser.parse_sections(answer or "")
+    facts = []
+    weather = stream_parser.parse_weather(sections.get("WEATHER", ""))
+    if weather.get("temperature") not in (None, "N/A"):
+        facts.append(f"weather {weather['temperature']}°C")
+    picks = [m.strip() for m in _PLACE_RE.findall(sections.get("REVIEWS", ""))][:3]
+    if picks:
+        facts.append("top picks: " + ", ".join(picks))
+    if not facts:
+        text = " ".join((answer or "").split())
+        facts.append(text[:120] + ("…" if len(text) > 120 else ""))
+    return f'- asked "{asked}" → {"; ".join(facts)}'
+
+
+def trim_messages(messages, limit=DISPLAY_MESSAGES):
+    """Keep only the last `limit` chat messages shown in the UI (in place)."""
+    if len(messages) > limit:
+        del messages[:-limit]
+    return messages
+
+
+class _Conversation:
+    __slots__ = ("user_id", "key", "generation", "turns", "summary", "unseen",
+                 "last_active", "prompts", "last_prompt_chars", "max_prompt_chars", "compactions")
+
+    def __init__(self, user_id, key):
+        self.user_id = user_id
+        self.key = key
+        self.generation = 0
+        self.turns = []            # (gist line, chars sent/received) per turn in the current ADK session
+        self.summary = []          # gist lines of compacted turns, oldest first
+        self.unseen = []           # summary lines the current ADK session has not been told yet
+        self.last_active = time.time()
+        self.prompts = 0
+        self.last_prompt_chars = 0
+        self.max_prompt_chars = 0
+        self.compactions = 0
+
+    @property
+    def session_id(self):
+        return f"{self.key}-{self.generation}"
+
+    def held_chars(self):
+        """Approximate text held for this conversation: the live ADK session's turns plus the summary."""
+        return sum(chars for _, chars in self.turns) + sum(len(line) for line in self.summary)
+
+    def summary_text(self):
+        return "\n".join(self.summary)
+
+    def add_summary(self, lines):
+        self.summary.extend(lines)
+        while len(self.summary) > 1 and sum(len(line) + 1 for line in self.summary) > SUMMARY_CHARS:
+            self.summary.pop(0)
+        self.unseen.extend(lines)
+
+
+class HistoryManager:
+    def __init__(self, max_turns=MAX_TURNS, idle_ttl_s=IDLE_TTL_S):
+        self.max_turns = max_turns
+        self.idle_ttl_s = idle_ttl_s
+        self._conversations = {}
+        self._lock = threading.Lock()
+        self._last_evict = time.time()
+        self.counters = {"compactions": 0, "evicted": 0}
+
+    def _get(self, user_id, key):
+        conv = self._conversations.get(key)
+        if conv is None:
+            conv = self._conversations[key] = _Conversation(user_id, key)
+        conv.last_active = time.time()
+        return conv
+
+    async def prepare(self, user_id, key, prompt):
+        """(adk_session_id, message_text) for the next agent turn, compacting the window first if it is full."""
+        await self.evict_idle()
+        stale = None
+        with self._lock:
+            conv = self._get(user_id, key)
+            if len(conv.turns) >= self.max_turns:
+                conv.add_summary([line for line, _ in conv.turns])
+                stale = conv.session_id
+                conv.turns = []
+                conv.generation += 1
+                conv.unseen = list(conv.summary)  # a fresh ADK session needs the whole summary
+                conv.compactions += 1
+                self.counters["compactions"] += 1
+            message = prompt
+            if conv.unseen:
+                message = "Earlier in this conversation:\n" + "\n".join(conv.unseen) + f"\n\n{prompt}"
+                conv.unseen = []
+            session_id = conv.session_id
+            conv.prompts += 1
+            conv.last_prompt_chars = len(message)
+            conv.max_prompt_chars = max(conv.max_prompt_chars, len(message))
+        if stale is not None:
+            await self._drop_session(user_id, stale)
+        return session_id, message
+
+    def record(self, user_id, key, prompt, answer, via_agent=True):
+        """Remember a finished turn as its gist; only the ADK session keeps the full text.
+
+        Fast-path turns never reached the agent, so they go straight to the summary.
+        """
+        line = gist(prompt, answer)
+        with self._lock:
+            conv = self._get(user_id, key)
+            if via_agent:
+                conv.turns.append((line, len(prompt) + len(answer or "")))
+            else:
+                conv.add_summary([line])
+
+    async def evict_idle(self, now=None):
+        """Forget sessions idle longer than idle_ttl_s and delete their ADK sessions; returns the evicted keys."""
+        now = time.time() if now is None else now
+        if now - self._last_evict < EVICT_INTERVAL_S:
+            return []
+        self._last_evict = now
+        with self._lock:
+            idle = [c for c in self._conversations.values() if now - c.last_active > self.idle_ttl_s]
+            for conv in idle:
+                del self._conversations[conv.key]
+            self.counters["evicted"] += len(idle)
+        for conv in idle:
+            await self._drop_session(conv.user_id, conv.session_id)
+        return [conv.key for conv in idle]
+
+    async def _drop_session(self, user_id, session_id):
+        if agent_runtime.has_session(user_id, session_id):
+            try:
+                await agent_runtime.delete_session(user_id, session_id)
+            except Exception:
+                pass
+
+    def session_stats(self, key):
+        with self._lock:
+            conv = self._conversations.get(key)
+            if conv is None:
+                return {}
+            return {
+                "generation": conv.generation,
+                "turns_in_window": len(conv.turns),
+                "summary_chars": len(conv.summary_text()),
+                "held_chars": conv.held_chars(),
+                "prompts": conv.prompts,
+                "last_prompt_chars": conv.last_prompt_chars,
+                "max_prompt_chars": conv.max_prompt_chars,
+                "compactions": conv.compactions,
+                "idle_s": time.time() - conv.last_active,
+            }
+
+    def stats(self):
+        with self._lock:
+            keys = list(self._conversations)
+            stats = dict(self.counters)
+        per_session = {key: self.session_stats(key) for key in keys}
+        held = [s["held_chars"] for s in per_session.values() if s]
+        stats.update({
+            "sessions": len(per_session),
+            "held_chars_total": sum(held),
+            "held_chars_max": max(held, default=0),
+            "prompt_chars_max": max((s["max_prompt_chars"] for s in per_session.values() if s), default=0),
+            "per_session": per_session,  # JSON-lines export only; Prometheus keeps the flat numbers
+        })
+        return stats
+
+
+history = HistoryManager()
+metrics.register_collector("history", history.stats)
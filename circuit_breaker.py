@@ -0,0 +1,117 @@
+import threading
+import time
+
+import metrics
+
+# Circuit breaker for a flaky dependency.
+#   closed    - calls go through; consecutive failures are counted
+#   open      - calls fail fast with CircuitOpen; a background probe polls the dependency
+#   half_open - after reset_timeout_s a limited number of trial calls go through;
+#               a success closes the circuit, a failure re-opens it
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling the dependency while the circuit is open."""
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=3, reset_timeout_s=30.0, half_open_max_calls=1,
+                 probe=None, probe_interval_s=5.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self.half_open_max_calls = half_open_max_calls
+        self.probe = probe
+        self.probe_interval_s = probe_interval_s
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_calls = 0
+        self._lock = threading.Lock()
+        self._probe_thread = None
+        self.counters = {"calls": 0, "failures": 0, "short_circuited": 0, "opened": 0, "probes": 0}
+        metrics.register_collector(f"breaker_{name}", self.stats)
+
+    def _set_state(self, state):
+        """Caller holds the lock."""
+        if state == self.state:
+            return
+        self.state = state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+            self.counters["opened"] += 1
+            self._start_probe()
+        elif state == CLOSED:
+            self._failures = 0
+        self._trial_calls = 0
+
+    def allow(self):
+        """Whether a call may go through now; moves open -> half_open once the reset timeout passed."""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout_s:
+                self._set_state(HALF_OPEN)
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and self._trial_calls < self.half_open_max_calls:
+                self._trial_calls += 1
+                return True
+            self.counters["short_circuited"] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._set_state(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.counters["failures"] += 1
+            self._failures += 1
+            if self.state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._set_state(OPEN)
+                self._opened_at = time.monotonic()
+
+    def call(self, fn, *args, **kwargs):
+        """Run fn through the breaker; any exception it raises counts as a failure."""
+        if not self.allow():
+            raise CircuitOpen(f"{self.name} circuit is open")
+        with self._lock:
+            self.counters["calls"] += 1
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    # Background health probe: restores the circuit as soon as the dependency answers again
+    def _start_probe(self):
+        if self.probe is None or (self._probe_thread and self._probe_thread.is_alive()):
+            return
+        self._probe_thread = threading.Thread(target=self._probe_loop, name=f"{self.name}-probe", daemon=True)
+        self._probe_thread.start()
+
+    def _probe_loop(self):
+        while True:
+            time.sleep(self.probe_interval_s)
+            with self._lock:
+                if self.state == CLOSED:
+                    return
+                self.counters["probes"] += 1
+            try:
+                healthy = self.probe()
+            except Exception:
+                healthy = False
+            if healthy:
+                self.record_success()
+                return
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["state"] = _STATE_VALUES[self.state]
+            stats["consecutive_failures"] = self._failures
+        return stats
@@ -0,0 +1,54 @@
+import numpy as np
+
+# Batched great-circle distances over coordinate arrays.
+# Replaces pair-at-a-time math.haversine loops when ranking or routing many places.
+EARTH_RADIUS_KM = 6371.0
+
+
+def _as_coords(points):
+    """(n, 2) float array of (lat, lon) from a list of pairs or an existing array."""
+    arr = np.asarray(points, dtype=np.float64)
+    return arr.reshape(-1, 2)
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Element-wise haversine distance in km; inputs broadcast like NumPy arrays."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def equirectangular_km(lat1, lon1, lat2, lon2):
+    """Flat-earth approximation; within ~0.1% of haversine for distances under a few tens of km."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    x = (lon2 - lon1) * np.cos((lat1 + lat2) / 2)
+    y = lat2 - lat1
+    return EARTH_RADIUS_KM * np.sqrt(x * x + y * y)
+
+
+def distance_matrix(origins, destinations, fast=False):
+    """
+    Distances in km between every origin and every destination.
+    Both arguments are sequences of (lat, lon); returns an (n_origins, n_destinations) array.
+    `fast=True` uses the equirectangular approximation.
+    """
+    o = _as_coords(origins)
+    d = _as_coords(destinations)
+    fn = equirectangular_km if fast else haversine_km
+    return fn(o[:, 0:1], o[:, 1:2], d[None, :, 0], d[None, :, 1])
+
+
+def distances_from(lat, lon, destinations, fast=False):
+    """1-D array of distances in km from one point to each destination."""
+    return distance_matrix([(lat, lon)], destinations, fast=fast)[0]
+
+
+def top_k_nearest(lat, lon, destinations, k, fast=False):
+    """Indices and distances of the k nearest destinations, nearest first."""
+    dist = distances_from(lat, lon, destinations, fast=fast)
+    k = min(k, dist.size)
+    if k <= 0:
+        return np.empty(0, dtype=np.intp), np.empty(0)
+    idx = np.argpartition(dist, k - 1)[:k]
+    idx = idx[np.argsort(dist[idx], kind="stable")]
+    return idx, dist[idx]
@@ -0,0 +1,211 @@
+import codecs
+import json
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+# Shared HTTP layer for every outbound call (Nominatim, Open-Meteo, OTP).
+# One keep-alive Session per host, so repeated tool calls reuse TCP/TLS connections.
+DEFAULT_TIMEOUT = float(os.getenv("HTTP_TIMEOUT_S", "10"))
+MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "2"))
+BACKOFF_S = float(os.getenv("HTTP_BACKOFF_S", "0.3"))
+# A longer Retry-After than this is not waited out: the error is raised instead
+MAX_RETRY_AFTER_S = float(os.getenv("HTTP_MAX_RETRY_AFTER_S", "5"))
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+USER_AGENT = "multi-agent-app"
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_sessions = {}
+_stats = {}
+_lock = threading.Lock()
+
+
+def _host(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def get_session(url):
+    """Return the pooled Session for the host of `url`, creating it on first use."""
+    host = _host(url)
+    session = _sessions.get(host)
+    if session is not None:
+        return session
+    with _lock:
+        if host not in _sessions:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update({
+                "User-Agent": USER_AGENT,
+                "Accept-Encoding": "gzip, deflate",
+            })
+            _sessions[host] = session
+            _stats[host] = {"requests": 0, "errors": 0, "retries": 0,
+                            "latency_total_s": 0.0, "latency_max_s": 0.0}
+        return _sessions[host]
+
+
+def _record(host, latency, error=False, retry=False):
+    metrics.observe("http", latency, host=host)
+    with _lock:
+        s = _stats[host]
+        s["requests"] += 1
+        s["latency_total_s"] += latency
+        s["latency_max_s"] = max(s["latency_max_s"], latency)
+        if error:
+            s["errors"] += 1
+        if retry:
+            s["retries"] += 1
+
+
+def _backoff(attempt, response=None):
+    """
+    Seconds to wait before the next attempt: a numeric Retry-After, otherwise
+    exponential backoff with full jitter. None when Retry-After asks for more
+    than MAX_RETRY_AFTER_S, i.e. the caller should give up now.
+    """
+    if response is not None:
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return float(retry_after) if float(retry_after) <= MAX_RETRY_AFTER_S else None
+    return random.uniform(0, BACKOFF_S * (2 ** attempt))
+
+
+def get(url, params=None, headers=None, timeout=None, retries=None, stream=False):
+    """
+    GET through the shared pool with retries on connection errors,
+    timeouts and retryable status codes (429/5xx).
+    Raises requests.HTTPError if the final response is an error status.
+    """
+    session = get_session(url)
+    host = _host(url)
+    timeout = DEFAULT_TIMEOUT if timeout is None else timeout
+    retries = MAX_RETRIES if retries is None else retries
+
+    for attempt in range(retries + 1):
+        last = attempt == retries
+        start = time.perf_counter()
+        try:
+            res = session.get(url, params=params, headers=headers, timeout=timeout, stream=stream)
+        except (requests.ConnectionError, requests.Timeout):
+            _record(host, time.perf_counter() - start, error=True, retry=not last)
+            if last:
+                raise
+            time.sleep(_backoff(attempt))
+            continue
+
+        retryable = res.status_code in RETRY_STATUSES
+        delay = _backoff(attempt, res) if retryable and not last else None
+        _record(host, time.perf_counter() - start, error=res.status_code >= 400, retry=delay is not None)
+        if delay is not None:
+            res.close()
+            time.sleep(delay)
+            continue
+        res.raise_for_status()
+        return res
+
+
+def get_json(url, params=None, headers=None, timeout=None, retries=None):
+    return get(url, params=params, headers=headers, timeout=timeout, retries=retries).json()
+
+
+# What may still follow a number or literal that ends a chunk ("3." + "25", "1" + "e5")
+_SCALAR_TAIL = frozenset("0123456789.eE+- \t\r\n")
+
+
+def iter_json_array(chunks):
+    """
+    Yield the elements of a JSON array as soon as each one is complete, from an
+    iterable of byte chunks; only the current, unfinished element is buffered.
+    Raises ValueError if the document is not an array or ends early.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")()
+    buf, pos, started = "", 0, False
+    for chunk in chunks:
+        buf = buf[pos:] + text.decode(chunk)
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(buf):
+                break
+            if not started:
+                if buf[pos] != "[":
+                    raise ValueError("expected a JSON array")
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                break  # element continues in the next chunk
+            if not isinstance(item, (dict, list, str)) and all(c in _SCALAR_TAIL for c in buf[end:]):
+                break  # a number or literal may go on in the next chunk
+            yield item
+            pos = end
+    raise ValueError("JSON array ended early")
+
+
+def get_json_items(url, params=None, headers=None, timeout=None, retries=None, chunk_size=16384):
+    """
+    GET a JSON array and yield its elements as they are decoded from the
+    (decompressed) body, instead of loading the whole document first.
+    """
+    res = get(url, params=params, headers=headers, timeout=timeout, retries=retries, stream=True)
+    with res:
+        yield from iter_json_array(res.iter_content(chunk_size))
+
+
+def post_json(url, payload, headers=None, timeout=None):
+    """
+    POST a JSON body through the shared pool and return the decoded answer.
+    Not retried (the call may not be idempotent); raises requests.HTTPError on error statuses.
+    """
+    session = get_session(url)
+    host = _host(url)
+    timeout = DEFAULT_TIMEOUT if timeout is None else timeout
+    start = time.perf_counter()
+    try:
+        res = session.post(url, json=payload, headers=headers, timeout=timeout)
+    except (requests.ConnectionError, requests.Timeout):
+        _record(host, time.perf_counter() - start, error=True)
+        raise
+    _record(host, time.perf_counter() - start, error=res.status_code >= 400)
+    res.raise_for_status()
+    return res.json()
+
+
+def stats():
+    """Per-host request counts, latency and connection pool usage."""
+    report = {}
+    with _lock:
+        for host, s in _stats.items():
+            entry = dict(s)
+            entry["latency_avg_s"] = s["latency_total_s"] / s["requests"] if s["requests"] else 0.0
+            pools = _sessions[host].get_adapter(host).poolmanager.pools
+            entry["open_connections"] = sum(
+                pools[key].num_connections for key in pools.keys()
+            )
+            entry["pool_requests"] = sum(pools[key].num_requests for key in pools.keys())
+            report[host] = entry
+    return report
+
+
+def _flat_stats():
+    return {f"{host}.{key}": value for host, entry in stats().items() for key, value in entry.items()}
+
+
+metrics.register_collector("http", _flat_stats)
@@ -0,0 +1,198 @@
+import argparse
+import importlib
+import os
+import re
+import threading
+
+import metrics
+
+# Deterministic fast path in front of the Gemini router agent.
+# Simple prompts ("weather", "cafes near me", "nearest atm") are classified locally
+# and answered by calling the tools directly; anything ambiguous returns None and
+# goes to the agent as before. The tools only know the user's own location and
+# the current conditions, so prompts naming another place ("weather in London")
+# or a future time ("will it rain tomorrow") always go to the agent.
+#
+#   python intent_router.py check            # classify EXAMPLES, exit 1 on a mismatch
+#   python intent_router.py classify "weather in London"
+WEATHER_WORDS = {"weather", "temperature", "temp", "wind", "windy", "rain", "raining", "forecast",
+                 "hot", "cold", "humid", "sunny", "alert", "alerts"}
+PLACE_CUES = ("near me", "nearby", "near by", "nearest", "closest", "around me", "around here",
+              "close to me", "close by", "in my area", "near here")
+CATEGORIES = {"cafe", "coffee", "restaurant", "atm", "bank", "hospital", "clinic", "pharmacy", "chemist",
+              "hotel", "bar", "pub", "park", "school", "supermarket", "grocery", "fuel", "petrol",
+              "gas station", "petrol pump", "metro", "metro station", "bus stop", "station", "museum",
+              "gym", "parking", "bakery", "library", "cinema", "theatre", "post office", "police",
+              "toilet", "mall", "temple", "church", "mosque", "salon", "dentist", "doctor", "food"}
+FILLER = re.compile(
+    r"^(please\s+)?(can you\s+|could you\s+)?(find|show|search for|search|list|get|locate|where is|"
+    r"where are|where can i find|i need|i want|looking for|any|some|the|a|an)\s+"
+)
+# Anything that needs the LLM's reasoning: comparisons, follow-ups, plans, multiple asks
+AMBIGUOUS = re.compile(r"\b(and|or|but|vs|versus|compare|which|why|how|should|plan|book|open now|tomorrow|later)\b")
+# "in/at/for" + a noun phrase that is not the user's own spot or a unit names somewhere else
+OTHER_PLACE = re.compile(r"\b(in|at|for)\s+(?!(me|my|here|now|the moment|present|this area|the area|celsius|fahrenheit)\b)\w+")
+FUTURE = re.compile(r"\b(will|going to|gonna|forecast|tomorrow|tonight|later|weekend|next|upcoming|soon|"
+                    r"this (morning|afternoon|evening|week)|monday|tuesday|wednesday|thursday|friday|saturday|sunday)\b")
+
+MIN_CONFIDENCE = float(os.getenv("INTENT_MIN_CONFIDENCE", "0.8"))
+
+_counters = {"prompts": 0, "fast_weather": 0, "fast_places": 0, "agent": 0, "errors": 0}
+_lock = threading.Lock()
+_model = None
+
+
+def set_model(model):
+    """
+    Plug in an optional on-box classifier used when the rules abstain.
+    `model(prompt)` returns (intent, query, confidence) with intent in
+    {"weather", "places", None}.
+    """
+    global _model
+    _model = model
+
+
+# INTENT_MODEL="package.module:function" loads a classifier at import time
+if os.getenv("INTENT_MODEL"):
+    _mod, _, _fn = os.getenv("INTENT_MODEL").partition(":")
+    set_model(getattr(importlib.import_module(_mod), _fn))
+
+
+def _singular(word):
+    return word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+
+
+def classify(prompt):
+    """Return (intent, query, confidence); intent is "weather", "places" or None."""
+    text = re.sub(r"[^\w\s']", " ", prompt.lower())
+    text = " ".join(text.split())
+    if not text:
+        return None, None, 0.0
+    words = text.split()
+    if OTHER_PLACE.search(text) or FUTURE.search(text):
+        # Not answerable from the user's location and current conditions, whatever the intent
+        return None, None, 0.0
+
+    has_weather = any(w in WEATHER_WORDS for w in words)
+    has_cue = any(cue in text for cue in PLACE_CUES)
+    ambiguous = bool(AMBIGUOUS.search(text))
+
+    if has_weather and not has_cue and not ambiguous and len(words) <= 8:
+        return "weather", None, 0.95
+
+    if not has_weather and not ambiguous:
+        query = text
+        for cue in PLACE_CUES:
+            query = query.replace(cue, " ")
+        query = " ".join(query.split())
+        while True:
+            stripped = FILLER.sub("", query)
+            if stripped == query:
+                break
+            query = stripped
+        query_words = query.split()
+        if 0 < len(query_words) <= 4:
+            singular = " ".join(_singular(w) for w in query_words)
+            if singular in CATEGORIES or query in CATEGORIES:
+                return "places", singular, 0.95
+            if has_cue:
+                return "places", query, 0.85
+
+    if _model is not None:
+        try:
+            return _model(prompt)
+        except Exception:
+            pass
+    return None, None, 0.0
+
+
+def _count(name):
+    with _lock:
+        _counters[name] += 1
+
+
+def fast_path(prompt, lat, lng):
+    """Rendered [WEATHER]/[PLACES]/[REVIEWS]/[TRANSPORT] answer, or None to fall back to the agent."""
+    _count("prompts")
+    intent, query, confidence = classify(prompt)
+    if intent is None or confidence < MIN_CONFIDENCE:
+        _count("agent")
+        return None
+
+    # Imported here so the classifier itself stays cheap to load
+    import agent_router
+    from agent_weather import get_weather
+    try:
+        if intent == "weather":
+            weather_text = agent_router.format_weather(get_weather(lat, lng))
+            answer = (f"[WEATHER]\n{weather_text}\n[PLACES]\nNone\n"
+                      f"[REVIEWS]\nNone\n[TRANSPORT]\nNone")
+        else:
+            answer = agent_router.combined_places_review_and_route(lat, lng, query)
+    except Exception:
+        _count("errors")
+        _count("agent")
+        return None
+    _count(f"fast_{intent}")
+    return answer
+
+
+def stats():
+    with _lock:
+        stats = dict(_counters)
+    fast = stats["fast_weather"] + stats["fast_places"]
+    stats["fast_path_ratio"] = fast / stats["prompts"] if stats["prompts"] else 0.0
+    return stats
+
+
+metrics.register_collector("intent_router", stats)
+
+# prompt -> the intent classify() must return (None: left to the agent)
+EXAMPLES = {
+    "weather": "weather",
+    "is it windy": "weather",
+    "what is the temperature": "weather",
+    "weather here": "weather",
+    "is it raining": "weather",
+    "temperature in celsius": "weather",
+    "cafes near me": "places",
+    "nearest atm": "places",
+    "find a pharmacy nearby": "places",
+    "gyms in my area": "places",
+    "what's the weather in London": None,
+    "rain at the airport": None,
+    "weather for Paris": None,
+    "cafes near me in Paris": None,
+    "will it rain tomorrow": None,
+    "forecast for tonight": None,
+    "weather this weekend": None,
+    "is it going to be cold": None,
+    "compare cafes and bars": None,
+}
+
+
+def check():
+    """Classify every EXAMPLES prompt; returns the list of (prompt, expected, got) mismatches."""
+    return [(prompt, expected, classify(prompt)[0]) for prompt, expected in EXAMPLES.items()
+            if classify(prompt)[0] != expected]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check or try the local intent classifier.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("check", help="Classify the built-in example prompts; exit 1 on a mismatch")
+    try_p = sub.add_parser("classify", help="Classify one prompt")
+    try_p.add_argument("prompt")
+    args = parser.parse_args()
+
+    if args.command == "check":
+        mismatches = check()
+        for prompt, expected, got in mismatches:
+            print(f"{prompt!r}: expected {expected}, got {got}")
+        print(f"{len(EXAMPLES) - len(mismatches)}/{len(EXAMPLES)} examples classified as expected")
+        raise SystemExit(1 if mismatches else 0)
+    print(classify(args.prompt))
+
+
+if __name__ == "__main__":
+    main()
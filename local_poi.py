@@ -0,0 +1,218 @@
+import argparse
+import csv
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# Offline POI engine.
+# An OSM extract is ingested once into a SQLite file holding an R*Tree spatial
+# index plus a term -> POI inverted index over names and category tags.
+# The file is opened read-only and memory-mapped, so bbox + category queries
+# run in milliseconds with no network.
+DB_PATH = os.getenv("LOCAL_POI_DB", "pois.sqlite")
+MMAP_BYTES = int(os.getenv("LOCAL_POI_MMAP_BYTES", str(512 * 1024 * 1024)))
+
+# Tags whose values describe what a place is ("amenity=cafe" -> "cafe")
+CATEGORY_TAGS = ("amenity", "shop", "tourism", "leisure", "cuisine", "healthcare", "office", "public_transport")
+STOPWORDS = {"a", "an", "the", "near", "nearby", "nearest", "me", "around", "in", "at", "closest", "find", "show", "best", "top"}
+
+_TOKEN_RE = re.compile(r"[^\W_]+", re.UNICODE)
+
+
+def tokenize(text):
+    tokens = set()
+    for tok in _TOKEN_RE.findall(str(text).lower()):
+        if tok in STOPWORDS:
+            continue
+        tokens.add(tok)
+        # Crude plural folding so "cafes" finds "cafe" and "atms" finds "atm"
+        if len(tok) > 3 and tok.endswith("s"):
+            tokens.add(tok[:-1])
+    return tokens
+
+
+def poi_terms(name, tags):
+    terms = tokenize(name or "")
+    for key in CATEGORY_TAGS:
+        if tags.get(key):
+            terms |= tokenize(tags[key].replace("_", " "))
+            terms.add(tags[key].lower())
+    return terms
+
+
+# Ingestion
+def _iter_json(path):
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    # Overpass export ({"elements": [...]}) or a plain list of Nominatim/OSM records
+    items = data.get("elements", []) if isinstance(data, dict) else data
+    for item in items:
+        tags = dict(item.get("tags") or item.get("extratags") or {})
+        lat = item.get("lat") or (item.get("center") or {}).get("lat")
+        lon = item.get("lon") or (item.get("center") or {}).get("lon")
+        name = tags.get("name") or item.get("name") or item.get("display_name")
+        if item.get("type") and item.get("class") and item.get("type") not in tags.values():
+            tags.setdefault(item["class"], item["type"])  # Nominatim class/type
+        yield name, lat, lon, tags
+
+
+def _iter_csv(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            lat = row.pop("lat", None)
+            lon = row.pop("lon", None) or row.pop("lng", None)
+            name = row.pop("name", None)
+            tags = {k: v for k, v in row.items() if k and v}
+            yield name, lat, lon, tags
+
+
+def _iter_pbf(path):
+    try:
+        import osmium
+    except ImportError:
+        raise SystemExit("Reading .pbf extracts needs the 'osmium' package (pip install osmium).")
+
+    rows = []
+
+    class Handler(osmium.SimpleHandler):
+        def node(self, n):
+            tags = {t.k: t.v for t in n.tags}
+            if tags.get("name") or any(k in tags for k in CATEGORY_TAGS):
+                rows.append((tags.get("name"), n.location.lat, n.location.lon, tags))
+
+    Handler().apply_file(path)
+    return rows
+
+
+def build_index(src, dst):
+    """Ingest an OSM extract (.pbf, .json or .csv) into a fresh index at `dst`. Returns the POI count."""
+    ext = os.path.splitext(src)[1].lower()
+    if ext == ".pbf":
+        rows = _iter_pbf(src)
+    elif ext == ".csv":
+        rows = _iter_csv(src)
+    else:
+        rows = _iter_json(src)
+
+    if os.path.exists(dst):
+        os.remove(dst)
+    conn = sqlite3.connect(dst)
+    conn.executescript("""
+        PRAGMA journal_mode=OFF;
+        PRAGMA synchronous=OFF;
+        CREATE TABLE pois (id INTEGER PRIMARY KEY, name TEXT, lat REAL, lon REAL, tags TEXT);
+        CREATE VIRTUAL TABLE poi_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon);
+        CREATE TABLE terms (term TEXT, poi_id INTEGER, PRIMARY KEY (term, poi_id)) WITHOUT ROWID;
+    """)
+    count = 0
+    with conn:
+        for name, lat, lon, tags in rows:
+            try:
+                lat, lon = float(lat), float(lon)
+            except (TypeError, ValueError):
+                continue
+            count += 1
+            conn.execute("INSERT INTO pois VALUES (?, ?, ?, ?, ?)",
+                         (count, name, lat, lon, json.dumps(tags, ensure_ascii=False)))
+            conn.execute("INSERT INTO poi_rtree VALUES (?, ?, ?, ?, ?)", (count, lat, lat, lon, lon))
+            conn.executemany("INSERT OR IGNORE INTO terms VALUES (?, ?)",
+                             [(t, count) for t in poi_terms(name, tags)])
+    conn.execute("ANALYZE")
+    conn.execute("VACUUM")
+    conn.close()
+    return count
+
+
+# Querying
+class LocalPOIIndex:
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._bounds = False  # not read yet
+
+    def _db(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if not os.path.exists(self.path):
+                raise FileNotFoundError(f"Local POI index not found: {self.path} (build it with local_poi.py build)")
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+            conn.execute(f"PRAGMA mmap_size={MMAP_BYTES}")
+            self._local.conn = conn
+        return conn
+
+    def bounds(self):
+        """(min_lon, min_lat, max_lon, max_lat) of every POI in the index, None when it is empty."""
+        if self._bounds is False:
+            row = self._db().execute("SELECT min(min_lon), min(min_lat), max(max_lon), max(max_lat) "
+                                     "FROM poi_rtree").fetchone()
+            self._bounds = None if row[0] is None else tuple(row)
+        return self._bounds
+
+    def query(self, box, text="", limit=40):
+        """POIs inside box (min_lon, min_lat, max_lon, max_lat) whose name/category matches every term of `text`."""
+        sql = ("SELECT p.name, p.lat, p.lon, p.tags FROM poi_rtree r JOIN pois p ON p.id = r.id "
+               "WHERE r.min_lat >= ? AND r.max_lat <= ? AND r.min_lon >= ? AND r.max_lon <= ?")
+        args = [box[1], box[3], box[0], box[2]]
+        # Require every query word, in its plural or singular form
+        for word in _TOKEN_RE.findall(str(text).lower()):
+            if word in STOPWORDS:
+                continue
+            singular = word[:-1] if len(word) > 3 and word.endswith("s") else word
+            sql += " AND p.id IN (SELECT poi_id FROM terms WHERE term IN (?, ?))"
+            args += [word, singular]
+        sql += " LIMIT ?"
+        args.append(limit)
+        return self._db().execute(sql, args).fetchall()
+
+    def search_raw(self, lat, lng, query, radius_deg=0.05, limit=40):
+        """Same contract as places_source.search_raw: Nominatim-shaped dicts."""
+        box = (lng - radius_deg, lat - radius_deg, lng + radius_deg, lat + radius_deg)
+        return self.search_box(box, query, limit)
+
+    def search_box(self, box, query, limit=40):
+        """Nominatim-shaped dicts for the POIs in box (min_lon, min_lat, max_lon, max_lat) matching `query`."""
+        results = []
+        for name, p_lat, p_lon, tags_json in self.query(box, query, limit):
+            tags = json.loads(tags_json)
+            address = {k[5:]: v for k, v in tags.items() if k.startswith("addr:")}
+            results.append({
+                "name": name or "",
+                "display_name": ", ".join([name or "Unnamed Place"] + list(address.values())),
+                "lat": str(p_lat),
+                "lon": str(p_lon),
+                "address": address,
+                "extratags": tags,
+            })
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the offline POI index.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Ingest an OSM extract (.pbf/.json/.csv)")
+    build.add_argument("source")
+    build.add_argument("output", nargs="?", default=DB_PATH)
+    query = sub.add_parser("query", help="Run a test query against an index")
+    query.add_argument("lat", type=float)
+    query.add_argument("lng", type=float)
+    query.add_argument("query")
+    query.add_argument("--db", default=DB_PATH)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        start = time.perf_counter()
+        count = build_index(args.source, args.output)
+        print(f"Indexed {count} POIs into {args.output} in {time.perf_counter() - start:.1f}s")
+    else:
+        start = time.perf_counter()
+        results = LocalPOIIndex(args.db).search_raw(args.lat, args.lng, args.query)
+        for p in results:
+            print(f"{p['name']} ({p['lat']}, {p['lon']})")
+        print(f"{len(results)} results in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
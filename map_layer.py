@@ -0,0 +1,252 @@
+import math
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import metrics
+
+# Map payloads that stay small however many places a search returns.
+# Places are clustered on a screen-space grid per zoom level (one cell is
+# MAP_CELL_PX pixels on a side, in Web Mercator), so a view of W x H pixels never
+# holds more than about (W / MAP_CELL_PX) * (H / MAP_CELL_PX) clusters. Only the
+# clusters inside the viewport are sent, and a MapSession remembers what a client
+# already has so later frames carry just the clusters that were added, changed
+# or removed. Top picks are always sent as single markers, with a line from the
+# user to each of them.
+CELL_PX = int(os.getenv("MAP_CELL_PX", "60"))
+MIN_ZOOM = int(os.getenv("MAP_MIN_ZOOM", "3"))
+MAX_ZOOM = int(os.getenv("MAP_MAX_ZOOM", "18"))
+MAX_SESSIONS = int(os.getenv("MAP_MAX_SESSIONS", "1000"))
+TILE_PX = 256
+
+
+# Web Mercator helpers: x, y in [0, 1), y growing southwards
+def mercator(lat, lon):
+    lat = np.clip(np.asarray(lat, dtype=np.float64), -85.05112878, 85.05112878)
+    x = (np.asarray(lon, dtype=np.float64) + 180.0) / 360.0
+    y = (1.0 - np.log(np.tan(np.radians(lat)) + 1.0 / np.cos(np.radians(lat))) / math.pi) / 2.0
+    return x, y
+
+
+def unmercator(x, y):
+    lon = x * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1.0 - 2.0 * y))))
+    return lat, lon
+
+
+def fit_view(lats, lons, width_px, height_px, padding_px=40):
+    """(center_lat, center_lon, zoom) showing every point in a width x height map."""
+    x, y = mercator(lats, lons)
+    cx, cy = (x.min() + x.max()) / 2, (y.min() + y.max()) / 2
+    span_x = max(float(x.max() - x.min()), 1e-9)
+    span_y = max(float(y.max() - y.min()), 1e-9)
+    scale = min((width_px - 2 * padding_px) / span_x, (height_px - 2 * padding_px) / span_y) / TILE_PX
+    zoom = int(np.clip(math.floor(math.log2(max(scale, 1.0))), MIN_ZOOM, MAX_ZOOM))
+    lat, lon = unmercator(cx, cy)
+    return lat, lon, zoom
+
+
+def view_bbox(lat, lon, zoom, width_px, height_px):
+    """(west, south, east, north) of a width x height map centered on (lat, lon)."""
+    x, y = mercator(lat, lon)
+    world = TILE_PX * 2 ** zoom
+    half_w, half_h = width_px / 2 / world, height_px / 2 / world
+    north, west = unmercator(x - half_w, y - half_h)
+    south, east = unmercator(x + half_w, y + half_h)
+    return west, south, east, north
+
+
+class ClusterLayer:
+    """Grid clusters of one result set, computed per zoom level on first use."""
+
+    def __init__(self, batch=None):
+        self.set_places(batch)
+
+    def set_places(self, batch):
+        """Replace the clustered places with a PlaceBatch (None for no places)."""
+        self.lat = batch.lat_array().copy() if batch is not None else np.empty(0)
+        self.lon = batch.lon_array().copy() if batch is not None else np.empty(0)
+        self.rating = batch.rating_array().copy() if batch is not None else np.empty(0)
+        self.names = list(batch.names) if batch is not None else []
+        self._x, self._y = mercator(self.lat, self.lon)
+        self._levels = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def clusters(self, zoom):
+        """Column dict for every non-empty cell at `zoom`: id, lat, lon (mean), count, rating (max), name."""
+        zoom = int(np.clip(zoom, MIN_ZOOM, MAX_ZOOM))
+        level = self._levels.get(zoom)
+        if level is None:
+            level = self._levels[zoom] = self._cluster(zoom)
+        return level
+
+    def _cluster(self, zoom):
+        cells = TILE_PX * 2 ** zoom / CELL_PX
+        cx = np.floor(self._x * cells).astype(np.int64)
+        cy = np.floor(self._y * cells).astype(np.int64)
+        keys, first, inverse, count = np.unique(cx * int(math.ceil(cells)) + cy, return_index=True,
+                                                return_inverse=True, return_counts=True)
+        rating = np.full(len(keys), -np.inf)
+        np.maximum.at(rating, inverse, self.rating)
+        return {
+            "id": [f"{zoom}/{cx[i]}/{cy[i]}" for i in first],
+            "lat": np.bincount(inverse, self.lat, len(keys)) / count,
+            "lon": np.bincount(inverse, self.lon, len(keys)) / count,
+            "count": count,
+            "rating": rating,
+            "name": [self.names[i] if n == 1 else None for i, n in zip(first, count)],
+        }
+
+    def visible(self, zoom, bbox):
+        """Clusters at `zoom` whose center lies in bbox (west, south, east, north), as dicts."""
+        level = self.clusters(zoom)
+        west, south, east, north = bbox
+        lat, lon = level["lat"], level["lon"]
+        inside = (lat >= south) & (lat <= north)
+        inside &= (lon >= west) & (lon <= east) if west <= east else (lon >= west) | (lon <= east)
+        return [{"id": level["id"][i], "lat": float(lat[i]), "lon": float(lon[i]),
+                 "count": int(level["count"][i]), "rating": float(level["rating"][i]), "name": level["name"][i]}
+                for i in np.flatnonzero(inside)]
+
+
+class MapSession:
+    """
+    One client's map: the current result set, top picks and user position, plus
+    what the client was last sent, so frames carry only differences.
+    """
+
+    def __init__(self):
+        self.layer = ClusterLayer()
+        self.origin = None
+        self.top = []
+        self.version = 0
+        self._sent = {}
+        self._lock = threading.Lock()
+        self.counters = {"frames": 0, "full_frames": 0, "items_sent": 0}
+
+    def update(self, batch, top=(), origin=None):
+        """New results: a PlaceBatch of all places, top-pick dicts (name, lat, lon, rating), user (lat, lon)."""
+        with self._lock:
+            self.layer.set_places(batch)
+            self.top = [{"id": f"top/{i}", "lat": float(p["lat"]), "lon": float(p["lon"]), "count": 1,
+                         "rating": float(p.get("rating") or 0.0), "name": p["name"], "top": True}
+                        for i, p in enumerate(top)]
+            if origin is not None:
+                self.origin = (float(origin[0]), float(origin[1]))
+
+    def fit(self, width_px, height_px):
+        """(center_lat, center_lon, zoom) that shows the user, the places and the top picks."""
+        lats = [self.layer.lat, [p["lat"] for p in self.top]]
+        lons = [self.layer.lon, [p["lon"] for p in self.top]]
+        if self.origin is not None:
+            lats.append([self.origin[0]])
+            lons.append([self.origin[1]])
+        lats, lons = np.concatenate(lats), np.concatenate(lons)
+        if not len(lats):
+            return 0.0, 0.0, MIN_ZOOM
+        if len(lats) == 1:
+            return float(lats[0]), float(lons[0]), 15
+        return fit_view(lats, lons, width_px, height_px)
+
+    def items(self, zoom, bbox):
+        """Everything in view: clusters, then top picks (top picks regardless of the viewport)."""
+        return self.layer.visible(zoom, bbox) + self.top
+
+    def frame(self, zoom, bbox, since=None):
+        """
+        Map update for a client that holds version `since`:
+        {"version", "zoom", "full", "add": [item], "update": [item], "remove": [id], "origin", "routes"}.
+        A client with any other version (or none) gets the full view.
+        """
+        zoom = int(np.clip(zoom, MIN_ZOOM, MAX_ZOOM))
+        with self._lock:
+            current = {item["id"]: item for item in self.items(zoom, bbox)}
+            full = since is None or since != self.version
+            known = {} if full else self._sent
+            add = [item for key, item in current.items() if key not in known]
+            update = [item for key, item in current.items() if key in known and known[key] != item]
+            remove = [key for key in known if key not in current]
+            self._sent = current
+            self.version += 1
+            self.counters["frames"] += 1
+            self.counters["full_frames"] += full
+            self.counters["items_sent"] += len(add) + len(update) + len(remove)
+            return {
+                "version": self.version,
+                "zoom": zoom,
+                "full": full,
+                "add": add,
+                "update": update,
+                "remove": remove,
+                "origin": self.origin,
+                "routes": [[self.origin, (p["lat"], p["lon"])] for p in self.top] if self.origin else [],
+            }
+
+
+class MapSessions:
+    """Bounded LRU of MapSessions by session id."""
+
+    def __init__(self, max_sessions=MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None) or MapSession()
+            self._sessions[session_id] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return session
+
+    def stats(self):
+        with self._lock:
+            stats = {"sessions": len(self._sessions),
+                     "places": sum(len(s.layer) for s in self._sessions.values())}
+            for s in self._sessions.values():
+                for key, value in s.counters.items():
+                    stats[key] = stats.get(key, 0) + value
+        return stats
+
+
+sessions = MapSessions()
+metrics.register_collector("map", sessions.stats)
+
+
+def deck(items, origin=None, routes=(), view=None):
+    """pydeck Deck for map items (clusters and top picks), the user's position and route lines."""
+    import pandas as pd
+    import pydeck as pdk
+
+    clusters = pd.DataFrame([i for i in items if not i.get("top")],
+                            columns=["id", "lat", "lon", "count", "rating", "name"])
+    clusters["radius"] = 6 + 4 * np.sqrt(clusters["count"].astype(float))
+    clusters["label"] = np.where(clusters["count"] > 1, clusters["count"].astype(str), "")
+    clusters["name"] = clusters["name"].fillna(clusters["count"].astype(str) + " places")
+    top = pd.DataFrame([i for i in items if i.get("top")], columns=["lat", "lon", "rating", "name"])
+    layers = [
+        pdk.Layer("ScatterplotLayer", clusters, get_position=["lon", "lat"], get_radius="radius",
+                  radius_units="pixels", get_fill_color=[30, 136, 229, 170], pickable=True),
+        pdk.Layer("TextLayer", clusters, get_position=["lon", "lat"], get_text="label", get_size=12,
+                  get_color=[255, 255, 255]),
+        pdk.Layer("LineLayer", pd.DataFrame({"source": [[a[1], a[0]] for a, _ in routes],
+                                             "target": [[b[1], b[0]] for _, b in routes]}),
+                  get_source_position="source", get_target_position="target",
+                  get_color=[229, 57, 53, 160], get_width=2),
+        pdk.Layer("ScatterplotLayer", top, get_position=["lon", "lat"], get_radius=9, radius_units="pixels",
+                  get_fill_color=[229, 57, 53, 230], pickable=True),
+    ]
+    if origin is not None:
+        layers.append(pdk.Layer("ScatterplotLayer", pd.DataFrame([{"lat": origin[0], "lon": origin[1],
+                                                                   "name": "You are here"}]),
+                                get_position=["lon", "lat"], get_radius=8, radius_units="pixels",
+                                get_fill_color=[67, 160, 71, 255], pickable=True))
+    if view is None and origin is not None:
+        view = (origin[0], origin[1], 14)
+    lat, lon, zoom = view or (0.0, 0.0, MIN_ZOOM)
+    return pdk.Deck(layers=layers, initial_view_state=pdk.ViewState(latitude=lat, longitude=lon, zoom=zoom),
+                    tooltip={"text": "{name}"}, map_style=None)
@@ -0,0 +1,229 @@
+import bisect
+import http.server
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Per-stage latency tracing.
+# span("name") times a block into a histogram; histograms export as Prometheus
+# text or JSON lines. With METRICS_ENABLED=0 span() returns a shared no-op
+# context manager, so instrumented code pays only a flag check.
+ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+TRACE_FILE = os.getenv("METRICS_TRACE_FILE", "")  # append every span as a JSON line
+PORT = int(os.getenv("METRICS_PORT", "0"))  # serve /metrics and /metrics.jsonl when set
+
+# Latency buckets in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+_histograms = {}
+_collectors = {}
+_recent = []  # last spans, newest last, for the UI timing panel
+_RECENT_MAX = 200
+
+
+class Histogram:
+    __slots__ = ("counts", "total", "count", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """Upper bucket bound containing the q-quantile."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, c in zip(BUCKETS + (float("inf"),), self.counts):
+            seen += c
+            if seen >= target:
+                return bound if bound != float("inf") else self.max
+        return self.max
+
+
+def set_enabled(enabled):
+    global ENABLED
+    ENABLED = enabled
+
+
+def observe(name, seconds, **labels):
+    """Record one duration for stage `name`."""
+    if not ENABLED:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = Histogram()
+        hist.observe(seconds)
+        _recent.append((time.time(), name, labels, seconds))
+        if len(_recent) > _RECENT_MAX:
+            del _recent[0]
+    if TRACE_FILE:
+        with open(TRACE_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"ts": time.time(), "span": name, "labels": labels, "seconds": seconds}) + "\n")
+
+
+class _Noop:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _Noop()
+
+
+@contextmanager
+def _timed(name, labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def span(name, **labels):
+    """Context manager timing a block as stage `name`."""
+    if not ENABLED:
+        return _NOOP
+    return _timed(name, labels)
+
+
+def timed(name, fn, *args, **kwargs):
+    """Call fn(*args, **kwargs) inside span(name); handy for thread pool submissions."""
+    with span(name):
+        return fn(*args, **kwargs)
+
+
+def register_collector(name, fn):
+    """Include `fn()` (a flat dict of numbers) in exports, e.g. cache or scheduler stats."""
+    _collectors[name] = fn
+
+
+def recent(limit=20):
+    with _lock:
+        return list(_recent[-limit:])
+
+
+def summary():
+    """{stage: {"count", "avg_s", "p50_s", "p90_s", "p99_s", "max_s"}} keyed by name and labels."""
+    out = {}
+    with _lock:
+        for (name, labels), h in _histograms.items():
+            key = name + "".join(f"[{k}={v}]" for k, v in labels)
+            out[key] = {
+                "count": h.count,
+                "avg_s": h.total / h.count if h.count else 0.0,
+                "p50_s": h.quantile(0.5),
+                "p90_s": h.quantile(0.9),
+                "p99_s": h.quantile(0.99),
+                "max_s": h.max,
+            }
+    return out
+
+
+def _prom_name(name):
+    return "".join(c if c.isalnum() else "_" for c in name)
+
+
+def _prom_labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+def export_prometheus():
+    """Prometheus text exposition format."""
+    lines = ["# TYPE stage_latency_seconds histogram"]
+    with _lock:
+        items = sorted(_histograms.items())
+        for (name, labels), h in items:
+            base = (("stage", name),) + labels
+            cumulative = 0
+            for bound, c in zip(BUCKETS, h.counts):
+                cumulative += c
+                lines.append(f"stage_latency_seconds_bucket{_prom_labels(base, [('le', bound)])} {cumulative}")
+            lines.append(f"stage_latency_seconds_bucket{_prom_labels(base, [('le', '+Inf')])} {h.count}")
+            lines.append(f"stage_latency_seconds_sum{_prom_labels(base)} {h.total}")
+            lines.append(f"stage_latency_seconds_count{_prom_labels(base)} {h.count}")
+    for collector, fn in list(_collectors.items()):
+        try:
+            values = fn()
+        except Exception:
+            continue
+        for key, value in values.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f"{_prom_name(collector)}_{_prom_name(key)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def export_json_lines():
+    """One JSON object per stage histogram and per collector."""
+    lines = []
+    ts = time.time()
+    for key, stats in summary().items():
+        lines.append(json.dumps({"ts": ts, "stage": key, **stats}))
+    for collector, fn in list(_collectors.items()):
+        try:
+            lines.append(json.dumps({"ts": ts, "collector": collector, **fn()}, default=str))
+        except Exception:
+            continue
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _recent.clear()
+
+
+class _ExportHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, ctype = export_prometheus(), "text/plain; version=0.0.4"
+        elif self.path == "/metrics.jsonl":
+            body, ctype = export_json_lines(), "application/x-ndjson"
+        else:
+            self.send_error(404)
+            return
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+_server = None
+
+
+def serve(port=PORT):
+    """Start the export endpoint in a daemon thread (once per process)."""
+    global _server
+    if _server is not None or not port:
+        return _server
+    with _lock:
+        if _server is None:
+            try:
+                _server = http.server.ThreadingHTTPServer(("0.0.0.0", port), _ExportHandler)
+            except OSError:
+                return None  # another worker process already serves this port
+            threading.Thread(target=_server.serve_forever, name="metrics-export", daemon=True).start()
+    return _server
@@ -0,0 +1,100 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from agent_route import haversine
+
+# Local stand-in for the OTP plan endpoint, for tests and offline development.
+#
+#   python otp_stub.py --port 8080 --delay 0.2
+#   OTP_URL=http://localhost:8080/otp/routers/default/plan streamlit run app_ui.py
+#
+# Itineraries are synthetic (walk → bus → walk for longer trips) but shaped like
+# OTP's /plan response, so agent_route parses them exactly as it would real ones.
+PLAN_PATH = "/otp/routers/default/plan"
+
+
+def plan(from_lat, from_lon, to_lat, to_lon):
+    total_m = haversine(from_lat, from_lon, to_lat, to_lon) * 1000
+    if total_m <= 800:
+        legs = [{"mode": "WALK", "distance": total_m}]
+    else:
+        walk = min(400.0, total_m * 0.1)
+        legs = [
+            {"mode": "WALK", "distance": walk},
+            {"mode": "BUS", "route": str(100 + int(total_m) % 400), "distance": total_m - 2 * walk},
+            {"mode": "WALK", "distance": walk},
+        ]
+    return {"plan": {"itineraries": [{"duration": int(total_m / 5), "legs": legs}]}}
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, delay_s=0.0, fail_rate=0.0):
+        super().__init__(address, _Handler)
+        self.delay_s = delay_s
+        self.fail_rate = fail_rate
+        self.requests = 0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == PLAN_PATH.rsplit("/plan", 1)[0]:
+            self._json({"routerId": "default"})
+            return
+        if url.path != PLAN_PATH:
+            self.send_error(404)
+            return
+        self.server.requests += 1
+        if self.server.delay_s:
+            time.sleep(self.server.delay_s)
+        if random.random() < self.server.fail_rate:
+            self.send_error(500)
+            return
+        q = parse_qs(url.query)
+        try:
+            from_lat, from_lon = map(float, q["fromPlace"][0].split(","))
+            to_lat, to_lon = map(float, q["toPlace"][0].split(","))
+        except (KeyError, ValueError):
+            self.send_error(400, "fromPlace and toPlace must be 'lat,lon'")
+            return
+        self._json(plan(from_lat, from_lon, to_lat, to_lon))
+
+    def _json(self, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start(port=0, delay_s=0.0, fail_rate=0.0):
+    """Start the stub in a background thread; returns (server, plan_url). port=0 picks a free port."""
+    server = StubServer(("127.0.0.1", port), delay_s, fail_rate)
+    threading.Thread(target=server.serve_forever, name="otp-stub", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}{PLAN_PATH}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OTP plan endpoint stand-in.")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds to wait before answering")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with 500")
+    args = parser.parse_args()
+    server = StubServer(("0.0.0.0", args.port), args.delay, args.fail_rate)
+    print(f"OTP stub listening on http://localhost:{args.port}{PLAN_PATH}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+# Geo-tiled cache for place searches.
+# Results are fetched for a whole grid tile (padded by the search radius) and
+# each caller's viewbox is served by filtering the tile's POIs, so users a few
+# metres apart asking for the same thing share one upstream request.
+TILE_DEG = float(os.getenv("PLACE_CACHE_TILE_DEG", "0.01"))
+TTL_S = float(os.getenv("PLACE_CACHE_TTL_S", str(24 * 3600)))
+MEMORY_ITEMS = int(os.getenv("PLACE_CACHE_MEMORY_ITEMS", "512"))
+DISK_ROWS = int(os.getenv("PLACE_CACHE_DISK_ROWS", "20000"))
+DB_PATH = os.getenv("PLACE_CACHE_DB", ".cache/places.sqlite")
+
+
+def normalize_query(query):
+    return " ".join(str(query).lower().split())
+
+
+def tile_of(lat, lng, tile_deg=TILE_DEG):
+    return math.floor(lat / tile_deg), math.floor(lng / tile_deg)
+
+
+def tile_bbox(tile, radius_deg, tile_deg=TILE_DEG):
+    """Bounding box (min_lon, min_lat, max_lon, max_lat) covering every viewbox centred in the tile."""
+    i, j = tile
+    return (j * tile_deg - radius_deg, i * tile_deg - radius_deg,
+            (j + 1) * tile_deg + radius_deg, (i + 1) * tile_deg + radius_deg)
+
+
+def in_box(place, box):
+    try:
+        lat = float(place.get("lat"))
+        lon = float(place.get("lon"))
+    except (TypeError, ValueError):
+        return False
+    return box[0] <= lon <= box[2] and box[1] <= lat <= box[3]
+
+
+class TileCache:
+    """In-process LRU in front of a SQLite table shared by all worker processes."""
+
+    def __init__(self, db_path=DB_PATH, ttl_s=TTL_S, memory_items=MEMORY_ITEMS, disk_rows=DISK_ROWS):
+        self.db_path = db_path
+        self.ttl_s = ttl_s
+        self.memory_items = memory_items
+        self.disk_rows = disk_rows
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+    # SQLite tier
+    def _db(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self.db_path != ":memory:":
+                os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS place_tiles ("
+                "key TEXT PRIMARY KEY, created REAL, accessed REAL, payload TEXT)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS place_tiles_accessed ON place_tiles(accessed)")
+            self._local.conn = conn
+        return conn
+
+    def _disk_get(self, key, now):
+        try:
+            conn = self._db()
+            row = conn.execute("SELECT created, payload FROM place_tiles WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[0] > self.ttl_s:
+                with conn:
+                    conn.execute("DELETE FROM place_tiles WHERE key = ?", (key,))
+                return None
+            with conn:
+                conn.execute("UPDATE place_tiles SET accessed = ? WHERE key = ?", (now, key))
+            return row[0], json.loads(row[1])
+        except sqlite3.Error:
+            return None
+
+    def _disk_put(self, key, created, places):
+        try:
+            conn = self._db()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO place_tiles VALUES (?, ?, ?, ?)",
+                    (key, created, created, json.dumps(places)),
+                )
+                # Size-based eviction: drop expired rows, then least recently used beyond the cap
+                conn.execute("DELETE FROM place_tiles WHERE created < ?", (created - self.ttl_s,))
+                excess = conn.execute("SELECT COUNT(*) FROM place_tiles").fetchone()[0] - self.disk_rows
+                if excess > 0:
+                    conn.execute(
+                        "DELETE FROM place_tiles WHERE key IN "
+                        "(SELECT key FROM place_tiles ORDER BY accessed LIMIT ?)", (excess,)
+                    )
+                    self._count("evictions", excess)
+        except sqlite3.Error:
+            pass
+
+    # Memory tier
+    def _memory_get(self, key, now):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            if now - entry[0] > self.ttl_s:
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            return entry
+
+    def _memory_put(self, key, entry):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def _places(self, key, fetch, box):
+        now = time.time()
+        entry = self._memory_get(key, now)
+        if entry is not None:
+            self._count("memory_hits")
+            return entry[1]
+        entry = self._disk_get(key, now)
+        if entry is not None:
+            self._count("disk_hits")
+            self._memory_put(key, entry)
+            return entry[1]
+        self._count("misses")
+        places = fetch(box)
+        if not getattr(places, "cacheable", True):
+            return places
+        entry = (now, places)
+        self._memory_put(key, entry)
+        self._disk_put(key, now, places)
+        return places
+
+    def search(self, query, lat, lng, radius_deg, fetch, namespace=""):
+        """
+        Return the cached POIs of the caller's tile that fall inside its viewbox.
+        On a miss, `fetch(tile_box)` is called with the padded tile bbox and
+        must return a list of dicts with "lat"/"lon" keys; a list whose
+        `cacheable` attribute is False is returned without being stored.
+        """
+        return self.search_status(query, lat, lng, radius_deg, fetch, namespace)[0]
+
+    def search_status(self, query, lat, lng, radius_deg, fetch, namespace="", limit=None):
+        """
+        search() plus whether the tile's upstream answer held `limit` or more
+        POIs, i.e. was probably cut off and may be missing some of the viewbox's.
+        """
+        tile = tile_of(lat, lng)
+        key = f"{namespace}|{normalize_query(query)}|{radius_deg}|{tile[0]}|{tile[1]}"
+        places = self._places(key, fetch, tile_bbox(tile, radius_deg))
+        box = (lng - radius_deg, lat - radius_deg, lng + radius_deg, lat + radius_deg)
+        return [p for p in places if in_box(p, box)], limit is not None and len(places) >= limit
+
+    def search_box(self, query, box, fetch, namespace="", limit=None):
+        """(POIs, cut off) for exactly `box` (min_lon, min_lat, max_lon, max_lat), cached like tiles."""
+        key = f"{namespace}|{normalize_query(query)}|box|" + "|".join(f"{v:.6f}" for v in box)
+        places = self._places(key, fetch, box)
+        return places, limit is not None and len(places) >= limit
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["memory_items"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+cache = TileCache()
+metrics.register_collector("place_cache", cache.stats)
@@ -0,0 +1,169 @@
+from array import array
+
+import numpy as np
+
+# Compact place representation shared by every tool.
+# PlaceBatch stores a result set column-wise: coordinates, ratings and distances
+# live in flat float64 arrays (8 bytes per value, no per-place dicts or boxed
+# floats), names, addresses and kinds in plain lists. Place is a __slots__ record used
+# when a single place is handed around (top picks, routing, reviews).
+OSM_LINK = "https://www.openstreetmap.org/?mlat={lat}&mlon={lon}&zoom={zoom}"
+
+
+def osm_ref(record):
+    """Nominatim lookup id ("N123", "W456", "R789") of a raw place record, or "" if it has none."""
+    osm_type, osm_id = record.get("osm_type"), record.get("osm_id")
+    if not osm_type or not osm_id:
+        return ""
+    return f"{str(osm_type)[0].upper()}{osm_id}"
+
+
+def place_address(record):
+    """One-line address of a raw place record with address details, or "" without them."""
+    address = record.get("address")
+    return ", ".join(address.values()) if address else ""
+
+
+# OSM tag values that say nothing about what a place is ("building=yes")
+GENERIC_KINDS = frozenset(("yes", "no", "unclassified", "unknown", "other"))
+
+
+def place_kind(record):
+    """Kind of a raw place record ("cafe", "atm"): its OSM type, else its amenity or shop tag; "" if only generic."""
+    tags = record.get("extratags") or {}
+    for kind in (record.get("type"), tags.get("amenity"), tags.get("shop")):
+        if kind and kind not in GENERIC_KINDS:
+            return kind
+    return ""
+
+
+class Place:
+    __slots__ = ("name", "lat", "lon", "rating", "address", "distance_km", "zoom", "kind", "ref")
+
+    def __init__(self, name, lat, lon, rating=0.0, address="", distance_km=None, zoom=16, kind="", ref=""):
+        self.name = name
+        self.lat = lat
+        self.lon = lon
+        self.rating = rating
+        self.address = address
+        self.distance_km = distance_km
+        self.zoom = zoom
+        self.kind = kind  # OSM type such as "cafe" or "atm", "" if unknown
+        self.ref = ref    # OSM id for address lookups (see osm_ref), "" if unknown
+
+    @property
+    def link(self):
+        return OSM_LINK.format(lat=self.lat, lon=self.lon, zoom=self.zoom)
+
+    # Mapping-style access so code written against the old dicts keeps working
+    def __getitem__(self, key):
+        try:
+            return getattr(self, "lon" if key == "lng" else key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            value = self[key]
+        except KeyError:
+            return default
+        return default if value is None else value
+
+    def to_dict(self):
+        d = {"name": self.name, "lat": self.lat, "lon": self.lon, "rating": self.rating,
+             "address": self.address, "link": self.link}
+        if self.distance_km is not None:
+            d["distance_km"] = self.distance_km
+        if self.kind:
+            d["kind"] = self.kind
+        return d
+
+    def __repr__(self):
+        return f"Place({self.name!r}, {self.lat}, {self.lon}, rating={self.rating})"
+
+
+class PlaceBatch:
+    __slots__ = ("names", "lat", "lon", "rating", "distance_km", "addresses", "kinds", "refs", "zoom")
+
+    def __init__(self, zoom=16):
+        self.names = []
+        self.addresses = []
+        self.kinds = []
+        self.refs = []
+        self.lat = array("d")
+        self.lon = array("d")
+        self.rating = array("d")
+        self.distance_km = array("d")  # empty until with_distances() is called
+        self.zoom = zoom
+
+    def append(self, name, lat, lon, rating=0.0, address="", kind="", ref=""):
+        self.names.append(name)
+        self.addresses.append(address)
+        self.kinds.append(kind)
+        self.refs.append(ref)
+        self.lat.append(lat)
+        self.lon.append(lon)
+        self.rating.append(rating)
+
+    @classmethod
+    def from_dicts(cls, places, zoom=16):
+        """Build a batch from loosely typed dicts (string coords, lon/lng keys) e.g. tool-call arguments."""
+        batch = cls(zoom=zoom)
+        for p in places:
+            try:
+                lat = float(p.get("lat", 0))
+                lon = float(p.get("lon", 0) or p.get("lng", 0))
+            except (TypeError, ValueError):
+                continue
+            rating = p.get("rating")
+            batch.append(p.get("name", "Unknown"), lat, lon, float(rating) if rating else 0.0, p.get("address", ""),
+                         p.get("kind", ""))
+        return batch
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, i):
+        return Place(self.names[i], self.lat[i], self.lon[i], self.rating[i], self.addresses[i],
+                     self.distance_km[i] if self.distance_km else None, self.zoom, self.kinds[i], self.refs[i])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def take(self, indices):
+        return [self[int(i)] for i in indices]
+
+    def link(self, i):
+        return OSM_LINK.format(lat=self.lat[i], lon=self.lon[i], zoom=self.zoom)
+
+    # Zero-copy NumPy views over the arrays
+    def lat_array(self):
+        return np.frombuffer(self.lat, dtype=np.float64) if len(self.lat) else np.empty(0)
+
+    def lon_array(self):
+        return np.frombuffer(self.lon, dtype=np.float64) if len(self.lon) else np.empty(0)
+
+    def rating_array(self):
+        return np.frombuffer(self.rating, dtype=np.float64) if len(self.rating) else np.empty(0)
+
+    def distance_array(self):
+        return np.frombuffer(self.distance_km, dtype=np.float64) if len(self.distance_km) else np.empty(0)
+
+    def with_distances(self, lat, lon):
+        """Fill distance_km (km from (lat, lon)) for every place in one vectorized pass."""
+        import geo_distance
+        dist = geo_distance.haversine_km(lat, lon, self.lat_array(), self.lon_array())
+        self.distance_km = array("d", dist.tobytes()) if len(self) else array("d")
+        return self
+
+    def to_dicts(self):
+        return [p.to_dict() for p in self]
+
+    def to_dataframe(self):
+        """pandas DataFrame with lat/lon (and rating) columns backed by the batch's buffers, for st.map."""
+        import pandas as pd
+        return pd.DataFrame(
+            {"lat": self.lat_array(), "lon": self.lon_array(), "rating": self.rating_array()},
+            copy=False,
+        )
@@ -0,0 +1,470 @@
+import contextvars
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+import geo_distance
+import http_client
+import metrics
+import rate_limiter
+from place_record import osm_ref
+from rate_limiter import StillQueued, Throttled
+
+# Place search providers behind one interface, with hedged requests.
+# Every provider answers fetch(query, box, limit) with Nominatim-shaped dicts
+# ("name", "display_name", "lat", "lon", "address", "extratags").
+# HedgedSearch asks the provider with the best rolling latency/error score
+# first; if it has not answered within its own p90 latency, the next provider
+# is fired as well and the first non-empty answer wins. An empty answer only
+# stands once every other provider has been tried, and providers that do not
+# cover the search box (a local index of another city) are not asked at all. Answers that are in by then
+# are merged, with duplicates (same place, same name) collapsed. Latencies are
+# the providers' own service times: time spent queued at a rate limiter is not
+# counted, so a busy scheduler does not push the hedge delay up.
+PROVIDERS = os.getenv("PLACES_PROVIDERS", "nominatim,local")
+OVERPASS_URL = os.getenv("OVERPASS_URL", "https://overpass-api.de/api/interpreter")
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+NOMINATIM_LOOKUP_URL = "https://nominatim.openstreetmap.org/lookup"
+# "lean": jsonv2 without addressdetails, streamed and projected to the fields below;
+# addresses are looked up later, only when a client asks for them (places_source.fill_addresses).
+# "full": the previous eager profile (addressdetails, whole body decoded at once).
+NOMINATIM_PROFILE = os.getenv("NOMINATIM_PROFILE", "lean")
+LEAN_FIELDS = ("osm_type", "osm_id", "name", "display_name", "lat", "lon", "category", "type")
+LEAN_TAGS = ("rating", "amenity", "shop", "cuisine")
+LOOKUP_MAX_IDS = 50  # Nominatim's limit per /lookup call
+HEDGE_MIN_S = float(os.getenv("PLACES_HEDGE_MIN_S", "0.3"))
+HEDGE_MAX_S = float(os.getenv("PLACES_HEDGE_MAX_S", "3"))
+HEDGE_DEFAULT_S = float(os.getenv("PLACES_HEDGE_DEFAULT_S", "1.5"))  # before a provider has enough samples
+MERGE_WAIT_S = float(os.getenv("PLACES_MERGE_WAIT_S", "0"))
+WINDOW = 50          # calls kept per provider for the rolling stats
+MIN_SAMPLES = 5      # calls needed before a provider's own p90 is trusted
+DEDUPE_KM = 0.075    # same normalized name within this distance = same place
+ERROR_PENALTY = 4.0  # score = p50 latency * (1 + ERROR_PENALTY * error rate)
+
+_NAME_RE = re.compile(r"[^\w]+", re.UNICODE)
+
+# Service times of the upstream calls made for the current timed_fetch
+_service_times = contextvars.ContextVar("provider_service_times", default=None)
+
+
+class FailedEmpty(list):
+    """An empty answer that stands in for a failed provider; callers should not cache it."""
+    cacheable = False
+
+
+class ProviderStats:
+    """Rolling latency and error rate over the last WINDOW calls."""
+
+    def __init__(self):
+        self._calls = deque(maxlen=WINDOW)  # (seconds, ok)
+        self._lock = threading.Lock()
+
+    def record(self, seconds, ok):
+        """seconds=None counts the call without a latency sample."""
+        with self._lock:
+            self._calls.append((seconds, ok))
+
+    def _latencies(self):
+        with self._lock:
+            return sorted(s for s, ok in self._calls if ok and s is not None), len(self._calls)
+
+    def quantile(self, q, default):
+        latencies, _ = self._latencies()
+        if len(latencies) < MIN_SAMPLES:
+            return default
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+    def error_rate(self):
+        with self._lock:
+            if not self._calls:
+                return 0.0
+            return sum(1 for _, ok in self._calls if not ok) / len(self._calls)
+
+    def score(self):
+        """Lower is better; untried providers score as HEDGE_DEFAULT_S."""
+        return self.quantile(0.5, HEDGE_DEFAULT_S) * (1 + ERROR_PENALTY * self.error_rate())
+
+    def snapshot(self):
+        _, calls = self._latencies()
+        return {
+            "calls": calls,
+            "p50_s": self.quantile(0.5, 0.0),
+            "p90_s": self.quantile(0.9, 0.0),
+            "error_rate": self.error_rate(),
+        }
+
+
+class PlacesProvider:
+    """
+    Base class: subclasses implement fetch(); available() gates whether one is
+    used at all and covers(box) whether it is asked for a given box. Providers
+    that queue their requests (queued = True) wrap the upstream call in
+    service() so only its own duration is recorded.
+    """
+    name = "provider"
+    queued = False
+
+    def __init__(self):
+        self.stats = ProviderStats()
+
+    def available(self):
+        return True
+
+    def covers(self, box):
+        return True
+
+    def fetch(self, query, box, limit):
+        raise NotImplementedError
+
+    @staticmethod
+    def service(fn):
+        """Wrap the upstream call `fn` so its duration counts as this fetch's service time."""
+        times = _service_times.get()
+
+        def call():
+            start = time.perf_counter()
+            try:
+                return fn()
+            finally:
+                if times is not None:
+                    times.append(time.perf_counter() - start)
+        return call
+
+    def _service_time(self, times, elapsed):
+        if not self.queued:
+            return elapsed
+        # The last attempt is the one that answered; none if merged into another caller's request
+        return times[-1] if times else None
+
+    def timed_fetch(self, query, box, limit):
+        times = []
+        token = _service_times.set(times)
+        start = time.perf_counter()
+        try:
+            results = self.fetch(query, box, limit)
+        except StillQueued:
+            raise  # our own queue was too long; says nothing about the provider
+        except Exception:
+            self.stats.record(self._service_time(times, time.perf_counter() - start), False)
+            raise
+        finally:
+            _service_times.reset(token)
+        elapsed = time.perf_counter() - start
+        self.stats.record(self._service_time(times, elapsed), True)
+        metrics.observe("places.provider", elapsed, provider=self.name)
+        for r in results:
+            r.setdefault("provider", self.name)
+        return results
+
+
+def project(record):
+    """The parts of a Nominatim record the pipeline reads (lean profile)."""
+    lean = {k: record[k] for k in LEAN_FIELDS if k in record}
+    tags = record.get("extratags") or {}
+    lean["extratags"] = {k: tags[k] for k in LEAN_TAGS if k in tags}
+    return lean
+
+
+class NominatimProvider(PlacesProvider):
+    name = "nominatim"
+    queued = True
+
+    def __init__(self, profile=NOMINATIM_PROFILE):
+        super().__init__()
+        self.lean = profile != "full"
+
+    def _get(self, url, params, transform=None):
+        """Whole decoded body, or [transform(item)] decoded item by item as the body streams in."""
+        try:
+            # Throttling is handled by the scheduler, not by http_client retries
+            if transform is None:
+                return http_client.get_json(url, params=params, timeout=10, retries=0)
+            return [transform(item) for item in http_client.get_json_items(url, params=params, timeout=10, retries=0)]
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code in (429, 503):
+                retry_after = e.response.headers.get("Retry-After", "")
+                raise Throttled(float(retry_after) if retry_after.isdigit() else None)
+            raise
+
+    def fetch(self, query, box, limit):
+        """Nominatim search queued through the shared rate limiter; identical pending searches are merged."""
+        params = {
+            "q": query,
+            "format": "jsonv2" if self.lean else "json",
+            "limit": limit,
+            "viewbox": ",".join(map(str, box)),
+            "bounded": 1,
+            "extratags": 1,
+            "addressdetails": 0 if self.lean else 1
+        }
+        key = ("search", query.lower().strip(), tuple(box), limit)
+        transform = project if self.lean else None
+        return rate_limiter.nominatim.run(key, self.service(lambda: self._get(NOMINATIM_URL, params, transform)))
+
+    def lookup_addresses(self, refs):
+        """{ref: address dict} for OSM refs such as "N123", in calls of up to LOOKUP_MAX_IDS ids."""
+        addresses = {}
+        for i in range(0, len(refs), LOOKUP_MAX_IDS):
+            chunk = list(refs[i:i + LOOKUP_MAX_IDS])
+            params = {"osm_ids": ",".join(chunk), "format": "jsonv2", "addressdetails": 1}
+            pairs = rate_limiter.nominatim.run(
+                ("lookup", tuple(chunk)),
+                lambda: self._get(NOMINATIM_LOOKUP_URL, params, lambda r: (osm_ref(r), r.get("address") or {})))
+            addresses.update(pairs)
+        return addresses
+
+
+class OverpassProvider(PlacesProvider):
+    """OSM features whose category tag or name matches the query, via an Overpass API endpoint."""
+    name = "overpass"
+    queued = True
+    TAGS = ("amenity", "shop", "tourism", "leisure", "cuisine")
+
+    def __init__(self, url=OVERPASS_URL):
+        super().__init__()
+        self.url = url
+        self.scheduler = rate_limiter.RequestScheduler(
+            rate_per_s=float(os.getenv("OVERPASS_RATE_PER_S", "1")), burst=2, name="overpass")
+
+    def build_query(self, query, box, limit):
+        words = [w for w in _NAME_RE.split(query.lower()) if w]
+        term = " ".join(words)
+        singular = term[:-1] if len(term) > 3 and term.endswith("s") else term
+        value = singular  # only word characters and spaces are left, nothing to escape
+        bbox = f"{box[1]},{box[0]},{box[3]},{box[2]}"  # south, west, north, east
+        clauses = "".join(f'nwr["{tag}"~"^{value}s?$",i]({bbox});' for tag in self.TAGS)
+        clauses += f'nwr["name"~"{value}",i]({bbox});'
+        return f"[out:json][timeout:10];({clauses});out center {int(limit)};"
+
+    def fetch(self, query, box, limit):
+        data = self.build_query(query, box, limit)
+        key = ("overpass", data)
+        payload = self.scheduler.run(key, self.service(lambda: http_client.get_json(self.url, params={"data": data},
+                                                                                    timeout=10, retries=0)))
+        return [self.to_record(el) for el in payload.get("elements", []) if el.get("tags")]
+
+    @staticmethod
+    def to_record(el):
+        tags = el.get("tags", {})
+        lat = el.get("lat", el.get("center", {}).get("lat"))
+        lon = el.get("lon", el.get("center", {}).get("lon"))
+        name = tags.get("name", "")
+        address = {k[5:]: v for k, v in tags.items() if k.startswith("addr:")}
+        return {
+            "osm_id": el.get("id"),
+            "osm_type": el.get("type"),
+            "name": name,
+            "display_name": ", ".join([name or "Unnamed Place"] + list(address.values())),
+            "lat": str(lat),
+            "lon": str(lon),
+            "address": address,
+            "extratags": {k: v for k, v in tags.items() if k != "name" and not k.startswith("addr:")},
+        }
+
+
+class LocalProvider(PlacesProvider):
+    """The offline R*Tree index built with local_poi.py; only used when its database exists."""
+    name = "local"
+
+    def __init__(self, index=None):
+        super().__init__()
+        self._index = index
+
+    @property
+    def index(self):
+        if self._index is None:
+            from local_poi import LocalPOIIndex
+            self._index = LocalPOIIndex()
+        return self._index
+
+    def available(self):
+        if self._index is not None:
+            return True
+        from local_poi import DB_PATH
+        return os.path.exists(DB_PATH)
+
+    def covers(self, box):
+        """Whether `box` overlaps the area the index was built for."""
+        bounds = self.index.bounds()
+        return (bounds is not None and box[0] <= bounds[2] and bounds[0] <= box[2]
+                and box[1] <= bounds[3] and bounds[1] <= box[3])
+
+    def fetch(self, query, box, limit):
+        return self.index.search_box(box, query, limit)
+
+
+# Merging
+def _norm_name(record):
+    return _NAME_RE.sub(" ", str(record.get("name") or record.get("display_name", "")).lower()).strip()
+
+
+def merge_results(result_lists, dedupe_km=DEDUPE_KM):
+    """
+    Concatenate provider answers in order, dropping records that duplicate an
+    earlier one: same normalized name within dedupe_km, or unnamed records at
+    (almost) the same point. The kept record gains fields only the duplicate had.
+    """
+    merged = []
+    coords = []
+    names = []
+    for results in result_lists:
+        for r in results:
+            try:
+                lat, lon = float(r["lat"]), float(r["lon"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            name = _norm_name(r)
+            dup = None
+            if coords:
+                dists = geo_distance.distances_from(lat, lon, coords)
+                for i, d in enumerate(dists):
+                    same_name = name and name == names[i]
+                    unnamed = not name or not names[i]
+                    if (same_name and d <= dedupe_km) or (unnamed and d <= dedupe_km / 5):
+                        dup = i
+                        break
+            if dup is None:
+                merged.append(dict(r))
+                coords.append((lat, lon))
+                names.append(name)
+            else:
+                kept = merged[dup]
+                for k, v in r.items():
+                    if v and not kept.get(k):
+                        kept[k] = v
+    return merged
+
+
+class HedgedSearch:
+    def __init__(self, providers):
+        self.providers = list(providers)
+        self._pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="places-hedge")
+        self.counters = {"searches": 0, "hedged": 0, "secondary_won": 0, "failovers": 0, "merged": 0, "failed": 0,
+                         "empty_passed": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.counters[key] += n
+
+    def ranked(self, box=None):
+        """Available providers covering `box`, best rolling score first (configuration order breaks ties)."""
+        usable = [p for p in self.providers if p.available() and (box is None or p.covers(box))]
+        return sorted(usable, key=lambda p: p.stats.score())
+
+    def fetch(self, query, box, limit):
+        providers = self.ranked(box)
+        if not providers:
+            raise RuntimeError("no places provider available")
+        self._count("searches")
+        if len(providers) == 1:
+            return providers[0].timed_fetch(query, box, limit)
+
+        pending = {}   # future -> provider
+        answers = {}   # provider name -> results
+        errors = []
+        queue = list(providers)
+
+        def fire():
+            provider = queue.pop(0)
+            # Copy the caller's context so scheduler session/priority carry over
+            fut = self._pool.submit(contextvars.copy_context().run, provider.timed_fetch, query, box, limit)
+            pending[fut] = provider
+            return provider
+
+        primary = fire()
+        hedge_after = min(HEDGE_MAX_S, max(HEDGE_MIN_S, primary.stats.quantile(0.9, HEDGE_DEFAULT_S)))
+        hedge_at = time.monotonic() + hedge_after
+        first = None
+        while pending and first is None:
+            timeout = None
+            if queue:
+                timeout = max(0.0, hedge_at - time.monotonic())
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # Primary is slower than its own p90: hedge with the next provider
+                hedged = fire()
+                self._count("hedged")
+                hedge_at = time.monotonic() + min(HEDGE_MAX_S, max(HEDGE_MIN_S, hedged.stats.quantile(0.9, HEDGE_DEFAULT_S)))
+                continue
+            for fut in done:
+                provider = pending.pop(fut)
+                try:
+                    answers[provider.name] = fut.result()
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                if answers[provider.name]:
+                    first = first or provider
+                elif queue or pending:
+                    self._count("empty_passed")  # "nothing here" waits for the others
+            if first is None and queue:
+                self._count("failovers")
+                fire()  # failed or found nothing fast; don't wait for the hedge timer
+
+        if first is None:
+            if not answers:
+                self._count("failed")
+                raise errors[-1] if errors else RuntimeError("no places provider answered")
+            # Every provider that answered found nothing
+            if errors:
+                queued = [e for e in errors if isinstance(e, StillQueued)]
+                if queued:
+                    raise queued[0]  # "still waiting for Nominatim" beats "nothing here"
+                # "Nothing here" next to a failure is not an answer worth caching
+                return FailedEmpty()
+            return []
+        if first is not primary:
+            self._count("secondary_won")
+
+        # Fold in other answers that are already in (or arrive within MERGE_WAIT_S)
+        if pending and MERGE_WAIT_S > 0:
+            done, _ = wait(list(pending), timeout=MERGE_WAIT_S)
+            for fut in done:
+                provider = pending.pop(fut)
+                if fut.exception() is None:
+                    answers[provider.name] = fut.result()
+        answers = {name: r for name, r in answers.items() if r}
+        if len(answers) == 1:
+            return answers[first.name]
+        self._count("merged")
+        ordered = [answers[first.name]] + [r for name, r in answers.items() if name != first.name]
+        return merge_results(ordered)[:limit]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        for p in self.providers:
+            for k, v in p.stats.snapshot().items():
+                stats[f"{p.name}_{k}"] = v
+        return stats
+
+
+REGISTRY = {
+    "nominatim": NominatimProvider,
+    "overpass": OverpassProvider,
+    "local": LocalProvider,
+}
+
+
+def build(names=PROVIDERS):
+    """HedgedSearch over the comma-separated provider names, e.g. "nominatim,overpass,local"."""
+    providers = []
+    for name in (n.strip() for n in names.split(",")):
+        if not name:
+            continue
+        if name not in REGISTRY:
+            raise ValueError(f"Unknown places provider: {name}")
+        providers.append(REGISTRY[name]())
+    return HedgedSearch(providers)
+
+
+search = build()
+metrics.register_collector("places_providers", search.stats)
+# Address lookups go to Nominatim even when it is not a search provider
+nominatim = next((p for p in search.providers if isinstance(p, NominatimProvider)), None) or NominatimProvider()
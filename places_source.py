@@ -0,0 +1,199 @@
+import heapq
+import math
+import os
+import threading
+from collections import OrderedDict
+import geo_distance
+import metrics
+import places_providers
+from place_cache import cache
+
+# Raw place lookups shared by places_tool and agent_places.
+# Returns Nominatim-shaped dicts ("name", "display_name", "lat", "lon",
+# "address", "extratags"); each tool shapes them into its own output.
+# Which upstream answers (Nominatim, Overpass, the local index) is decided per
+# search by places_providers (PLACES_PROVIDERS).
+RADIUS_DEG = 0.05
+TILE_LIMIT = 40  # Nominatim's maximum; a padded tile covers more ground than one viewbox
+
+# "viewbox" (fixed ±RADIUS_DEG box) or "knn" (rings widen until the k nearest are known)
+SEARCH_MODE = os.getenv("PLACES_SEARCH_MODE", "viewbox")
+KNN_MIN_RADIUS_DEG = float(os.getenv("PLACES_KNN_MIN_RADIUS_DEG", "0.005"))
+KNN_MAX_RADIUS_DEG = float(os.getenv("PLACES_KNN_MAX_RADIUS_DEG", "0.2"))
+# How many times a box whose answer hit TILE_LIMIT is split into quadrants
+KNN_MAX_SPLITS = int(os.getenv("PLACES_KNN_MAX_SPLITS", "3"))
+KM_PER_DEG = 111.32
+
+# Addresses fetched by fill_addresses, by OSM ref
+ADDRESS_CACHE_ITEMS = int(os.getenv("PLACES_ADDRESS_CACHE_ITEMS", "4096"))
+_addresses = OrderedDict()
+_addresses_lock = threading.Lock()
+_address_counters = {"hits": 0, "looked_up": 0, "errors": 0}
+
+def fetch_places(query, box, limit=TILE_LIMIT):
+    """One provider search for a box; see places_providers for provider choice and hedging."""
+    return places_providers.search.fetch(query, box, limit)
+
+
+def fill_addresses(places, lookup=True):
+    """
+    Fill in the address of Places that were found without one (lean Nominatim
+    results carry an OSM ref instead) from the addresses looked up before, and
+    with lookup=True the rest with one batched Nominatim /lookup. That call is
+    rate limited, so only make it for addresses a client actually asked for;
+    answers are kept in a process-wide LRU, and places keep "" otherwise.
+    """
+    todo = [p for p in places if p.ref and not p.address]
+    if not todo:
+        return places
+    with _addresses_lock:
+        missing = []
+        for p in todo:
+            if p.ref in _addresses:
+                _addresses.move_to_end(p.ref)
+                _address_counters["hits"] += 1
+            elif p.ref not in missing:
+                missing.append(p.ref)
+    found = {}
+    if missing and lookup:
+        try:
+            with metrics.span("places.address_lookup"):
+                found = {ref: ", ".join(address.values())
+                         for ref, address in places_providers.nominatim.lookup_addresses(missing).items()}
+        except Exception:
+            with _addresses_lock:
+                _address_counters["errors"] += 1
+    with _addresses_lock:
+        _address_counters["looked_up"] += len(found)
+        for ref, address in found.items():
+            _addresses[ref] = address
+        while len(_addresses) > ADDRESS_CACHE_ITEMS:
+            _addresses.popitem(last=False)
+        for p in todo:
+            p.address = _addresses.get(p.ref, "")
+    return places
+
+
+def address_stats():
+    with _addresses_lock:
+        return dict(_address_counters, cached=len(_addresses))
+
+
+metrics.register_collector("place_addresses", address_stats)
+
+
+def search_raw(lat: float, lng: float, query: str, radius_deg: float = RADIUS_DEG):
+    """Places matching `query` inside the ±radius_deg viewbox around (lat, lng), served from the tile cache."""
+    return search_status(lat, lng, query, radius_deg)[0]
+
+
+def search_status(lat: float, lng: float, query: str, radius_deg: float = RADIUS_DEG):
+    """
+    (search_raw's places, truncated): truncated is True when the upstream
+    answer behind them hit TILE_LIMIT, so places in the viewbox may be missing.
+    """
+    return cache.search_status(query, lat, lng, radius_deg,
+                               fetch=lambda box: fetch_places(query, box),
+                               namespace="places", limit=TILE_LIMIT)
+
+
+def search_box(query: str, box):
+    """(places, truncated) for exactly `box` (min_lon, min_lat, max_lon, max_lat)."""
+    return cache.search_box(query, box, fetch=lambda b: fetch_places(query, b),
+                            namespace="places", limit=TILE_LIMIT)
+
+
+def _box_distance_km(lat, lng, box):
+    """Lower bound of the distance from (lat, lng) to any point of `box`."""
+    dlat = max(box[1] - lat, 0.0, lat - box[3])
+    dlon = max(box[0] - lng, 0.0, lng - box[2])
+    edge_lat = max(abs(box[1]), abs(box[3]))
+    return KM_PER_DEG * math.hypot(dlat, dlon * max(math.cos(math.radians(edge_lat)), 0.0))
+
+
+def _quadrants(box):
+    mid_lon, mid_lat = (box[0] + box[2]) / 2, (box[1] + box[3]) / 2
+    return [(box[0], box[1], mid_lon, mid_lat), (mid_lon, box[1], box[2], mid_lat),
+            (box[0], mid_lat, mid_lon, box[3]), (mid_lon, mid_lat, box[2], box[3])]
+
+
+def search_knn(lat: float, lng: float, query: str, k: int = 10,
+               min_radius_deg: float = None, max_radius_deg: float = None):
+    """
+    The k places matching `query` nearest to (lat, lng), nearest first, each
+    with a "distance_km" key. The search box doubles from min_radius_deg until
+    the k-th best distance lies inside the area already searched, or
+    max_radius_deg is reached. A box whose answer hit the provider's result
+    limit holds an arbitrary subset of its places, so it is searched again as
+    quadrants (nearest first, up to KNN_MAX_SPLITS times, skipping those farther
+    than the k-th best distance); if the smallest quadrants are still full the
+    search stops there with the best places found.
+    """
+    radius = min_radius_deg or KNN_MIN_RADIUS_DEG
+    max_radius = max_radius_deg or KNN_MAX_RADIUS_DEG
+    # Distance guaranteed covered by a ±radius box: its inscribed circle
+    km_per_deg = KM_PER_DEG * min(1.0, max(math.cos(math.radians(lat)), 0.01))
+    heap = []    # bounded max-heap of (-distance, seq, place), size <= k
+    seen = set()
+    seq = 0
+
+    def add(raw):
+        nonlocal seq
+        fresh = []
+        for p in raw:
+            ident = (p.get("osm_id") or p.get("name"), p.get("lat"), p.get("lon"))
+            if ident not in seen:
+                seen.add(ident)
+                fresh.append(p)
+        if fresh:
+            dists = geo_distance.distances_from(lat, lng, [(float(p["lat"]), float(p["lon"])) for p in fresh])
+            for p, d in zip(fresh, dists):
+                item = (-float(d), seq, p)
+                seq += 1
+                if len(heap) < k:
+                    heapq.heappush(heap, item)
+                elif -item[0] < -heap[0][0]:
+                    heapq.heapreplace(heap, item)
+
+    def kth_km():
+        return -heap[0][0] if len(heap) >= k else math.inf
+
+    while True:
+        raw, truncated = search_status(lat, lng, query, radius_deg=radius)
+        add(raw)
+        if truncated:
+            # Best-first over quadrants of the ring's box
+            todo = [(0.0, 0, (lng - radius, lat - radius, lng + radius, lat + radius))]
+            truncated = False
+            while todo:
+                near_km, level, box = heapq.heappop(todo)
+                if near_km >= kth_km():
+                    break
+                raw, full = search_box(query, box)
+                add(raw)
+                if full and level < KNN_MAX_SPLITS:
+                    for quad in _quadrants(box):
+                        heapq.heappush(todo, (_box_distance_km(lat, lng, quad), level + 1, quad))
+                else:
+                    truncated = truncated or full
+            if truncated:
+                break  # too dense to resolve further; best effort
+        if len(heap) >= k and -heap[0][0] <= radius * km_per_deg:
+            break
+        if radius >= max_radius:
+            break
+        radius = min(radius * 2, max_radius)
+
+    results = []
+    for neg_dist, _, p in sorted(heap, key=lambda item: -item[0]):
+        place = dict(p)
+        place["distance_km"] = round(-neg_dist, 3)
+        results.append(place)
+    return results
+
+
+def search(lat: float, lng: float, query: str, limit: int = 10):
+    """Up to `limit` places for the tools, using the configured search mode."""
+    if SEARCH_MODE == "knn":
+        return search_knn(lat, lng, query, k=limit)
+    return search_raw(lat, lng, query)[:limit]
@@ -1,4 +1,8 @@
-import requests
+import http_client
+import places_source
+import weather_batch
+import weather_cache
+from place_record import PlaceBatch, osm_ref, place_address, place_kind
 
 def search_nearby(lat: float, lng: float, query: str):
     """
@@ -14,32 +18,26 @@ def search_nearby(lat: float, lng: float, query: str):
             "address": str
         }
     ]
+    Addresses come with the search (NOMINATIM_PROFILE=full) or from addresses
+    looked up earlier (see places_source.fill_addresses), "" otherwise.
     """
 
-    radius_deg = 0.05
-    viewbox = f"{lng - radius_deg},{lat - radius_deg},{lng + radius_deg},{lat + radius_deg}"
-
-    url = "https://nominatim.openstreetmap.org/search"
-    params = {
-        "q": query,
-        "format": "json",
-        "limit": 15,
-        "viewbox": viewbox,
-        "bounded": 1,
-        "extratags": 1,
-        "addressdetails": 1
-    }
+    places = list(find_places(lat, lng, query))
+    places_source.fill_addresses(places, lookup=False)
+    return [p.to_dict() for p in places]
 
+def find_places(lat: float, lng: float, query: str) -> PlaceBatch:
+    """Same search as search_nearby, as a compact PlaceBatch for in-process callers."""
     try:
-        res = requests.get(
-            url, params=params,
-            headers={"User-Agent": "multi-agent-app"},
-            timeout=10
-        ).json()
+        res = places_source.search(lat, lng, query, limit=15)
     except Exception:
-        return []
+        return PlaceBatch()
 
-    places = []
+    return normalize_places(res)
+
+def normalize_places(res) -> PlaceBatch:
+    """Turn raw Nominatim records into a PlaceBatch."""
+    places = PlaceBatch()
 
     for p in res:
         # Coordinate extraction
@@ -54,10 +52,6 @@ def search_nearby(lat: float, lng: float, query: str):
 
         name = p.get("name") or "Unnamed Place"
 
-        address = ""
-        if p.get("address"):
-            address = ", ".join(list(p["address"].values()))
-
         extratags = p.get("extratags", {})
         rating_raw = extratags.get("rating")
         try:
@@ -65,33 +59,29 @@ def search_nearby(lat: float, lng: float, query: str):
         except:
             rating = 3.5
 
-        places.append({
-            "name": name,
-            "lat": lat_val,
-            "lon": lon_val,
-            "rating": rating,
-            "address": address,
-            "link": f"https://www.openstreetmap.org/?mlat={lat_val}&mlon={lon_val}&zoom=16"
-        })
+        places.append(name, lat_val, lon_val, rating, place_address(p), place_kind(p), osm_ref(p))
 
     return places
 
-def get_weather(lat: float, lng: float):
-    """
-    Fetch current weather & alerts for a given lat/lng.
-    Returns text: temperature, wind speed, and weather alerts.
-    """
-
-    url = "https://api.open-meteo.com/v1/forecast"
+def _fetch_weather(lat, lng):
+    url = weather_batch.OPEN_METEO_URL
     params = {
         "latitude": lat,
         "longitude": lng,
         "current_weather": "true",
         "weather_alerts": "true"
     }
+    return http_client.get_json(url, params=params, timeout=10)
+
+def get_weather(lat: float, lng: float):
+    """
+    Fetch current weather & alerts for a given lat/lng.
+    Returns text: temperature, wind speed, and weather alerts.
+    Answers are shared per weather_cache grid cell.
+    """
 
     try:
-        res = requests.get(url, params=params, timeout=10).json()
+        res = weather_cache.cache.get(lat, lng, _fetch_weather, namespace="places_tool")
 
         cw = res.get("current_weather", {})
         temp = cw.get("temperature", "?")
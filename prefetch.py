@@ -0,0 +1,217 @@
+import argparse
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import rate_limiter
+from place_cache import normalize_query, tile_of
+
+# Speculative prefetch: as soon as a user's location is known, warm the weather
+# and the searches people most often run around there, so the first real
+# question usually hits warm caches.
+# - categories come from a query log (per grid cell, falling back to the most
+#   common queries overall, then to DEFAULT_CATEGORIES)
+# - place searches go through the Nominatim scheduler at PREFETCH priority, so
+#   interactive requests from any session are always served first
+# - each run is budgeted (categories, wall time, scheduler backlog) and is
+#   cancelled when the session moves to another cell
+#
+#   python prefetch.py learn queries.jsonl     # seed the log from (lat, lon, query) rows
+#   python prefetch.py top 12.97 77.59
+LOG_DB = os.getenv("PREFETCH_LOG_DB", ".cache/query_log.sqlite")
+MAX_CATEGORIES = int(os.getenv("PREFETCH_CATEGORIES", "3"))
+BUDGET_S = float(os.getenv("PREFETCH_BUDGET_S", "15"))
+MAX_QUEUE_WAIT_S = float(os.getenv("PREFETCH_MAX_QUEUE_WAIT_S", "5"))
+REFRESH_S = float(os.getenv("PREFETCH_REFRESH_S", "600"))
+ENABLED = os.getenv("PREFETCH_ENABLED", "1") != "0"
+DEFAULT_CATEGORIES = ("restaurant", "cafe", "atm")
+
+
+class QueryLog:
+    """Counts of normalized place queries per grid cell, persisted in SQLite."""
+
+    def __init__(self, db_path=LOG_DB):
+        self.db_path = db_path
+        self._local = threading.local()
+
+    def _db(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self.db_path != ":memory:":
+                os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS query_counts ("
+                "tile_x INTEGER, tile_y INTEGER, query TEXT, hits INTEGER, last REAL, "
+                "PRIMARY KEY (tile_x, tile_y, query))"
+            )
+            self._local.conn = conn
+        return conn
+
+    def record(self, lat, lng, query, hits=1):
+        query = normalize_query(query)
+        if not query:
+            return
+        tx, ty = tile_of(lat, lng)
+        try:
+            with self._db() as conn:
+                conn.execute(
+                    "INSERT INTO query_counts VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (tile_x, tile_y, query) DO UPDATE SET hits = hits + excluded.hits, last = excluded.last",
+                    (tx, ty, query, hits, time.time()),
+                )
+        except sqlite3.Error:
+            pass  # the log is best-effort; never fail a user request over it
+
+    def top(self, lat, lng, k=MAX_CATEGORIES):
+        """Most frequent queries for the cell around (lat, lng), topped up from the global ranking."""
+        tx, ty = tile_of(lat, lng)
+        try:
+            conn = self._db()
+            local = [q for q, in conn.execute(
+                "SELECT query FROM query_counts WHERE tile_x = ? AND tile_y = ? ORDER BY hits DESC, last DESC LIMIT ?",
+                (tx, ty, k))]
+            overall = [q for q, in conn.execute(
+                "SELECT query FROM query_counts GROUP BY query ORDER BY SUM(hits) DESC LIMIT ?", (k,))]
+        except sqlite3.Error:
+            local, overall = [], []
+        ranked = []
+        for q in local + overall + list(DEFAULT_CATEGORIES):
+            if q not in ranked:
+                ranked.append(q)
+        return ranked[:k]
+
+
+class Prefetcher:
+    def __init__(self, log, max_categories=MAX_CATEGORIES, budget_s=BUDGET_S, max_queue_wait_s=MAX_QUEUE_WAIT_S,
+                 scheduler=None, workers=2):
+        self.log = log
+        self.max_categories = max_categories
+        self.budget_s = budget_s
+        self.max_queue_wait_s = max_queue_wait_s
+        self.scheduler = scheduler or rate_limiter.nominatim
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self._runs = {}  # session -> (cell, started_at, cancel Event, Future)
+        self._lock = threading.Lock()
+        self.counters = {"started": 0, "completed": 0, "cancelled": 0, "steps": 0,
+                         "skipped_busy": 0, "budget_exhausted": 0, "errors": 0}
+
+    def start(self, session, lat, lng):
+        """Prefetch for this session's location; a no-op if the same cell was prefetched recently."""
+        cell = tile_of(lat, lng)
+        with self._lock:
+            run = self._runs.get(session)
+            if run is not None:
+                if run[0] == cell and time.monotonic() - run[1] < REFRESH_S:
+                    return run[3]
+                self._cancel_locked(session)
+            cancel = threading.Event()
+            ctx = contextvars.Context()  # fresh context: session/priority set inside stay in this run
+            future = self._pool.submit(ctx.run, self._run, session, lat, lng, cancel)
+            self._runs[session] = (cell, time.monotonic(), cancel, future)
+            self.counters["started"] += 1
+        return future
+
+    def cancel(self, session):
+        with self._lock:
+            self._cancel_locked(session)
+
+    def _cancel_locked(self, session):
+        run = self._runs.pop(session, None)
+        if run is None or run[3].done():
+            return
+        run[2].set()
+        run[3].cancel()
+        self.scheduler.withdraw(session, rate_limiter.PREFETCH)
+        self.counters["cancelled"] += 1
+
+    def _run(self, session, lat, lng, cancel):
+        # Imported here: the tools pull in the HTTP stack, which the UI may not need yet
+        from agent_places import find_places
+        from agent_weather import get_weather
+
+        rate_limiter.current_session.set(session)
+        rate_limiter.current_priority.set(rate_limiter.PREFETCH)
+        deadline = time.monotonic() + self.budget_s
+        steps = [("weather", lambda: get_weather(lat, lng))]
+        steps += [(f"places:{q}", lambda q=q: find_places(lat, lng, q))
+                  for q in self.log.top(lat, lng, self.max_categories)]
+        with metrics.span("prefetch.total"):
+            for name, step in steps:
+                if cancel.is_set():
+                    return
+                if time.monotonic() >= deadline:
+                    self._count("budget_exhausted")
+                    return
+                if name.startswith("places:") and \
+                        self.scheduler.estimated_wait(rate_limiter.PREFETCH) > self.max_queue_wait_s:
+                    self._count("skipped_busy")
+                    continue
+                try:
+                    with metrics.span("prefetch.step", kind=name.split(":")[0]):
+                        step()
+                    self._count("steps")
+                except Exception:
+                    self._count("errors")
+        self._count("completed")
+
+    def _count(self, key):
+        with self._lock:
+            self.counters[key] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["running"] = sum(1 for run in self._runs.values() if not run[3].done())
+        return stats
+
+
+query_log = QueryLog()
+prefetcher = Prefetcher(query_log)
+metrics.register_collector("prefetch", prefetcher.stats)
+
+
+def record_query(lat, lng, query):
+    """Log a real place query (prefetches and batch rows are not counted)."""
+    if rate_limiter.current_priority.get() == rate_limiter.INTERACTIVE:
+        query_log.record(lat, lng, query)
+
+
+def start(session, lat, lng):
+    if ENABLED:
+        return prefetcher.start(session, lat, lng)
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query log used to pick prefetch categories.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    learn_p = sub.add_parser("learn", help="Add (lat, lon, query) rows from a .jsonl or .csv file to the log")
+    learn_p.add_argument("input")
+    top_p = sub.add_parser("top", help="Categories that would be prefetched at a location")
+    top_p.add_argument("lat", type=float)
+    top_p.add_argument("lng", type=float)
+    top_p.add_argument("-k", type=int, default=MAX_CATEGORIES)
+    args = parser.parse_args()
+
+    if args.command == "learn":
+        from batch_runner import read_rows
+        n = 0
+        for row in read_rows(args.input):
+            if "error" in row:
+                continue
+            query_log.record(row["lat"], row["lon"], row["query"])
+            n += 1
+        print(f"Logged {n} queries to {query_log.db_path}")
+    else:
+        print(json.dumps(query_log.top(args.lat, args.lng, args.k)))
+
+
+if __name__ == "__main__":
+    main()
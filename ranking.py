@@ -0,0 +1,136 @@
+import math
+import os
+import re
+
+import numpy as np
+
+# Multi-criteria ranking of candidate places.
+# Every candidate gets a score in [0, 1] from four criteria, each already in [0, 1]:
+#   rating    (rating - 1) / 4 on the 1-5 scale
+#   distance  exp(-distance_km / RANK_DISTANCE_SCALE_KM)
+#   travel    exp(-minutes / RANK_TRAVEL_SCALE_MIN), minutes estimated from distance
+#             with the same walk / auto / metro bands agent_route falls back to
+#   category  1 when the place's kind or name matches a query word
+# weighted by RANK_WEIGHTS. All criteria are computed over whole arrays and the
+# top k come from np.argpartition, so ranking thousands of candidates stays cheap.
+DEFAULT_WEIGHTS = {"rating": 0.5, "distance": 0.25, "travel": 0.15, "category": 0.1}
+DISTANCE_SCALE_KM = float(os.getenv("RANK_DISTANCE_SCALE_KM", "2"))
+TRAVEL_SCALE_MIN = float(os.getenv("RANK_TRAVEL_SCALE_MIN", "20"))
+
+# (up to km, speed km/h, fixed overhead minutes) per mode band
+TRAVEL_BANDS = ((0.5, 5.0, 0.0), (2.0, 20.0, 5.0), (math.inf, 30.0, 10.0))
+_BAND_UPPER = np.array([upper for upper, _, _ in TRAVEL_BANDS[:-1]])
+_BAND_MIN_PER_KM = np.array([60.0 / speed for _, speed, _ in TRAVEL_BANDS])
+_BAND_OVERHEAD = np.array([overhead for _, _, overhead in TRAVEL_BANDS])
+
+_WORD_RE = re.compile(r"[^\W_]+", re.UNICODE)
+
+
+def parse_weights(spec):
+    """"rating=0.6,distance=0.4" -> weights dict; criteria not listed keep their default."""
+    weights = dict(DEFAULT_WEIGHTS)
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, _, value = part.partition("=")
+        if name.strip() not in weights:
+            raise ValueError(f"Unknown ranking criterion: {name}")
+        weights[name.strip()] = float(value)
+    return weights
+
+
+WEIGHTS = parse_weights(os.getenv("RANK_WEIGHTS", ""))
+
+
+def travel_minutes(distance_km):
+    """Estimated door-to-door minutes for an array of distances."""
+    d = np.asarray(distance_km, dtype=np.float64)
+    band = np.searchsorted(_BAND_UPPER, d)
+    return d * _BAND_MIN_PER_KM[band] + _BAND_OVERHEAD[band]
+
+
+def query_words(query):
+    words = set()
+    for word in _WORD_RE.findall(str(query or "").lower()):
+        words.add(word)
+        if len(word) > 3 and word.endswith("s"):
+            words.add(word[:-1])
+    return words
+
+
+def category_match(kinds, names, query):
+    """1.0 where a place's kind or name contains a query word, else 0.0."""
+    words = query_words(query)
+    if not words:
+        return np.zeros(len(names))
+    pattern = re.compile("|".join(map(re.escape, sorted(words, key=len, reverse=True))), re.IGNORECASE)
+    search = pattern.search
+    # Few distinct kinds per result set: test each once
+    kind_hit = {kind: search(kind) is not None for kind in set(kinds)}
+    return np.fromiter((kind_hit[kind] or search(name) is not None for kind, name in zip(kinds, names)),
+                       dtype=np.float64, count=len(names))
+
+
+def scores(rating, distance_km=None, kinds=None, names=None, query=None, weights=None):
+    """Weighted score per candidate; missing criteria (no distances, no query) contribute nothing."""
+    weights = weights or WEIGHTS
+    rating = np.asarray(rating, dtype=np.float64)
+    # fmin/fmax rather than clip: a missing (NaN) rating scores 0
+    total = weights["rating"] * np.fmin(np.fmax((rating - 1.0) / 4.0, 0.0), 1.0)
+    if distance_km is not None and len(distance_km):
+        d = np.asarray(distance_km, dtype=np.float64)
+        total = total + weights["distance"] * np.exp(-d / DISTANCE_SCALE_KM)
+        total = total + weights["travel"] * np.exp(-travel_minutes(d) / TRAVEL_SCALE_MIN)
+    if query and names is not None:
+        total = total + weights["category"] * category_match(kinds or [""] * len(names), names, query)
+    return total
+
+
+def top_k_indices(score, k, distance_km=None):
+    """Indices of the k best scores, best first (nearer first on equal score), without sorting everything."""
+    n = len(score)
+    if n == 0 or k <= 0:
+        return np.empty(0, dtype=np.intp)
+    k = min(k, n)
+    idx = np.argpartition(-score, k - 1)[:k] if k < n else np.arange(n)
+    if distance_km is not None and len(distance_km):
+        order = np.lexsort((np.asarray(distance_km)[idx], -score[idx]))
+    else:
+        order = np.argsort(-score[idx], kind="stable")
+    return idx[order]
+
+
+def rank_batch(batch, k, query=None, weights=None):
+    """Top k Places of a PlaceBatch."""
+    dist = batch.distance_array() if len(batch.distance_km) else None
+    s = scores(batch.rating_array(), dist, batch.kinds, batch.names, query, weights)
+    return batch.take(top_k_indices(s, k, dist))
+
+
+def rank_records(records, k, query=None, weights=None):
+    """Top k of a list of place dicts (or Places), e.g. tool-call arguments; missing fields score as neutral."""
+    if not records:
+        return []
+    rating = _floats([r.get("rating") for r in records])
+    dist = _floats([r.get("distance_km") for r in records])
+    if np.isnan(dist).any():
+        dist = None
+    names = kinds = None
+    if query:
+        names = [str(r.get("name", "")) for r in records]
+        kinds = [str(r.get("kind", "")) for r in records]
+    s = scores(rating, dist, kinds, names, query, weights)
+    return [records[i] for i in top_k_indices(s, k, dist)]
+
+
+def _floats(values):
+    """float64 array of values; None, "" and other unparsable entries become NaN."""
+    try:
+        return np.fromiter(values, dtype=np.float64, count=len(values))
+    except (TypeError, ValueError):
+        return np.fromiter((_float(v) for v in values), dtype=np.float64, count=len(values))
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
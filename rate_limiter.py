@@ -0,0 +1,304 @@
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import metrics
+
+# Process-wide token-bucket scheduler for rate-limited upstreams (Nominatim: ~1 req/s).
+# Requests are queued instead of failing:
+# - higher priority classes are always served first (interactive > prefetch > batch)
+# - within a class, sessions are served round-robin so one busy tab can't starve others
+# - a request identical to one already pending or in flight shares its result
+# - a caller with a deadline stops waiting when it passes; a request still
+#   queued then is taken out of line and the caller gets StillQueued with the
+#   estimated wait, so it can say "queued, about N s" instead of "nothing found"
+INTERACTIVE, PREFETCH, BATCH = 0, 1, 2
+
+# Which session/priority the current call belongs to; set by the UI, prefetcher or batch runner
+current_session = contextvars.ContextVar("scheduler_session", default="default")
+current_priority = contextvars.ContextVar("scheduler_priority", default=INTERACTIVE)
+# Absolute time.monotonic() deadline of the request the current call serves, None for no deadline
+current_deadline = contextvars.ContextVar("scheduler_deadline", default=None)
+
+
+class Throttled(Exception):
+    """Raised by a job to tell the scheduler the upstream asked us to slow down."""
+
+    def __init__(self, retry_after=None):
+        super().__init__("upstream throttled")
+        self.retry_after = retry_after
+
+
+class StillQueued(TimeoutError):
+    """The caller's deadline passed before its request was sent; eta_s estimates the wait it would have had."""
+
+    def __init__(self, eta_s):
+        super().__init__(f"request still queued, about {eta_s:.0f} s to go")
+        self.eta_s = eta_s
+
+
+class _Job:
+    __slots__ = ("key", "fn", "future", "priority", "attempts", "dispatched", "waiters")
+
+    def __init__(self, key, fn, priority):
+        self.key = key
+        self.fn = fn
+        self.future = Future()
+        self.priority = priority
+        self.attempts = 0
+        self.dispatched = False
+        self.waiters = 1  # submissions sharing this job
+
+
+class RequestScheduler:
+    def __init__(self, rate_per_s=1.0, burst=1, max_attempts=3, throttle_pause_s=2.0, name="scheduler"):
+        self.rate = rate_per_s
+        self.burst = burst
+        self.max_attempts = max_attempts
+        self.throttle_pause_s = throttle_pause_s
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        # priority -> OrderedDict(session -> deque of jobs); OrderedDict order is the round-robin turn
+        self._queues = {p: OrderedDict() for p in (INTERACTIVE, PREFETCH, BATCH)}
+        self._jobs = {}  # key -> pending or in-flight job
+        self._cond = threading.Condition()
+        self._workers = ThreadPoolExecutor(max_workers=4, thread_name_prefix=f"{name}-worker")
+        self.counters = {"submitted": 0, "merged": 0, "dispatched": 0, "throttled": 0, "failed": 0, "withdrawn": 0,
+                         "expired": 0}
+        threading.Thread(target=self._dispatch_loop, name=f"{name}-dispatch", daemon=True).start()
+
+    # Submission
+    def submit(self, key, fn, session=None, priority=None):
+        """
+        Queue `fn()` and return a Future for its result.
+        The Future carries `eta_s`, the estimated seconds until it is sent upstream.
+        """
+        session = current_session.get() if session is None else session
+        priority = current_priority.get() if priority is None else priority
+        with self._cond:
+            self.counters["submitted"] += 1
+            job = self._jobs.get(key)
+            if job is not None:
+                self.counters["merged"] += 1
+                job.waiters += 1
+                if priority < job.priority and not job.dispatched:
+                    # Promote: also queue it in the higher class; whichever entry runs first wins
+                    job.priority = priority
+                    self._enqueue(job, session)
+                job.future.eta_s = 0.0 if job.dispatched else self._eta_locked(job.priority)
+                return job.future
+            job = _Job(key, fn, priority)
+            self._jobs[key] = job
+            self._enqueue(job, session)
+            job.future.eta_s = self._eta_locked(priority)
+            self._cond.notify()
+            return job.future
+
+    def run(self, key, fn, session=None, priority=None, timeout=None):
+        """
+        submit() and wait for the result, at most `timeout` seconds (by default
+        until current_deadline). Raises StillQueued if the request was not sent
+        by then; a request that was already sent is waited for to the end.
+        """
+        if timeout is None and current_deadline.get() is not None:
+            timeout = max(0.0, current_deadline.get() - time.monotonic())
+        future = self.submit(key, fn, session, priority)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout:
+            pass
+        with self._cond:
+            job = self._jobs.get(key)
+            if job is None or job.future is not future or job.dispatched:
+                in_flight = True
+            else:
+                in_flight = False
+                eta_s = self._eta_locked(job.priority)
+                job.waiters -= 1
+                if job.waiters <= 0:
+                    # Nobody else wants it: take it out of line
+                    self._jobs.pop(key, None)
+                    self._unqueue_locked(job)
+                    job.future.cancel()
+                self.counters["expired"] += 1
+        if in_flight:
+            return future.result()
+        raise StillQueued(eta_s)
+
+    def withdraw(self, session, priority):
+        """
+        Cancel `session`'s queued, not yet dispatched jobs in class `priority`
+        (e.g. a prefetch the user moved away from). Jobs another caller has
+        merged into only lose this session's share and keep their place in
+        line. Returns the number of jobs cancelled.
+        """
+        with self._cond:
+            sessions = self._queues[priority]
+            queue = sessions.get(session)
+            if not queue:
+                return 0
+            kept = []
+            withdrawn = 0
+            for job in queue:
+                if job.dispatched or job.future.done():
+                    continue
+                if job.priority != priority:
+                    # Promoted: the entry in the higher class is the live one
+                    job.waiters -= 1
+                    continue
+                if job.waiters > 1:
+                    job.waiters -= 1
+                    kept.append(job)
+                    continue
+                self._jobs.pop(job.key, None)
+                job.future.cancel()
+                withdrawn += 1
+            if kept:
+                # Same deque, so the session also keeps its round-robin turn
+                queue.clear()
+                queue.extend(kept)
+            else:
+                del sessions[session]
+            self.counters["withdrawn"] += withdrawn
+        return withdrawn
+
+    def _unqueue_locked(self, job):
+        for sessions in self._queues.values():
+            for session, queue in list(sessions.items()):
+                if job in queue:
+                    queue.remove(job)
+                    if not queue:
+                        del sessions[session]
+
+    def _enqueue(self, job, session, front=False):
+        sessions = self._queues[job.priority]
+        queue = sessions.setdefault(session, deque())
+        if front:
+            queue.appendleft(job)
+        else:
+            queue.append(job)
+
+    # Estimates
+    def _eta_locked(self, priority):
+        ahead = sum(len(q) for p in self._queues if p <= priority for q in self._queues[p].values())
+        now = time.monotonic()
+        start = max(now, self._paused_until)
+        tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        return max(0.0, start - now + (ahead - tokens) / self.rate)
+
+    def estimated_wait(self, priority=INTERACTIVE):
+        """Seconds a request submitted now at `priority` would wait before being sent."""
+        with self._cond:
+            return self._eta_locked(priority)
+
+    def queue_depth(self):
+        with self._cond:
+            return {p: sum(len(q) for q in sessions.values()) for p, sessions in self._queues.items()}
+
+    # Dispatch
+    def _next_job(self):
+        for priority in (INTERACTIVE, PREFETCH, BATCH):
+            sessions = self._queues[priority]
+            while sessions:
+                session, queue = next(iter(sessions.items()))
+                job = queue.popleft()
+                # Rotate this session to the back of the round-robin
+                del sessions[session]
+                if queue:
+                    sessions[session] = queue
+                if job.dispatched or job.future.done():
+                    continue  # stale duplicate of a promoted job
+                return job, session
+        return None, None
+
+    def _take_token_locked(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                while not any(self._queues.values()):
+                    self._cond.wait()
+                delay = self._take_token_locked()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                job, session = self._next_job()
+                if job is None:
+                    self._tokens += 1  # nothing runnable after all; give the token back
+                    continue
+                job.dispatched = True
+                self.counters["dispatched"] += 1
+            try:
+                self._workers.submit(self._execute, job, session)
+            except RuntimeError as e:
+                # Worker pool shut down (interpreter exit): fail everything still waiting
+                self._fail_all(job, e)
+                return
+
+    def _fail_all(self, job, error):
+        with self._cond:
+            jobs = [job] + [j for j in self._jobs.values() if j is not job]
+            self._jobs.clear()
+            for sessions in self._queues.values():
+                sessions.clear()
+            self.counters["failed"] += len(jobs)
+        for j in jobs:
+            if not j.future.done():
+                j.future.set_exception(error)
+
+    def _execute(self, job, session):
+        job.attempts += 1
+        try:
+            result = job.fn()
+        except Throttled as e:
+            with self._cond:
+                self.counters["throttled"] += 1
+                self._paused_until = time.monotonic() + (e.retry_after or self.throttle_pause_s)
+                if job.attempts < self.max_attempts:
+                    # Back to the head of its queue; it keeps its place in line
+                    job.dispatched = False
+                    self._enqueue(job, session, front=True)
+                    self._cond.notify()
+                    return
+                self.counters["failed"] += 1
+                self._jobs.pop(job.key, None)
+            job.future.set_exception(e)
+            return
+        except Exception as e:
+            with self._cond:
+                self.counters["failed"] += 1
+                self._jobs.pop(job.key, None)
+            job.future.set_exception(e)
+            return
+        with self._cond:
+            self._jobs.pop(job.key, None)
+        job.future.set_result(result)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self.counters)
+            stats["pending"] = len(self._jobs)
+        stats["queue_depth"] = self.queue_depth()
+        stats["estimated_wait_s"] = round(self.estimated_wait(), 2)
+        return stats
+
+
+nominatim = RequestScheduler(
+    rate_per_s=float(os.getenv("NOMINATIM_RATE_PER_S", "1")),
+    burst=int(os.getenv("NOMINATIM_BURST", "1")),
+    name="nominatim",
+)
+metrics.register_collector("nominatim_scheduler", nominatim.stats)
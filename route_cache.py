@@ -0,0 +1,82 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+# Itinerary cache for OTP plans.
+# Keyed by quantized origin, quantized destination and a departure-time bucket,
+# so users near the same station asking for the same popular places share one plan.
+ORIGIN_DEG = float(os.getenv("ROUTE_CACHE_ORIGIN_DEG", "0.002"))     # ~200 m
+DEST_DEG = float(os.getenv("ROUTE_CACHE_DEST_DEG", "0.0005"))        # ~50 m
+TIME_BUCKET_S = float(os.getenv("ROUTE_CACHE_TIME_BUCKET_S", "900"))  # 15 min of departures
+TTL_S = float(os.getenv("ROUTE_CACHE_TTL_S", "900"))
+MAX_ITEMS = int(os.getenv("ROUTE_CACHE_MAX_ITEMS", "5000"))
+
+
+def route_key(user_lat, user_lon, place_lat, place_lon, depart=None):
+    depart = time.time() if depart is None else depart
+    return (
+        math.floor(user_lat / ORIGIN_DEG), math.floor(user_lon / ORIGIN_DEG),
+        math.floor(place_lat / DEST_DEG), math.floor(place_lon / DEST_DEG),
+        int(depart // TIME_BUCKET_S),
+    )
+
+
+class RouteCache:
+    def __init__(self, ttl_s=TTL_S, max_items=MAX_ITEMS):
+        self.ttl_s = ttl_s
+        self.max_items = max_items
+        self._entries = OrderedDict()  # key -> (stored_at, itinerary, fetch_seconds)
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "otp_time_saved_s": 0.0, "otp_time_spent_s": 0.0}
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now - entry[0] > self.ttl_s:
+                if entry is not None:
+                    del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            self.counters["hits"] += 1
+            self.counters["otp_time_saved_s"] += entry[2]
+            return entry[1]
+
+    def put(self, key, itinerary, fetch_seconds):
+        with self._lock:
+            self._entries[key] = (time.time(), itinerary, fetch_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+
+    def get_or_fetch(self, user_lat, user_lon, place_lat, place_lon, fetch):
+        """Cached itinerary, or `fetch(...)` on a miss. Failed fetches raise and are not cached."""
+        key = route_key(user_lat, user_lon, place_lat, place_lon)
+        itinerary = self.get(key)
+        if itinerary is not None:
+            return itinerary
+        with self._lock:
+            self.counters["misses"] += 1
+        start = time.perf_counter()
+        itinerary = fetch(user_lat, user_lon, place_lat, place_lon)
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.counters["otp_time_spent_s"] += elapsed
+        self.put(key, itinerary, elapsed)
+        return itinerary
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["items"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+cache = RouteCache()
+metrics.register_collector("route_cache", cache.stats)
@@ -1,8 +1,10 @@
+import argparse
 import asyncio
-from google.adk.runners import Runner
-from google.adk.sessions import InMemorySessionService
-from google.genai.types import Content, Part
-from agent_router import root_agent  # Multi-agent router
+import json
+import agent_runtime
+import intent_router
+import metrics
+import time
 
 async def main():
     print("📍 Nearby Finder CLI (Multi-Agent)")
@@ -10,18 +12,54 @@ async def main():
     lng = input("Enter longitude: ")
     query = input("Enter your query (places/weather/both): ")
 
+    # Simple prompts are answered locally, skipping the Gemini round-trip
+    try:
+        fast_answer = await asyncio.to_thread(intent_router.fast_path, query, float(lat), float(lng))
+    except ValueError:
+        fast_answer = None
+    if fast_answer is not None:
+        print("\n" + fast_answer)
+        return
+
     # Initialize session and runner
-    session = InMemorySessionService()
-    runner = Runner(agent=root_agent, app_name="cli_multi_agent", session_service=session)
-    await session.create_session(user_id="user", session_id="cli", app_name=runner.app_name)
+    runner = agent_runtime.get_runner()
+    await agent_runtime.ensure_session("user", "cli")
 
     enriched_prompt = f"My location is {lat}, {lng}. {query}"
-    msg = Content(role="user", parts=[Part(text=enriched_prompt)])
+    msg = agent_runtime.user_message(enriched_prompt)
 
     print("\nSearching...\n")
+    stream_start = time.perf_counter()
+    first_token = True
     async for event in runner.run_async(user_id="user", session_id="cli", new_message=msg):
         if event.content and event.content.parts:
+            if first_token:
+                metrics.observe("agent.ttft", time.perf_counter() - stream_start)
+                first_token = False
             print(event.content.parts[0].text, end="")
+    metrics.observe("agent.stream", time.perf_counter() - stream_start)
+
+def batch_main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute answers for a file of (lat, lon, query) rows.")
+    parser.add_argument("command", choices=["batch"])
+    parser.add_argument("input", help=".jsonl or .csv with lat, lon and query fields")
+    parser.add_argument("--out", default="batch_results.jsonl", help="JSONL output; also the resume checkpoint")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--max-pending", type=int, default=None, help="Rows in flight before reading pauses")
+    parser.add_argument("--agent", action="store_true", help="Run each row through the Gemini agent")
+    parser.add_argument("--no-weather-prewarm", action="store_true",
+                        help="Fetch weather row by row instead of in batched calls up front")
+    args = parser.parse_args(argv)
+
+    import batch_runner
+    summary = batch_runner.run_batch(args.input, args.out, workers=args.workers,
+                                     use_agent=args.agent, max_pending=args.max_pending,
+                                     prewarm_weather=not args.no_weather_prewarm)
+    print(json.dumps(summary))
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    import sys
+    if len(sys.argv) > 1:
+        batch_main()
+    else:
+        asyncio.run(main())
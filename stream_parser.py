@@ -0,0 +1,128 @@
+import json
+import re
+
+# Incremental parser for the agent's marker-delimited answer:
+#   [WEATHER] ... [PLACES] ... [REVIEWS] ... [TRANSPORT] ...
+# Chunks are consumed once as they stream in; a section is reported complete
+# as soon as the next marker arrives (or the stream ends).
+SECTIONS = ("WEATHER", "PLACES", "REVIEWS", "TRANSPORT")
+_MARKER_RE = re.compile(r"\[(WEATHER|PLACES|REVIEWS|TRANSPORT)\]")
+_KEEP = max(len(s) for s in SECTIONS) + 1  # a marker split across chunks fits in this tail
+
+
+class SectionStreamParser:
+    def __init__(self):
+        self.current = None   # section being read
+        self._pending = ""    # unscanned text; only a possible partial marker is held back
+        self._body = []       # parts of the current section
+        self.sections = {}
+
+    def feed(self, chunk):
+        """Consume a chunk; return [(section, text)] for sections completed by it."""
+        completed = []
+        buf = self._pending + chunk
+        pos = 0
+        for m in _MARKER_RE.finditer(buf):
+            self._body.append(buf[pos:m.start()])
+            done = self._close()
+            if done:
+                completed.append(done)
+            self.current = m.group(1)
+            pos = m.end()
+        rest = buf[pos:]
+        # Hold back a tail that may be the start of a marker split across chunks
+        cut = rest.rfind("[", max(0, len(rest) - _KEEP))
+        if cut != -1 and "]" not in rest[cut:]:
+            self._body.append(rest[:cut])
+            self._pending = rest[cut:]
+        else:
+            self._body.append(rest)
+            self._pending = ""
+        return completed
+
+    def finish(self):
+        """Flush the stream; return [(section, text)] for the last open section, if any."""
+        self._body.append(self._pending)
+        self._pending = ""
+        done = self._close()
+        return [done] if done else []
+
+    def _close(self):
+        text = "".join(self._body).strip()
+        self._body = []
+        if self.current is None:
+            return None
+        self.sections[self.current] = text
+        return self.current, text
+
+
+# Section interpretation (shared by the UI, the benchmarks and any other consumer)
+def parse_weather(raw):
+    """Weather section text -> {"alert", "temperature", "wind"}."""
+    weather_display = {"alert": "None", "temperature": "N/A", "wind": "N/A"}
+    raw = raw.strip()
+    if not raw:
+        return weather_display
+    try:
+        parsed = json.loads(raw.replace("'", '"'))
+    except:
+        parsed = None
+    if isinstance(parsed, dict):
+        weather_display["alert"] = parsed.get("alert", "None")
+        weather_display["temperature"] = parsed.get("temperature", "N/A")
+        weather_display["wind"] = parsed.get("wind", "N/A")
+        return weather_display
+
+    tmatch = re.search(r"([Tt]emperature[: ]+)(-?\d+\.?\d*)", raw)
+    wmatch = re.search(r"([Ww]ind(?: speed)?[: ]+)(-?\d+\.?\d*)", raw)
+    if tmatch:
+        weather_display["temperature"] = tmatch.group(2)
+    if wmatch:
+        weather_display["wind"] = wmatch.group(2)
+    alert_match = re.search(r"(⚠️|alert[: ]+([^.\n]+))", raw, re.IGNORECASE)
+    if alert_match:
+        weather_display["alert"] = alert_match.group(2) if alert_match.lastindex and alert_match.group(2) else "⚠️"
+    else:
+        weather_display["alert"] = raw
+    return weather_display
+
+
+def section_display(name, raw):
+    """Display text for a PLACES/REVIEWS/TRANSPORT section, or None when it carries no info."""
+    text = raw.strip()
+    empty = ("none", "")
+    if name == "PLACES":
+        empty = ("none", "no places found.", "no places info")
+    if not text or text.lower() in empty:
+        return None
+    return text
+
+
+_MAP_LINK_RE = re.compile(r"\(?\[([^\]]*)\]\((https?://[^)\s]*mlat=(-?[\d.]+)&mlon=(-?[\d.]+)[^)\s]*)\)\)?")
+_RATING_RE = re.compile(r"⭐\s*(\d+(?:\.\d+)?)")
+_PREFIX_RE = re.compile(r"^\s*(?:[•*\-]\s*)?(?:⭐\s*\d+(?:\.\d+)?\s*)?(?:—\s*)?")
+
+
+def parse_place_links(raw):
+    """Places linked in a PLACES/REVIEWS section -> [{"name", "lat", "lon", "rating"}], one per line with a map link."""
+    places = []
+    for line in raw.splitlines():
+        m = _MAP_LINK_RE.search(line)
+        if not m:
+            continue
+        label, _, lat, lon = m.groups()
+        # "• Name ([map](link))" and "⭐ 4.5 — Name ([map](link))" name the place outside the link
+        name = label if label.lower() != "map" else _MAP_LINK_RE.sub("", line)
+        name = _PREFIX_RE.sub("", name).strip() or "Unnamed Place"
+        rating = _RATING_RE.search(line)
+        places.append({"name": name, "lat": float(lat), "lon": float(lon),
+                       "rating": float(rating.group(1)) if rating else 0.0})
+    return places
+
+
+def parse_sections(full_text):
+    """Parse a complete answer in one go: {section: text} for every marker present."""
+    parser = SectionStreamParser()
+    parser.feed(full_text)
+    parser.finish()
+    return parser.sections
@@ -0,0 +1,81 @@
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import http_client
+import metrics
+import weather_cache
+
+# Weather for many coordinates with few Open-Meteo calls.
+# Open-Meteo accepts comma-separated latitude/longitude lists and answers with
+# one result per location, in order. Points are first reduced to distinct
+# weather_cache cells (cached cells cost nothing), the missing cells are split
+# into chunks of WEATHER_BATCH_SIZE locations, and up to
+# WEATHER_BATCH_CONCURRENCY chunks are requested at once. Every answer is
+# cached per cell, so later single-point lookups for those cells are hits.
+#
+#   python weather_stub.py --port 8090
+#   OPEN_METEO_URL=http://localhost:8090/v1/forecast python run.py batch rows.jsonl
+OPEN_METEO_URL = os.getenv("OPEN_METEO_URL", "https://api.open-meteo.com/v1/forecast")
+BATCH_SIZE = int(os.getenv("WEATHER_BATCH_SIZE", "100"))
+BATCH_CONCURRENCY = int(os.getenv("WEATHER_BATCH_CONCURRENCY", "4"))
+
+_pool = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix="weather-batch")
+_lock = threading.Lock()
+counters = {"requests": 0, "locations": 0, "failed_requests": 0}
+
+
+def _count(**deltas):
+    with _lock:
+        for key, n in deltas.items():
+            counters[key] += n
+
+
+def fetch_chunk(coords, params):
+    """One Open-Meteo request for up to BATCH_SIZE (lat, lng) pairs; one response dict per pair."""
+    query = dict(params)
+    query["latitude"] = ",".join(f"{lat:.4f}" for lat, _ in coords)
+    query["longitude"] = ",".join(f"{lng:.4f}" for _, lng in coords)
+    with metrics.span("weather.batch_request"):
+        res = http_client.get_json(OPEN_METEO_URL, params=query)
+    # A single location comes back as an object, several as a list
+    results = res if isinstance(res, list) else [res]
+    if len(results) != len(coords):
+        raise ValueError(f"Open-Meteo returned {len(results)} results for {len(coords)} locations")
+    return results
+
+
+def fetch_many(coords, params):
+    """Responses for every (lat, lng) in coords, chunked and fetched concurrently; None where a chunk failed."""
+    chunks = [coords[i:i + BATCH_SIZE] for i in range(0, len(coords), BATCH_SIZE)]
+    futures = [_pool.submit(contextvars.copy_context().run, fetch_chunk, chunk, params) for chunk in chunks]
+    results = []
+    for chunk, future in zip(chunks, futures):
+        try:
+            results.extend(future.result())
+            _count(requests=1, locations=len(chunk))
+        except Exception:
+            results.extend([None] * len(chunk))
+            _count(requests=1, failed_requests=1)
+    return results
+
+
+def get_many(points, params, namespace):
+    """
+    Raw Open-Meteo responses for [(lat, lng), ...], in input order (None where
+    unavailable). `namespace` must be the weather_cache namespace of the
+    single-point lookups that use the same `params`, so the two share answers.
+    """
+    if not points:
+        return []
+    with metrics.span("weather.batch"):
+        return weather_cache.cache.get_many(points, lambda coords: fetch_many(coords, params), namespace=namespace)
+
+
+def stats():
+    with _lock:
+        return dict(counters)
+
+
+metrics.register_collector("weather_batch", stats)
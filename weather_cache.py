@@ -0,0 +1,172 @@
+import math
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import metrics
+
+# Current-weather cache keyed by a quantized lat/lon cell.
+# - fresh entries (younger than TTL) are served directly
+# - stale entries (younger than TTL + STALE) are served immediately while one
+#   background refresh runs (stale-while-revalidate)
+# - concurrent misses for the same cell share a single upstream request (single-flight)
+# - get_many answers many points at once, fetching all of their missing cells in one batch
+CELL_DEG = float(os.getenv("WEATHER_CELL_DEG", "0.05"))
+TTL_S = float(os.getenv("WEATHER_TTL_S", "300"))
+STALE_S = float(os.getenv("WEATHER_STALE_S", "600"))
+
+
+def cell_of(lat, lng, cell_deg=CELL_DEG):
+    return math.floor(lat / cell_deg), math.floor(lng / cell_deg)
+
+
+def cell_center(cell, cell_deg=CELL_DEG):
+    return (cell[0] + 0.5) * cell_deg, (cell[1] + 0.5) * cell_deg
+
+
+class WeatherCache:
+    def __init__(self, ttl_s=TTL_S, stale_s=STALE_S):
+        self.ttl_s = ttl_s
+        self.stale_s = stale_s
+        self._entries = {}   # key -> (fetched_at, value)
+        self._inflight = {}  # key -> Future
+        self._lock = threading.Lock()
+        self._refresh_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="weather-refresh")
+        self.counters = {"hits": 0, "stale_hits": 0, "misses": 0, "coalesced_waits": 0, "errors": 0}
+
+    def _start_fetch(self, key):
+        """Register an in-flight future for `key`; caller must hold the lock."""
+        future = Future()
+        self._inflight[key] = future
+        return future
+
+    def _run_fetch(self, key, future, fetch):
+        try:
+            value = fetch()
+        except Exception as e:
+            self._fail(key, future, e)
+            return
+        self._store(key, future, value)
+
+    def _run_fetch_many(self, jobs, fetch_many):
+        """Fetch [(key, future, centre)] with one fetch_many call; a None answer fails only its own key."""
+        try:
+            values = fetch_many([center for _, _, center in jobs])
+        except Exception as e:
+            values = [e] * len(jobs)
+        for (key, future, _), value in zip(jobs, values):
+            if value is None or isinstance(value, Exception):
+                self._fail(key, future, value or LookupError(f"no answer for cell {key[1]}"))
+            else:
+                self._store(key, future, value)
+
+    def _fail(self, key, future, error):
+        with self._lock:
+            self._inflight.pop(key, None)
+            self.counters["errors"] += 1
+        future.set_exception(error)
+
+    def _store(self, key, future, value):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._inflight.pop(key, None)
+            # Drop entries that are past serving even as stale
+            cutoff = time.time() - self.ttl_s - self.stale_s
+            for k in [k for k, (t, _) in self._entries.items() if t < cutoff]:
+                del self._entries[k]
+        future.set_result(value)
+
+    def get(self, lat, lng, fetch, namespace=""):
+        """
+        Cached value for the cell containing (lat, lng).
+        `fetch(cell_lat, cell_lng)` is called with the cell centre on a miss,
+        so every caller in the cell shares one upstream answer.
+        """
+        cell = cell_of(lat, lng)
+        key = (namespace, cell)
+        center = cell_center(cell)
+        call = lambda: fetch(*center)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            age = now - entry[0] if entry else None
+            if entry and age <= self.ttl_s:
+                self.counters["hits"] += 1
+                return entry[1]
+            if entry and age <= self.ttl_s + self.stale_s:
+                self.counters["stale_hits"] += 1
+                if key not in self._inflight:
+                    future = self._start_fetch(key)
+                    self._refresh_pool.submit(self._run_fetch, key, future, call)
+                return entry[1]
+            future = self._inflight.get(key)
+            if future is not None:
+                self.counters["coalesced_waits"] += 1
+                owner = False
+            else:
+                self.counters["misses"] += 1
+                future = self._start_fetch(key)
+                owner = True
+
+        if owner:
+            self._run_fetch(key, future, call)
+        return future.result()
+
+    def get_many(self, points, fetch_many, namespace=""):
+        """
+        Cached values for many (lat, lng) points, in input order (None where the fetch failed).
+        Points are reduced to distinct cells first; `fetch_many([(cell_lat, cell_lng), ...])`
+        is called once with the centres of every missing cell and returns one value per
+        centre (None for a cell it could not answer). Stale cells are served and refreshed
+        together in the background; cells another caller is fetching are waited for.
+        """
+        keys = [(namespace, cell_of(lat, lng)) for lat, lng in points]
+        values, waiting, missing, refresh = {}, {}, [], []
+        now = time.time()
+
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                entry = self._entries.get(key)
+                age = now - entry[0] if entry else None
+                if entry and age <= self.ttl_s:
+                    self.counters["hits"] += 1
+                    values[key] = entry[1]
+                elif entry and age <= self.ttl_s + self.stale_s:
+                    self.counters["stale_hits"] += 1
+                    values[key] = entry[1]
+                    if key not in self._inflight:
+                        refresh.append((key, self._start_fetch(key), cell_center(key[1])))
+                elif key in self._inflight:
+                    self.counters["coalesced_waits"] += 1
+                    waiting[key] = self._inflight[key]
+                else:
+                    self.counters["misses"] += 1
+                    future = self._start_fetch(key)
+                    missing.append((key, future, cell_center(key[1])))
+                    waiting[key] = future
+
+        if refresh:
+            self._refresh_pool.submit(self._run_fetch_many, refresh, fetch_many)
+        if missing:
+            self._run_fetch_many(missing, fetch_many)
+        for key, future in waiting.items():
+            try:
+                values[key] = future.result()
+            except Exception:
+                values[key] = None
+        return [values[key] for key in keys]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["cells"] = len(self._entries)
+            stats["inflight"] = len(self._inflight)
+        lookups = stats["hits"] + stats["stale_hits"] + stats["misses"] + stats["coalesced_waits"]
+        stats["hit_ratio"] = (stats["hits"] + stats["stale_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+cache = WeatherCache()
+metrics.register_collector("weather_cache", cache.stats)
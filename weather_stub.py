@@ -0,0 +1,102 @@
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Local stand-in for the Open-Meteo forecast endpoint, for tests and offline development.
+#
+#   python weather_stub.py --port 8090 --delay 0.1
+#   OPEN_METEO_URL=http://localhost:8090/v1/forecast streamlit run app_ui.py
+#
+# Accepts single coordinates or comma-separated lists like the real API (one
+# object for one location, a list for several) and answers with synthetic but
+# stable current weather derived from the coordinates.
+FORECAST_PATH = "/v1/forecast"
+MAX_LOCATIONS = 1000
+
+
+def current_weather(lat, lon):
+    """Synthetic weather that depends only on the location, so repeated runs give the same answers."""
+    temperature = round(30 - abs(lat) * 0.45 + 3 * math.sin(lon / 7), 1)
+    windspeed = round(8 + 6 * abs(math.cos(lat * 3 + lon)), 1)
+    return {"temperature": temperature, "windspeed": windspeed, "winddirection": int(lon * 10) % 360,
+            "weathercode": 0 if temperature > 15 else 3, "is_day": 1, "time": time.strftime("%Y-%m-%dT%H:00")}
+
+
+def forecast(lat, lon):
+    return {"latitude": lat, "longitude": lon, "timezone": "GMT", "current_weather": current_weather(lat, lon)}
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, delay_s=0.0, fail_rate=0.0):
+        super().__init__(address, _Handler)
+        self.delay_s = delay_s
+        self.fail_rate = fail_rate
+        self.requests = 0
+        self.locations = 0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path != FORECAST_PATH:
+            self.send_error(404)
+            return
+        q = parse_qs(url.query)
+        try:
+            lats = [float(v) for v in q["latitude"][0].split(",")]
+            lons = [float(v) for v in q["longitude"][0].split(",")]
+        except (KeyError, ValueError):
+            self._json({"error": True, "reason": "latitude and longitude must be numbers or lists"}, 400)
+            return
+        if len(lats) != len(lons) or len(lats) > MAX_LOCATIONS:
+            self._json({"error": True, "reason": f"need matching lists of at most {MAX_LOCATIONS} locations"}, 400)
+            return
+        self.server.requests += 1
+        self.server.locations += len(lats)
+        if self.server.delay_s:
+            time.sleep(self.server.delay_s)
+        if random.random() < self.server.fail_rate:
+            self.send_error(500)
+            return
+        results = [forecast(lat, lon) for lat, lon in zip(lats, lons)]
+        self._json(results[0] if len(results) == 1 else results)
+
+    def _json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start(port=0, delay_s=0.0, fail_rate=0.0):
+    """Start the stub in a background thread; returns (server, forecast_url). port=0 picks a free port."""
+    server = StubServer(("127.0.0.1", port), delay_s, fail_rate)
+    threading.Thread(target=server.serve_forever, name="weather-stub", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}{FORECAST_PATH}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Open-Meteo forecast endpoint stand-in.")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds to wait before answering")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with 500")
+    args = parser.parse_args()
+    server = StubServer(("0.0.0.0", args.port), args.delay, args.fail_rate)
+    print(f"Open-Meteo stub listening on http://localhost:{args.port}{FORECAST_PATH}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()